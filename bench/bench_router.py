@@ -0,0 +1,288 @@
+"""
+Benchmarks the router against a simulated fleet of stub Infernet nodes, offline.
+
+For each fleet size, reports:
+    - refresh: time from startup until every reachable node is available, and the
+      sustained probe rate
+    - memory: traced memory of the routing state per available node
+    - get_nodes: in-process node selection latency
+    - REST: `/api/v1/ips` throughput and tail latency, from a separate load process
+
+Usage:
+    python3.11 bench/bench_router.py --nodes 100,1000,10000,50000
+
+The router reads its configuration from the environment as usual. Rate limiting
+and the per-host connection limit (all stub nodes share a few ports) are lifted by
+default, unless set explicitly.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import sys
+import tracemalloc
+from dataclasses import asdict, dataclass
+from multiprocessing.queues import Queue
+from os import environ, path
+from time import monotonic, perf_counter
+from typing import Optional
+
+environ.setdefault("RATELIMIT_REQS_PER_MIN", "1000000000")
+environ.setdefault("PROBE_MAX_CONNECTIONS_PER_HOST", "0")
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+from aiohttp import ClientSession, TCPConnector  # noqa: E402
+from fleet import FleetConfig, build_fleet, run_fleet  # noqa: E402
+
+from metrics import PROBES  # noqa: E402
+from monitor import NodeMonitor  # noqa: E402
+from rest import RESTServer  # noqa: E402
+
+
+@dataclass
+class Result:
+    """Benchmark results for one fleet size"""
+
+    nodes: int
+    reachable: int
+    available: int
+    refresh_seconds: float
+    probes_per_second: float
+    bytes_per_node: float
+    get_nodes_p50_us: float
+    get_nodes_p99_us: float
+    rest_rps: float
+    rest_p50_ms: float
+    rest_p99_ms: float
+    rest_errors: int
+
+
+def percentile(samples: list[float], q: float) -> float:
+    """Returns the `q`-th percentile (0-100) of `samples`"""
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+def queries(config: FleetConfig, count: int, seed: int) -> list[list[str]]:
+    """Returns container queries, weighted like the fleet's container popularity"""
+    rng = random.Random(seed)
+    ids = config.container_ids()
+    weights = [1 / (rank + 1) for rank in range(len(ids))]
+    return [
+        sorted(set(rng.choices(ids, weights=weights, k=rng.choice((1, 1, 1, 2)))))
+        for _ in range(count)
+    ]
+
+
+async def load(
+    url: str, paths: list[str], concurrency: int, duration: float
+) -> tuple[int, int, list[float]]:
+    """Issues requests from `concurrency` clients for `duration` seconds
+
+    Returns:
+        tuple[int, int, list[float]]: Completed requests, errors, and latencies
+    """
+    latencies: list[float] = []
+    errors = 0
+    deadline = monotonic() + duration
+
+    async with ClientSession(connector=TCPConnector(limit=concurrency)) as session:
+
+        async def client(offset: int) -> None:
+            nonlocal errors
+            i = offset
+            while monotonic() < deadline:
+                started = perf_counter()
+                try:
+                    async with session.get(url + paths[i % len(paths)]) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                except Exception:
+                    errors += 1
+                latencies.append(perf_counter() - started)
+                i += concurrency
+
+        await asyncio.gather(*(client(i) for i in range(concurrency)))
+
+    return len(latencies), errors, latencies
+
+
+def run_load(
+    url: str,
+    paths: list[str],
+    concurrency: int,
+    duration: float,
+    results: Queue[tuple[int, int, list[float]]],
+) -> None:
+    """Process entry point for `load`"""
+    results.put(asyncio.run(load(url, paths, concurrency, duration)))
+
+
+async def bench(config: FleetConfig, args: argparse.Namespace) -> Result:
+    """Runs all benchmarks against one stub fleet, which must already be serving"""
+    fleet = build_fleet(config)
+    reachable = sum(not node["dead"] for node in fleet)
+
+    # Refresh: discover the fleet through the explorer, and probe until every
+    # reachable node is available
+    environ["API_URL"] = config.explorer_url
+    monitor = NodeMonitor([])
+    probes = PROBES.value
+    started = monotonic()
+    task = asyncio.create_task(monitor.run_forever())
+
+    available = 0
+    while monotonic() - started < args.refresh_timeout:
+        await asyncio.sleep(0.25)
+        available = len(monitor.export_table())
+        if available >= reachable:
+            break
+    refresh_seconds = monotonic() - started
+    probes_per_second = (PROBES.value - probes) / refresh_seconds
+
+    # Memory: routing state for the same nodes, traced from empty
+    table = monitor.export_table()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    mirror = NodeMonitor([])
+    mirror.load_table(table)
+    mirror.snapshot()
+    bytes_per_node = (tracemalloc.get_traced_memory()[0] - baseline) / max(
+        1, len(table)
+    )
+    tracemalloc.stop()
+    del mirror
+
+    # get_nodes: in-process selection latency
+    timings = []
+    for containers in queries(config, args.get_nodes_samples, config.seed):
+        t0 = perf_counter()
+        monitor.get_nodes(containers)
+        timings.append(perf_counter() - t0)
+
+    # REST: throughput and tail latency, while the monitor keeps probing
+    server = RESTServer(str(args.rest_port), monitor)
+    server_task = asyncio.create_task(server.run_forever())
+    await asyncio.sleep(1)
+
+    paths = [
+        "/api/v1/ips?" + "&".join(f"container={c}" for c in containers)
+        for containers in queries(config, 1000, config.seed + 1)
+    ]
+    context = multiprocessing.get_context("spawn")
+    results: Queue[tuple[int, int, list[float]]] = context.Queue()
+    generator = context.Process(
+        target=run_load,
+        args=(
+            f"http://127.0.0.1:{args.rest_port}",
+            paths,
+            args.concurrency,
+            args.duration,
+            results,
+        ),
+    )
+    generator.start()
+    completed, errors, latencies = await asyncio.get_running_loop().run_in_executor(
+        None, results.get
+    )
+    generator.join()
+
+    await server.stop()
+    await server_task
+    await monitor.stop()
+    task.cancel()
+
+    return Result(
+        nodes=config.nodes,
+        reachable=reachable,
+        available=available,
+        refresh_seconds=refresh_seconds,
+        probes_per_second=probes_per_second,
+        bytes_per_node=bytes_per_node,
+        get_nodes_p50_us=percentile(timings, 50) * 1e6,
+        get_nodes_p99_us=percentile(timings, 99) * 1e6,
+        rest_rps=completed / args.duration,
+        rest_p50_ms=percentile(latencies, 50) * 1e3,
+        rest_p99_ms=percentile(latencies, 99) * 1e3,
+        rest_errors=errors,
+    )
+
+
+def report(results: list[Result]) -> str:
+    """Formats results as a table"""
+    columns = (
+        ("nodes", "nodes", "{:d}"),
+        ("avail", "available", "{:d}"),
+        ("refresh s", "refresh_seconds", "{:.2f}"),
+        ("probes/s", "probes_per_second", "{:.0f}"),
+        ("B/node", "bytes_per_node", "{:.0f}"),
+        ("get p50 us", "get_nodes_p50_us", "{:.1f}"),
+        ("get p99 us", "get_nodes_p99_us", "{:.1f}"),
+        ("REST rps", "rest_rps", "{:.0f}"),
+        ("REST p50 ms", "rest_p50_ms", "{:.2f}"),
+        ("REST p99 ms", "rest_p99_ms", "{:.2f}"),
+        ("errors", "rest_errors", "{:d}"),
+    )
+    rows = [[title for title, _, _ in columns]] + [
+        [fmt.format(getattr(result, field)) for _, field, fmt in columns]
+        for result in results
+    ]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join(
+        "  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows
+    )
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", default="100,1000,10000,50000")
+    parser.add_argument("--containers", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    parser.add_argument("--max-pending", type=int, default=10)
+    parser.add_argument("--base-port", type=int, default=19000)
+    parser.add_argument("--rest-port", type=int, default=18000)
+    parser.add_argument("--refresh-timeout", type=float, default=600)
+    parser.add_argument("--get-nodes-samples", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--json", help="Also write results to this file")
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for nodes in map(int, args.nodes.split(",")):
+        config = FleetConfig(
+            nodes=nodes,
+            containers=args.containers,
+            max_pending=args.max_pending,
+            latency_ms=args.latency_ms,
+            failure_rate=args.failure_rate,
+            base_port=args.base_port,
+        )
+        ready, stop = context.Event(), context.Event()
+        stubs = context.Process(target=run_fleet, args=(config, ready, stop))
+        stubs.start()
+        ready.wait()
+        try:
+            results.append(asyncio.run(bench(config, args)))
+        finally:
+            stop.set()
+            stubs.join()
+        print(report(results[-1:]), file=sys.stderr)
+
+    print(report(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
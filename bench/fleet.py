@@ -0,0 +1,171 @@
+"""
+Simulated fleet of Infernet nodes and a Node Explorer API, for benchmarking the
+router offline.
+
+All stub nodes of a fleet are served by a handful of aiohttp servers, each node
+under its own path prefix: node `i` is reachable as host `127.0.0.1:<port>/n/<i>`,
+so the router probes it at `http://127.0.0.1:<port>/n/<i>/info`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+from dataclasses import dataclass
+from multiprocessing.synchronize import Event as EventType
+from typing import Any
+
+from aiohttp import web
+
+
+@dataclass
+class FleetConfig:
+    """Stub fleet parameters
+
+    Attributes:
+        nodes (int): Number of stub nodes
+        containers (int): Number of distinct containers across the fleet.
+            Container popularity follows a Zipf-like distribution
+        containers_per_node (int): Maximum number of containers per node
+        max_pending (int): Pending job counts are uniform in [0, max_pending]
+        latency_ms (float): Median `/info` latency, log-normally distributed
+        failure_rate (float): Fraction of nodes that never answer (probes time out)
+        ports (int): Number of servers to spread nodes over
+        base_port (int): First server port. The explorer API is served on the port
+            after the last node server
+        seed (int): Random seed
+    """
+
+    nodes: int = 1000
+    containers: int = 50
+    containers_per_node: int = 5
+    max_pending: int = 10
+    latency_ms: float = 20
+    failure_rate: float = 0.05
+    ports: int = 8
+    base_port: int = 19000
+    seed: int = 0
+
+    @property
+    def explorer_url(self: FleetConfig) -> str:
+        return f"http://127.0.0.1:{self.base_port + self.ports}"
+
+    def host(self: FleetConfig, i: int) -> str:
+        return f"127.0.0.1:{self.base_port + i % self.ports}/n/{i}"
+
+    def container_ids(self: FleetConfig) -> list[str]:
+        return [f"container-{c}" for c in range(self.containers)]
+
+
+def build_fleet(config: FleetConfig) -> list[dict[str, Any]]:
+    """Builds the stub nodes' static `/info` documents
+
+    Args:
+        config (FleetConfig): Fleet parameters
+
+    Returns:
+        list[dict[str, Any]]: `containers` and `dead` flag per node
+    """
+    rng = random.Random(config.seed)
+    ids = config.container_ids()
+    weights = [1 / (rank + 1) for rank in range(len(ids))]
+
+    fleet = []
+    for _ in range(config.nodes):
+        count = rng.randint(1, config.containers_per_node)
+        chosen = set(rng.choices(ids, weights=weights, k=count))
+        fleet.append(
+            {
+                "containers": [
+                    {
+                        "id": container,
+                        "image": f"ritualnetwork/{container}:latest",
+                        "description": f"Stub {container} service",
+                        "external": True,
+                    }
+                    for container in sorted(chosen)
+                ],
+                "dead": rng.random() < config.failure_rate,
+            }
+        )
+    return fleet
+
+
+async def serve_fleet(config: FleetConfig, ready: EventType, stop: EventType) -> None:
+    """Serves the stub fleet and explorer API until `stop` is set
+
+    Args:
+        config (FleetConfig): Fleet parameters
+        ready (EventType): Set once all servers are listening
+        stop (EventType): Stops serving once set
+    """
+    fleet = build_fleet(config)
+    rng = random.Random(config.seed + 1)
+    median = config.latency_ms / 1000
+
+    async def info(request: web.Request) -> web.Response:
+        node = fleet[int(request.match_info["i"])]
+        if node["dead"]:
+            # Never answer, the router's probe times out
+            await asyncio.sleep(3600)
+
+        await asyncio.sleep(rng.lognormvariate(0, 0.5) * median)
+        return web.json_response(
+            {
+                "version": "1.0.0",
+                "containers": node["containers"],
+                "pending": {
+                    "offchain": rng.randint(0, config.max_pending),
+                    "onchain": 0,
+                },
+                "chain": {"enabled": False},
+            }
+        )
+
+    async def health(request: web.Request) -> web.Response:
+        node = fleet[int(request.match_info["i"])]
+        if node["dead"]:
+            await asyncio.sleep(3600)
+
+        await asyncio.sleep(rng.lognormvariate(0, 0.5) * median)
+        return web.json_response({"status": "healthy"})
+
+    async def nodes(request: web.Request) -> web.Response:
+        # Explorer reports ip and port separately, the path prefix rides on the port
+        return web.json_response(
+            {
+                "data": [
+                    {"ip": host.split(":")[0], "port": host.split(":", 1)[1]}
+                    for host in map(config.host, range(config.nodes))
+                ]
+            }
+        )
+
+    runners = []
+    for port in range(config.ports):
+        app = web.Application()
+        app.router.add_get("/n/{i}/info", info)
+        app.router.add_get("/n/{i}/health", health)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", config.base_port + port).start()
+        runners.append(runner)
+
+    explorer = web.Application()
+    explorer.router.add_get("/api/nodes", nodes)
+    runner = web.AppRunner(explorer, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", config.base_port + config.ports).start()
+    runners.append(runner)
+
+    ready.set()
+    while not stop.is_set():
+        await asyncio.sleep(0.1)
+
+    for runner in runners:
+        await runner.cleanup()
+
+
+def run_fleet(config: FleetConfig, ready: EventType, stop: EventType) -> None:
+    """Process entry point for `serve_fleet`"""
+    asyncio.run(serve_fleet(config, ready, stop))
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from time import monotonic
+from typing import Hashable, Optional
+
+import configs
+from profiler import LoopMonitor
+
+# Period in seconds over which a client's rate limit is replenished
+RATELIMIT_PERIOD = 30.0
+
+# Seconds clients are asked to wait before retrying a shed request
+SHED_RETRY_AFTER = 1
+
+
+class RateLimiter:
+    """Per-client token buckets
+
+    Each client (key) may burst up to its limit, which is replenished continuously
+    over `RATELIMIT_PERIOD`. A bucket is two numbers (tokens left, last update),
+    and buckets of clients idle for a whole period, which would be full again, are
+    evicted, so state is bounded by the number of recently active clients. Both
+    requests and evictions take constant (amortized) time.
+
+    Private attributes:
+        _period (float): Period in seconds over which limits are replenished
+        _buckets (OrderedDict[Hashable, tuple[float, float]]): Key -> (tokens,
+            last update time), least recently updated first
+
+    Methods:
+        acquire: Take a token from a client's bucket
+    """
+
+    def __init__(self: RateLimiter, period: float = RATELIMIT_PERIOD) -> None:
+        """Initializes RateLimiter
+
+        Args:
+            period (float, optional): Period in seconds over which limits are
+                replenished. Defaults to RATELIMIT_PERIOD.
+        """
+        self._period = period
+        self._buckets: OrderedDict[Hashable, tuple[float, float]] = OrderedDict()
+
+    def __len__(self: RateLimiter) -> int:
+        return len(self._buckets)
+
+    def acquire(
+        self: RateLimiter, key: Hashable, limit: int, now: Optional[float] = None
+    ) -> float:
+        """Takes a token from a client's bucket, if it has one left
+
+        Args:
+            key (Hashable): Client key
+            limit (int): Client's limit per period, 0 for no limit
+            now (Optional[float], optional): Current monotonic time. Defaults to
+                `monotonic()`.
+
+        Returns:
+            float: 0 if a token was taken, else seconds until one is available
+        """
+        if limit <= 0:
+            return 0.0
+
+        now = monotonic() if now is None else now
+        while self._buckets:
+            oldest = next(iter(self._buckets))
+            if now - self._buckets[oldest][1] < self._period:
+                break
+            del self._buckets[oldest]
+
+        tokens, updated = self._buckets.pop(key, (float(limit), now))
+        tokens = min(float(limit), tokens + (now - updated) * limit / self._period)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            return 0.0
+
+        self._buckets[key] = (tokens, now)
+        return (1 - tokens) * self._period / limit
+
+
+class AdmissionControl:
+    """Sheds requests while the router is overloaded
+
+    Requests are admitted while fewer than `max_inflight` are being handled, and
+    while the event loop keeps up. Node probing shares the loop with request
+    handling, so once callbacks run more than `max_lag` seconds late, requests are
+    shed until the loop catches up, so that probes keep running on time.
+
+    Private attributes:
+        _max_inflight (Optional[int]): Maximum number of requests handled at once,
+            0 for no limit, None for `MAX_INFLIGHT_REQUESTS`
+        _max_lag (Optional[float]): Loop lag in seconds beyond which requests are
+            shed, 0 to disable, None for `MAX_LOOP_LAG`
+
+    Public attributes:
+        inflight (int): Number of requests being handled
+        loop (LoopMonitor): Event loop lag sampler
+
+    Methods:
+        admit: Admit a request, unless overloaded
+        release: Release an admitted request
+    """
+
+    def __init__(
+        self: AdmissionControl,
+        max_inflight: Optional[int] = None,
+        max_lag: Optional[float] = None,
+        loop: Optional[LoopMonitor] = None,
+    ) -> None:
+        """Initializes AdmissionControl
+
+        Args:
+            max_inflight (Optional[int], optional): Maximum number of requests
+                handled at once, 0 for no limit. Defaults to None, for (the current)
+                MAX_INFLIGHT_REQUESTS.
+            max_lag (Optional[float], optional): Loop lag in seconds beyond which
+                requests are shed, 0 to disable. Defaults to None, for (the current)
+                MAX_LOOP_LAG.
+            loop (Optional[LoopMonitor], optional): Event loop lag sampler, run by
+                the caller. Defaults to None, for a new one.
+        """
+        self._max_inflight = max_inflight
+        self._max_lag = max_lag
+        self.inflight = 0
+        self.loop = LoopMonitor() if loop is None else loop
+
+    def admit(self: AdmissionControl) -> bool:
+        """Admits a request, unless overloaded. Admitted requests must be released
+
+        Returns:
+            bool: Whether the request was admitted
+        """
+        max_inflight = (
+            configs.MAX_INFLIGHT_REQUESTS
+            if self._max_inflight is None
+            else self._max_inflight
+        )
+        max_lag = configs.MAX_LOOP_LAG if self._max_lag is None else self._max_lag
+        if 0 < max_inflight <= self.inflight:
+            return False
+        if 0 < max_lag < self.loop.lag:
+            return False
+        self.inflight += 1
+        return True
+
+    def release(self: AdmissionControl) -> None:
+        """Releases an admitted request"""
+        self.inflight -= 1
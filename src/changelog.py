@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from collections import deque
+from typing import Optional
+
+
+class ChangeLog:
+    """Bounded log of changed keys, numbered by a sequence number
+
+    Consumers remember the last sequence number they saw, and ask for the keys
+    changed since. Only the most recent `size` changes are retained: consumers
+    that fall further behind must resynchronize in full.
+
+    Private attributes:
+        _entries (deque[tuple[int, str]]): Retained (sequence number, key) changes,
+            oldest first
+
+    Public attributes:
+        seq (int): Sequence number of the latest change, 0 if none
+
+    Methods:
+        append: Record a changed key
+        since: Keys changed after a sequence number
+    """
+
+    def __init__(self: ChangeLog, size: int) -> None:
+        """Initializes ChangeLog
+
+        Args:
+            size (int): Number of changes retained
+        """
+        self._entries: deque[tuple[int, str]] = deque(maxlen=size)
+        self.seq = 0
+
+    def append(self: ChangeLog, key: str) -> int:
+        """Records a changed key
+
+        Args:
+            key (str): Changed key
+
+        Returns:
+            int: Sequence number of the change
+        """
+        self.seq += 1
+        self._entries.append((self.seq, key))
+        return self.seq
+
+    def since(self: ChangeLog, seq: int) -> Optional[list[str]]:
+        """Returns keys changed after sequence number `seq`
+
+        Args:
+            seq (int): Last sequence number seen by the consumer
+
+        Returns:
+            Optional[list[str]]: Distinct changed keys, most recently changed first.
+                None if changes after `seq` are no longer retained, or `seq` is
+                ahead of this log (e.g. it was issued by another process)
+        """
+        if seq > self.seq:
+            return None
+        if seq == self.seq:
+            return []
+        if not self._entries or self._entries[0][0] > seq + 1:
+            return None
+
+        keys: dict[str, None] = {}
+        for entry_seq, key in reversed(self._entries):
+            if entry_seq <= seq:
+                break
+            keys.setdefault(key)
+        return list(keys)
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from asyncio import sleep, to_thread
+from os import path as os_path
+from time import time
+from typing import Optional
+
+from configs import CHECKPOINT_INTERVAL, CHECKPOINT_MAX_AGE
+from logger import log
+from monitor import Hostname, NodeMonitor, NodeTable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    host TEXT PRIMARY KEY,
+    containers TEXT NOT NULL,
+    pending TEXT NOT NULL,
+    latency REAL NOT NULL,
+    last_seen REAL NOT NULL
+)
+"""
+
+
+def save_checkpoint(
+    path: str, table: NodeTable, last_seen: dict[Hostname, float]
+) -> None:
+    """Replaces the checkpoint at `path` with a node table, in one transaction
+
+    Args:
+        path (str): SQLite database path
+        table (NodeTable): Available nodes
+        last_seen (dict[Hostname, float]): Time each node last answered a probe
+    """
+    now = time()
+    connection = sqlite3.connect(path)
+    try:
+        with connection:
+            connection.execute(SCHEMA)
+            connection.execute("DELETE FROM nodes")
+            connection.executemany(
+                "INSERT INTO nodes VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        host,
+                        json.dumps(containers, separators=(",", ":")),
+                        json.dumps(pending, separators=(",", ":")),
+                        latency,
+                        last_seen.get(host, now),
+                    )
+                    for host, (containers, pending, latency, _) in table.items()
+                ),
+            )
+    finally:
+        connection.close()
+
+
+def load_checkpoint(
+    path: str, max_age: float = CHECKPOINT_MAX_AGE
+) -> tuple[NodeTable, dict[Hostname, float]]:
+    """Loads nodes seen within `max_age` seconds from the checkpoint at `path`
+
+    Args:
+        path (str): SQLite database path
+        max_age (float, optional): Maximum age in seconds of loaded nodes. Defaults
+            to CHECKPOINT_MAX_AGE.
+
+    Returns:
+        tuple[NodeTable, dict[Hostname, float]]: Nodes, and the time each of them
+            last answered a probe. Empty if there is no (readable) checkpoint
+    """
+    if not os_path.exists(path):
+        return {}, {}
+
+    try:
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = connection.execute(
+                "SELECT host, containers, pending, latency, last_seen FROM nodes "
+                "WHERE last_seen >= ?",
+                (time() - max_age,),
+            ).fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        log.warning(f"Failed to load checkpoint from {path}: {str(e)}")
+        return {}, {}
+
+    table: NodeTable = {}
+    last_seen: dict[Hostname, float] = {}
+    for host, containers, pending, latency, seen in rows:
+        # Labels are not checkpointed, they come with ips.txt and discovery again
+        table[host] = (json.loads(containers), json.loads(pending), latency, {})
+        last_seen[host] = seen
+    return table, last_seen
+
+
+class Checkpointer:
+    """Checkpoints a NodeMonitor's node table to a SQLite file whenever it changes,
+    at most every `CHECKPOINT_INTERVAL` seconds, and once more on shutdown"""
+
+    def __init__(self: Checkpointer, monitor: NodeMonitor, path: str) -> None:
+        """Initializes Checkpointer
+
+        Args:
+            monitor (NodeMonitor): Node monitor owning the node state
+            path (str): SQLite database path
+        """
+        self._monitor = monitor
+        self._path = path
+        self._version: Optional[int] = None
+        self._shutdown = False
+
+    async def _save(self: Checkpointer) -> None:
+        """Writes a checkpoint if node state changed since the last one"""
+        version = self._monitor.snapshot().version
+        if version == self._version:
+            return
+
+        try:
+            # Tables are exported on the event loop, and written off it
+            await to_thread(
+                save_checkpoint,
+                self._path,
+                self._monitor.export_table(),
+                self._monitor.last_seen(),
+            )
+            self._version = version
+        except sqlite3.Error as e:
+            log.error(f"Failed to write checkpoint to {self._path}: {str(e)}")
+
+    async def run_forever(self: Checkpointer) -> None:
+        """Main lifecycle loop"""
+        while not self._shutdown:
+            await sleep(CHECKPOINT_INTERVAL)
+            await self._save()
+
+    async def stop(self: Checkpointer) -> None:
+        """Stop checkpointer, writing a final checkpoint"""
+        self._shutdown = True
+        await self._save()
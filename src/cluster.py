@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+from asyncio import gather, sleep
+from bisect import bisect
+from dataclasses import dataclass, field
+from hashlib import blake2b
+from secrets import token_hex
+from time import monotonic
+from typing import Any, Optional
+
+from aiohttp import ClientSession, ClientTimeout
+
+from configs import CLUSTER_PEER_TIMEOUT, CLUSTER_SYNC_INTERVAL
+from logger import log
+from monitor import Hostname, NodeDelta, NodeMonitor
+
+# Points per member on the hash ring. More points spread shards more evenly
+RING_POINTS = 64
+
+# Timeout of state requests to peers
+PEER_TIMEOUT = ClientTimeout(total=3)
+
+
+def parse_state(state: Any) -> tuple[str, int, bool, NodeDelta]:
+    """Validates a peer's state response, see `Cluster.state`
+
+    Args:
+        state (Any): Decoded response body
+
+    Returns:
+        tuple[str, int, bool, NodeDelta]: Epoch, sequence number, whether the state
+            is full, and changed nodes
+
+    Raises:
+        ValueError: If the response is malformed
+    """
+    if not isinstance(state, dict):
+        raise ValueError("Expected an object")
+    epoch, seq, full, nodes = (
+        state.get(key) for key in ("epoch", "seq", "full", "nodes")
+    )
+    if not (
+        isinstance(epoch, str)
+        and isinstance(seq, int)
+        and isinstance(full, bool)
+        and isinstance(nodes, dict)
+    ):
+        raise ValueError("Expected epoch, seq, full and nodes")
+
+    delta: NodeDelta = {}
+    for host, entry in nodes.items():
+        if entry is None:
+            delta[host] = None
+            continue
+        if not (isinstance(entry, (list, tuple)) and len(entry) == 4):
+            raise ValueError(f"Malformed entry for {host}")
+        containers, pending, latency, labels = entry
+        if not (
+            isinstance(containers, (list, tuple))
+            and all(
+                isinstance(container, dict) and isinstance(container.get("id"), str)
+                for container in containers
+            )
+            and isinstance(pending, dict)
+            and all(isinstance(count, int) for count in pending.values())
+            and isinstance(latency, (int, float))
+            and isinstance(labels, dict)
+            and all(isinstance(value, str) for value in labels.values())
+        ):
+            raise ValueError(f"Malformed entry for {host}")
+        delta[host] = (list(containers), pending, float(latency), labels)
+    return epoch, seq, full, delta
+
+
+def ring_hash(key: str) -> int:
+    """Stable 64-bit hash of a key, identical across processes and hosts"""
+    return int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring, assigning keys to members
+
+    Adding or removing a member only reassigns the keys of that member.
+
+    Private attributes:
+        _points (list[int]): Sorted hashes of member points
+        _owners (list[str]): Member owning each point
+
+    Methods:
+        owner: Member a key is assigned to
+    """
+
+    def __init__(self: HashRing, members: list[str]) -> None:
+        """Initializes HashRing
+
+        Args:
+            members (list[str]): Ring members
+        """
+        ring = sorted(
+            (ring_hash(f"{member}#{i}"), member)
+            for member in members
+            for i in range(RING_POINTS)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [member for _, member in ring]
+
+    def owner(self: HashRing, key: str) -> str:
+        """Returns the member a key is assigned to: the owner of the first point
+        after the key's hash, wrapping around
+
+        Args:
+            key (str): Key
+
+        Returns:
+            str: Member
+        """
+        return self._owners[bisect(self._points, ring_hash(key)) % len(self._points)]
+
+
+@dataclass
+class PeerState:
+    """Synchronization state of a peer
+
+    Attributes:
+        epoch (Optional[str]): Peer's process epoch, None before the first sync
+        seq (int): Last change sequence number received from the peer
+        hosts (set[Hostname]): Available nodes last reported by the peer
+        last_sync (float): Time of the last successful sync
+    """
+
+    epoch: Optional[str] = None
+    seq: int = 0
+    hosts: set[Hostname] = field(default_factory=set)
+    last_sync: float = field(default_factory=monotonic)
+
+
+class Cluster:
+    """Shards node probing across peer routers, and merges their observations
+
+    Tracked nodes are split between live peers by consistent hashing. This router
+    only probes its own shard, and polls every peer for the nodes in theirs, every
+    `CLUSTER_SYNC_INTERVAL` seconds: first in full, then as deltas since the last
+    change sequence number received. Peers that haven't answered for
+    `CLUSTER_PEER_TIMEOUT` seconds are dropped from the ring, so that their shards
+    are taken over by the remaining peers, until they answer again.
+
+    Private attributes:
+        _monitor (NodeMonitor): Node monitor probing this router's shard
+        _self_url (str): This router's URL, as configured on its peers
+        _peers (dict[str, PeerState]): Peer URL -> synchronization state
+        _live (frozenset[str]): Peers currently in the ring
+        _ring (HashRing): Ring over this router and its live peers
+        _epoch (str): Random ID of this process, so that peers can tell a restart
+            (and reset change sequence numbers) apart
+        _session (Optional[ClientSession]): HTTP client for peer requests
+        _shutdown (bool): Shutdown flag
+
+    Methods:
+        owns: Whether this router probes a node
+        state: State response for a peer
+        run_forever: Main lifecycle loop
+        stop: Stop synchronizing
+    """
+
+    def __init__(
+        self: Cluster, monitor: NodeMonitor, self_url: str, peers: list[str]
+    ) -> None:
+        """Initializes Cluster, assuming all peers are live until proven otherwise
+
+        Args:
+            monitor (NodeMonitor): Node monitor probing this router's shard
+            self_url (str): This router's URL, as configured on its peers
+            peers (list[str]): Peer URLs. This router's own URL is ignored
+        """
+        self._monitor = monitor
+        self._self_url = self_url
+        self._peers = {peer: PeerState() for peer in peers if peer != self_url}
+        self._live = frozenset(self._peers)
+        self._ring = HashRing([self_url, *self._live])
+        self._epoch = token_hex(8)
+        self._session: Optional[ClientSession] = None
+        self._shutdown = False
+
+        monitor.set_shard(self.owns)
+
+    def owns(self: Cluster, host: Hostname) -> bool:
+        """Whether this router probes a node
+
+        Args:
+            host (Hostname): Node hostname or IP
+
+        Returns:
+            bool: Whether the node is in this router's shard
+        """
+        return self._ring.owner(host) == self._self_url
+
+    def state(
+        self: Cluster, since: Optional[int] = None, epoch: Optional[str] = None
+    ) -> dict[str, Any]:
+        """Returns the state of this router's shard for a peer: nodes changed since
+        the peer's last sync, or all of them if the peer is new, this process
+        restarted, or the changes are no longer retained
+
+        Args:
+            since (Optional[int], optional): Last change sequence number the peer
+                received. Defaults to None.
+            epoch (Optional[str], optional): Epoch `since` was received in.
+                Defaults to None.
+
+        Returns:
+            dict[str, Any]: `epoch`, `seq`, whether the state is `full`, and
+                changed `nodes` (null if no longer available)
+        """
+        seq, delta, full = self._monitor.export_changes(
+            since if epoch == self._epoch else None
+        )
+        return {
+            "epoch": self._epoch,
+            "seq": seq,
+            "full": full,
+            "nodes": {host: entry for host, entry in delta.items() if self.owns(host)},
+        }
+
+    def _apply(self: Cluster, peer: str, state: Any) -> None:
+        """Applies a peer's state response
+
+        Args:
+            peer (str): Peer URL
+            state (Any): Peer's response, see `state`
+
+        Raises:
+            ValueError: If the response is malformed, before applying any of it
+        """
+        epoch, seq, full, delta = parse_state(state)
+        peer_state = self._peers[peer]
+        if full:
+            # Nodes missing from a full state are gone, unless the peer only
+            # stopped reporting them because they moved to another shard
+            for host in peer_state.hosts - delta.keys():
+                if self._ring.owner(host) == peer:
+                    delta[host] = None
+            peer_state.hosts = set()
+
+        for host, entry in delta.items():
+            if entry is None:
+                peer_state.hosts.discard(host)
+            else:
+                peer_state.hosts.add(host)
+
+        # This router's own probes take precedence in its shard
+        self._monitor.apply_remote(
+            {host: entry for host, entry in delta.items() if not self.owns(host)}
+        )
+        peer_state.epoch = epoch
+        peer_state.seq = seq
+
+    async def _sync(self: Cluster, peer: str) -> None:
+        """Fetches and applies a peer's state, since its last sync
+
+        Args:
+            peer (str): Peer URL
+        """
+        if self._session is None:
+            self._session = ClientSession(timeout=PEER_TIMEOUT)
+
+        peer_state = self._peers[peer]
+        params = {}
+        if peer_state.epoch is not None:
+            params = {"since": str(peer_state.seq), "epoch": peer_state.epoch}
+
+        try:
+            async with self._session.get(
+                f"{peer}/api/v1/cluster/state", params=params
+            ) as response:
+                if response.status != 200:
+                    log.warning("Peer sync failed", peer=peer, status=response.status)
+                    return
+                state = await response.json()
+        except Exception as e:
+            log.warning("Peer sync failed", peer=peer, error=str(e))
+            return
+
+        try:
+            self._apply(peer, state)
+        except ValueError as e:
+            log.warning("Peer sync failed", peer=peer, error=f"Invalid state: {e}")
+            return
+        peer_state.last_sync = monotonic()
+
+    def _update_ring(self: Cluster) -> None:
+        """Rebuilds the ring if peers went down or came back, reassigning shards"""
+        now = monotonic()
+        live = frozenset(
+            peer
+            for peer, peer_state in self._peers.items()
+            if now - peer_state.last_sync < CLUSTER_PEER_TIMEOUT
+        )
+        if live == self._live:
+            return
+
+        log.warning(
+            "Cluster membership changed",
+            down=sorted(self._live - live),
+            up=sorted(live - self._live),
+        )
+        self._live = live
+        self._ring = HashRing([self._self_url, *live])
+        self._monitor.set_shard(self.owns)
+
+    async def _sync_forever(self: Cluster, peer: str) -> None:
+        """Syncs with a peer every `CLUSTER_SYNC_INTERVAL` seconds, independently of
+        other (possibly unresponsive) peers
+
+        Args:
+            peer (str): Peer URL
+        """
+        while not self._shutdown:
+            await self._sync(peer)
+            self._update_ring()
+            await sleep(CLUSTER_SYNC_INTERVAL)
+
+    async def run_forever(self: Cluster) -> None:
+        """Main lifecycle loop"""
+        log.info("Joined cluster", url=self._self_url, peers=sorted(self._peers))
+        await gather(*(self._sync_forever(peer) for peer in self._peers))
+
+    async def stop(self: Cluster) -> None:
+        """Stop synchronizing with peers"""
+        self._shutdown = True
+        if self._session is not None:
+            await self._session.close()
@@ -1,7 +1,230 @@
 from os import environ
 
+from dotenv import load_dotenv
+
+# Settings not set in the environment are read from the config file (CONFIG_PATH),
+# before any is parsed
+load_dotenv(environ.get("CONFIG_PATH", ".env") or None)
+
 # Interval to poll nodes for availability
 REFRESH_INTERVAL = float(environ.get("REFRESH_INTERVAL", 30))
 
+# Interval to fetch live nodes from the explorer API
+DISCOVERY_INTERVAL = float(environ.get("DISCOVERY_INTERVAL", REFRESH_INTERVAL))
+
 # Rate limit for REST API in requests per minute
 RATELIMIT_REQS_PER_MIN = int(environ.get("RATELIMIT_REQS_PER_MIN", 10))
+
+# Rate limit tiers, as comma-separated name=requests per minute pairs, e.g.
+# "partner=600,internal=0" (0 for no limit)
+RATELIMIT_TIERS = {
+    tier.strip(): int(limit)
+    for tier, limit in (
+        pair.split("=", 1)
+        for pair in environ.get("RATELIMIT_TIERS", "").split(",")
+        if "=" in pair
+    )
+}
+
+# API keys (sent in the X-API-Key header) and their rate limit tier, as
+# comma-separated key=tier pairs. Requests without a known key are limited per
+# client address at RATELIMIT_REQS_PER_MIN
+API_KEYS = {
+    key.strip(): tier.strip()
+    for key, tier in (
+        pair.split("=", 1)
+        for pair in environ.get("API_KEYS", "").split(",")
+        if "=" in pair
+    )
+}
+
+# Number of reverse proxies in front of the router, whose X-Forwarded-For entries
+# are trusted to identify clients (0 to identify clients by their socket address)
+TRUSTED_PROXY_HOPS = int(environ.get("TRUSTED_PROXY_HOPS", 0))
+
+# Maximum number of requests handled at once per REST process. Requests beyond it
+# are shed with 503 (0 for no limit)
+MAX_INFLIGHT_REQUESTS = int(environ.get("MAX_INFLIGHT_REQUESTS", 256))
+
+# Event loop lag in seconds beyond which requests are shed, so that node probes keep
+# running on time (0 to disable)
+MAX_LOOP_LAG = float(environ.get("MAX_LOOP_LAG", 0.5))
+
+# Maximum number of concurrent connections used to probe nodes (0 for no limit)
+PROBE_MAX_CONNECTIONS = int(environ.get("PROBE_MAX_CONNECTIONS", 500))
+
+# Maximum number of concurrent connections to a single host (0 for no limit)
+PROBE_MAX_CONNECTIONS_PER_HOST = int(environ.get("PROBE_MAX_CONNECTIONS_PER_HOST", 2))
+
+# Time-to-live of cached DNS resolutions in seconds
+DNS_CACHE_TTL = int(environ.get("DNS_CACHE_TTL", 300))
+
+# Global probe budget in probes per second (0 for no limit)
+PROBE_RATE = float(environ.get("PROBE_RATE", 200))
+
+# Shortest interval in seconds between probes of a single (busy) node
+MIN_PROBE_INTERVAL = float(environ.get("MIN_PROBE_INTERVAL", 5))
+
+# Longest interval in seconds between probes of a single (unreachable) node
+MAX_PROBE_BACKOFF = float(environ.get("MAX_PROBE_BACKOFF", 300))
+
+# Number of probes of an idle node per full /info fetch. Probes in between only
+# check its liveness via /health (1 to always fetch /info)
+FULL_PROBE_EVERY = int(environ.get("FULL_PROBE_EVERY", 5))
+
+# Number of REST worker processes. Above 1, a single poller process publishes node
+# state to the workers through shared memory
+WORKERS = int(environ.get("WORKERS", 1))
+
+# Size in bytes of the shared memory segment holding the node table
+SHARED_MEMORY_SIZE = int(environ.get("SHARED_MEMORY_SIZE", 32 * 1024 * 1024))
+
+# Interval in seconds at which node state is published to / read by REST workers
+SHARED_STATE_INTERVAL = float(environ.get("SHARED_STATE_INTERVAL", 0.5))
+
+# Half-life in seconds of provisional (in-flight) jobs counted against nodes returned
+# by /api/v1/ips, until their next probe (0 to disable)
+INFLIGHT_HALF_LIFE = float(environ.get("INFLIGHT_HALF_LIFE", 15))
+
+# Default node selection strategy: "least" (least busy first), "p2c" (power of two
+# choices) or "weighted" (random, weighted by inverse load)
+ROUTING_STRATEGY = environ.get("ROUTING_STRATEGY", "least")
+
+# Default node ranking mode: "pending" (pending job count) or "latency" (expected
+# completion time, combining pending job count and observed probe latency)
+RANKING_MODE = environ.get("RANKING_MODE", "pending")
+
+# Lifetime in seconds of node rankings cached for cursor pagination of /api/v1/ips
+CURSOR_TTL = float(environ.get("CURSOR_TTL", 60))
+
+# Maximum number of node rankings cached for cursor pagination
+CURSOR_CACHE_SIZE = int(environ.get("CURSOR_CACHE_SIZE", 128))
+
+# Interval in seconds at which node table changes are streamed to subscribers
+SUBSCRIBE_INTERVAL = float(environ.get("SUBSCRIBE_INTERVAL", 0.5))
+
+# Interval in seconds at which idle subscriptions are sent keep-alive comments
+SUBSCRIBE_KEEPALIVE = float(environ.get("SUBSCRIBE_KEEPALIVE", 15))
+
+# Maximum number of node table subscribers per REST process (0 for no limit)
+MAX_SUBSCRIBERS = int(environ.get("MAX_SUBSCRIBERS", 1000))
+
+# Path of the SQLite file node state is checkpointed to, and restored from on startup
+# (empty to disable)
+CHECKPOINT_PATH = environ.get("CHECKPOINT_PATH", "")
+
+# Interval in seconds at which node state is checkpointed, if it changed
+CHECKPOINT_INTERVAL = float(environ.get("CHECKPOINT_INTERVAL", 30))
+
+# Maximum age in seconds of checkpointed nodes restored on startup
+CHECKPOINT_MAX_AGE = float(environ.get("CHECKPOINT_MAX_AGE", 3600))
+
+# Maximum number of log records queued for the background log writer. Records beyond
+# it are dropped (and counted)
+LOG_QUEUE_SIZE = int(environ.get("LOG_QUEUE_SIZE", 10000))
+
+# Interval in seconds over which repeated per-node log events are summarized
+LOG_SUMMARY_INTERVAL = float(environ.get("LOG_SUMMARY_INTERVAL", 10))
+
+# Number of repeated per-node log events logged individually per summary interval
+LOG_SAMPLE_SIZE = int(environ.get("LOG_SAMPLE_SIZE", 5))
+
+# Distinct clients reporting failures (POST /api/v1/feedback) within EJECT_WINDOW
+# seconds that eject a node from routing (0 to disable)
+EJECT_THRESHOLD = int(environ.get("EJECT_THRESHOLD", 3))
+
+# Window in seconds over which failure reports are counted
+EJECT_WINDOW = float(environ.get("EJECT_WINDOW", 30))
+
+# Time in seconds after which an ejected node is probed, and re-admitted if it answers
+EJECT_COOLDOWN = float(environ.get("EJECT_COOLDOWN", 15))
+
+# Number of node changes retained for peers and subscribers to catch up on, before
+# they must resynchronize in full
+CHANGELOG_SIZE = int(environ.get("CHANGELOG_SIZE", 65536))
+
+# Base URLs of all routers in the cluster, comma-separated (empty to run standalone).
+# Routers split node probing between them, and exchange their observations
+CLUSTER_PEERS = [url for url in environ.get("CLUSTER_PEERS", "").split(",") if url]
+
+# This router's own base URL, as listed in CLUSTER_PEERS
+CLUSTER_SELF = environ.get("CLUSTER_SELF", "")
+
+# Interval in seconds at which node state is fetched from peers
+CLUSTER_SYNC_INTERVAL = float(environ.get("CLUSTER_SYNC_INTERVAL", 1))
+
+# Time in seconds after which an unresponsive peer's shard is taken over
+CLUSTER_PEER_TIMEOUT = float(environ.get("CLUSTER_PEER_TIMEOUT", 10))
+
+# Weights of pending jobs per container ID, as comma-separated id=weight pairs, e.g.
+# "llm=4,hello-world=0.5". Containers default to 1. Only applies to nodes reporting
+# pending jobs per container
+CONTAINER_WEIGHTS = {
+    container.strip(): float(weight)
+    for container, weight in (
+        pair.split("=", 1)
+        for pair in environ.get("CONTAINER_WEIGHTS", "").split(",")
+        if "=" in pair
+    )
+}
+
+# Client address prefixes and their region, as comma-separated cidr=region pairs,
+# e.g. "10.1.0.0/16=eu-west,10.2.0.0/16=us-east". Requests to /api/v1/ips that
+# don't specify preferred node labels prefer nodes labeled with the client's region
+REGION_CIDRS = {
+    cidr.strip(): region.strip()
+    for cidr, region in (
+        pair.split("=", 1)
+        for pair in environ.get("REGION_CIDRS", "").split(",")
+        if "=" in pair
+    )
+}
+
+# Queue depth (pending and in-flight jobs) up to which nodes with preferred labels
+# are ranked ahead of all others. Busier preferred nodes compete with other nodes
+# on equal terms, spilling jobs over to them
+SPILLOVER_DEPTH = float(environ.get("SPILLOVER_DEPTH", 2))
+
+# Path of the node list, one node per line, optionally followed by labels
+IPS_PATH = environ.get("IPS_PATH", "ips.txt")
+
+# Path of a config file (.env format), loaded above and watched for changes to the
+# settings in RELOADABLE, which are then applied without a restart (empty to
+# disable watching)
+CONFIG_PATH = environ.get("CONFIG_PATH", ".env")
+
+# Interval in seconds at which IPS_PATH and CONFIG_PATH are checked for changes (0
+# to disable)
+RELOAD_INTERVAL = float(environ.get("RELOAD_INTERVAL", 5))
+
+# Time in seconds the event loop may be blocked by a callback before the callback's
+# stack is logged (0 to disable)
+SLOW_CALLBACK_THRESHOLD = float(environ.get("SLOW_CALLBACK_THRESHOLD", 0.25))
+
+# API keys (sent in the X-API-Key header) allowed to use the admin endpoints,
+# comma-separated (empty to disable them)
+ADMIN_API_KEYS = [
+    key.strip() for key in environ.get("ADMIN_API_KEYS", "").split(",") if key.strip()
+]
+
+# Settings re-read when CONFIG_PATH changes. Components read these on use, rather
+# than at startup. Other settings require a restart
+RELOADABLE = (
+    "REFRESH_INTERVAL",
+    "DISCOVERY_INTERVAL",
+    "RATELIMIT_REQS_PER_MIN",
+    "RATELIMIT_TIERS",
+    "API_KEYS",
+    "MAX_INFLIGHT_REQUESTS",
+    "MAX_LOOP_LAG",
+    "PROBE_RATE",
+    "MIN_PROBE_INTERVAL",
+    "MAX_PROBE_BACKOFF",
+    "FULL_PROBE_EVERY",
+    "ROUTING_STRATEGY",
+    "RANKING_MODE",
+    "REGION_CIDRS",
+    "SPILLOVER_DEPTH",
+    "SLOW_CALLBACK_THRESHOLD",
+    "ADMIN_API_KEYS",
+)
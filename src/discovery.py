@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+from asyncio import Event, TimeoutError, wait_for
+from time import perf_counter
+from typing import Callable, Optional
+
+from aiohttp import ClientSession
+
+import configs
+from labels import Labels
+from logger import log
+from metrics import LIVE_REFRESH_SECONDS
+from sql import fetch_live_nodes
+
+
+class Discovery:
+    """Discovers live nodes via the explorer API, on its own schedule
+
+    Runs alongside node probing rather than in its way: the live node list is
+    fetched every `DISCOVERY_INTERVAL` and, if it changed, handed to a callback
+    that applies the difference. Fetches are conditional when the explorer tags
+    its responses. If a fetch fails, the last known live nodes are kept.
+
+    Private attributes:
+        _api_url (str): URL of the explorer API
+        _session (Callable[[], ClientSession]): Returns the HTTP client to use
+        _on_change (Callable[[set[str], dict[str, Labels]], None]): Called with
+            the live nodes and their labels whenever they change
+        _interval (Optional[float]): Interval between fetches in seconds, None for
+            `DISCOVERY_INTERVAL`
+        _hosts (Optional[set[str]]): Live nodes as of the last successful fetch
+        _labels (dict[str, Labels]): Labels of live nodes as of the last successful
+            fetch
+        _etag (Optional[str]): Entity tag of the last successful fetch
+        _shutdown (Event): Set to stop discovery
+
+    Methods:
+        refresh: Fetch live nodes once
+        run_forever: Fetch live nodes every interval
+        stop: Stop discovery
+    """
+
+    def __init__(
+        self: Discovery,
+        api_url: str,
+        session: Callable[[], ClientSession],
+        on_change: Callable[[set[str], dict[str, Labels]], None],
+        interval: Optional[float] = None,
+    ) -> None:
+        """Initializes Discovery
+
+        Args:
+            api_url (str): URL of the explorer API
+            session (Callable[[], ClientSession]): Returns the HTTP client to use
+            on_change (Callable[[set[str], dict[str, Labels]], None]): Called
+                with the live nodes and their labels whenever they change
+            interval (Optional[float], optional): Interval between fetches in
+                seconds. Defaults to None, for (the current) DISCOVERY_INTERVAL.
+        """
+        self._api_url = api_url
+        self._session = session
+        self._on_change = on_change
+        self._interval = interval
+        self._hosts: Optional[set[str]] = None
+        self._labels: dict[str, Labels] = {}
+        self._etag: Optional[str] = None
+        self._shutdown = Event()
+
+    async def refresh(self: Discovery) -> bool:
+        """Fetches live nodes once, applying them if they changed
+
+        Returns:
+            bool: Whether the fetch succeeded
+        """
+        started = perf_counter()
+        result = await fetch_live_nodes(self._session(), self._api_url, self._etag)
+        if result is None:
+            if self._hosts is not None:
+                log.warning("Keeping last known live nodes", live=len(self._hosts))
+            return False
+
+        self._etag = result.etag
+        if result.hosts is not None and (
+            result.hosts != self._hosts or result.labels != self._labels
+        ):
+            previous = self._hosts or set()
+            self._hosts, self._labels = result.hosts, result.labels
+            self._on_change(result.hosts, result.labels)
+            log.debug(
+                "Refreshed live nodes",
+                live=len(result.hosts),
+                added=len(result.hosts - previous),
+                removed=len(previous - result.hosts),
+            )
+        LIVE_REFRESH_SECONDS.observe(perf_counter() - started)
+        return True
+
+    async def run_forever(self: Discovery) -> None:
+        """Fetches live nodes every interval, until stopped"""
+        while not self._shutdown.is_set():
+            await self.refresh()
+            try:
+                await wait_for(
+                    self._shutdown.wait(),
+                    timeout=(
+                        configs.DISCOVERY_INTERVAL
+                        if self._interval is None
+                        else self._interval
+                    ),
+                )
+            except TimeoutError:
+                pass
+
+    async def stop(self: Discovery) -> None:
+        """Stops discovery"""
+        self._shutdown.set()
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import json
+import sys
+from typing import Any, Hashable, Iterable, Optional
+
+# Interned objects are forgotten (and re-interned on next use) beyond this many
+INTERN_TABLE_SIZE = 65536
+
+# Interned container listing: (containers, container IDs, membership bitmap)
+ContainerSet = tuple[list[dict[str, Any]], list[str], int]
+
+
+def freeze(value: dict[str, Any]) -> Hashable:
+    """Returns a hashable key, equal for equal JSON objects"""
+    key = tuple(sorted(value.items()))
+    try:
+        hash(key)
+        return key
+    except TypeError:
+        # Nested, unhashable values
+        return json.dumps(value, sort_keys=True)
+
+
+class ContainerInterner:
+    """Deduplicates node state shared across many nodes
+
+    Fleets run the same few hundred containers on tens of thousands of nodes, so
+    equal container descriptions, container listings and pending job counts are
+    stored once, and shared by every node reporting them. Container membership is
+    also encoded as a bitmap over container IDs, one bit per ID ever seen.
+
+    Interned objects are shared, and must not be mutated.
+
+    Private attributes:
+        _size (int): Maximum number of interned objects per table
+        _containers (dict[Hashable, dict[str, Any]]): Interned container
+            descriptions
+        _sets (dict[tuple[int, ...], ContainerSet]): Interned container listings,
+            keyed by the identities of their (interned) descriptions
+        _pending (dict[Hashable, dict[str, int]]): Interned pending job counts
+        _bits (dict[str, int]): Container ID -> bit index
+
+    Methods:
+        intern_containers: Canonical container listing
+        intern_pending: Canonical pending job counts
+        mask: Bitmap of container IDs
+    """
+
+    def __init__(self: ContainerInterner, size: int = INTERN_TABLE_SIZE) -> None:
+        """Initializes ContainerInterner
+
+        Args:
+            size (int, optional): Maximum number of interned objects per table.
+                Defaults to INTERN_TABLE_SIZE.
+        """
+        self._size = size
+        self._containers: dict[Hashable, dict[str, Any]] = {}
+        self._sets: dict[tuple[int, ...], ContainerSet] = {}
+        self._pending: dict[Hashable, dict[str, int]] = {}
+        self._bits: dict[str, int] = {}
+
+    def _intern_container(
+        self: ContainerInterner, container: dict[str, Any]
+    ) -> dict[str, Any]:
+        """Returns the canonical copy of a container description"""
+        key = freeze(container)
+        interned = self._containers.get(key)
+        if interned is None:
+            interned = self._containers[key] = {
+                sys.intern(k): sys.intern(v) if isinstance(v, str) else v
+                for k, v in container.items()
+            }
+        return interned
+
+    def intern_containers(
+        self: ContainerInterner, containers: list[dict[str, Any]]
+    ) -> ContainerSet:
+        """Returns the canonical copy of a node's container listing
+
+        Args:
+            containers (list[dict[str, Any]]): Containers as reported by a node
+
+        Returns:
+            ContainerSet: Shared containers, their IDs and membership bitmap
+        """
+        if len(self._containers) >= self._size or len(self._sets) >= self._size:
+            # Listings are keyed by identities of interned descriptions, so both
+            # tables are reset together
+            self._containers.clear()
+            self._sets.clear()
+
+        interned = [self._intern_container(container) for container in containers]
+        key = tuple(map(id, interned))
+        container_set = self._sets.get(key)
+        if container_set is None:
+            ids = [container["id"] for container in interned]
+            container_set = self._sets[key] = (interned, ids, self._mask(ids))
+        return container_set
+
+    def intern_pending(
+        self: ContainerInterner, pending: dict[str, int]
+    ) -> dict[str, int]:
+        """Returns the canonical copy of a node's pending job counts
+
+        Args:
+            pending (dict[str, int]): Pending job counts as reported by a node
+
+        Returns:
+            dict[str, int]: Shared pending job counts
+        """
+        if len(self._pending) >= self._size:
+            self._pending.clear()
+
+        key = freeze(pending)
+        interned = self._pending.get(key)
+        if interned is None:
+            interned = self._pending[key] = {
+                sys.intern(k): v for k, v in pending.items()
+            }
+        return interned
+
+    def _mask(self: ContainerInterner, container_ids: Iterable[str]) -> int:
+        """Returns the bitmap of container IDs, assigning bits to new IDs"""
+        mask = 0
+        for container_id in container_ids:
+            bit = self._bits.get(container_id)
+            if bit is None:
+                bit = self._bits[container_id] = len(self._bits)
+            mask |= 1 << bit
+        return mask
+
+    def mask(self: ContainerInterner, container_ids: Iterable[str]) -> Optional[int]:
+        """Returns the bitmap of known container IDs
+
+        Args:
+            container_ids (Iterable[str]): Container IDs
+
+        Returns:
+            Optional[int]: Bitmap, or None if no node ever ran one of the containers
+        """
+        mask = 0
+        for container_id in container_ids:
+            bit = self._bits.get(container_id)
+            if bit is None:
+                return None
+            mask |= 1 << bit
+        return mask
+
+
+# Interner shared by all node state in this process
+CONTAINERS = ContainerInterner()
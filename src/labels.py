@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+from ipaddress import ip_address, ip_network
+from typing import Any, Iterable, Optional
+
+# Node labels, e.g. {"region": "eu-west", "zone": "eu-west-1a", "tier": "gpu"}
+Labels = dict[str, str]
+
+# Well-known labels, also read from top-level fields of explorer node objects
+LABEL_KEYS = ("region", "zone", "tier")
+
+
+def parse_labels(pairs: Iterable[str]) -> Labels:
+    """Parses `key=value` pairs into labels, skipping malformed ones
+
+    Args:
+        pairs (Iterable[str]): `key=value` pairs
+
+    Returns:
+        Labels: Labels
+    """
+    labels: Labels = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        if key.strip() and value.strip():
+            labels[key.strip()] = value.strip()
+    return labels
+
+
+def parse_node(line: str) -> Optional[tuple[str, Labels]]:
+    """Parses a line of `ips.txt`: a node's hostname or IP, optionally followed by
+    whitespace-separated `key=value` labels
+
+    Args:
+        line (str): Line, e.g. `1.2.3.4:4000 region=eu-west zone=eu-west-1a`
+
+    Returns:
+        Optional[tuple[str, Labels]]: Hostname and labels, or None for blank lines
+            and comments (starting with `#`)
+    """
+    fields = line.split()
+    if not fields or fields[0].startswith("#"):
+        return None
+    return fields[0], parse_labels(fields[1:])
+
+
+def node_labels(node: dict[str, Any]) -> Labels:
+    """Returns the labels of a node object from the explorer API: its `labels`
+    object, if any, and its well-known label fields (see `LABEL_KEYS`)
+
+    Args:
+        node (dict[str, Any]): Node object
+
+    Returns:
+        Labels: Labels
+    """
+    labels = node.get("labels")
+    result: Labels = (
+        {
+            str(key): value
+            for key, value in labels.items()
+            if isinstance(value, str) and value
+        }
+        if isinstance(labels, dict)
+        else {}
+    )
+    for key in LABEL_KEYS:
+        value = node.get(key)
+        if isinstance(value, str) and value:
+            result[key] = value
+    return result
+
+
+class RegionTable:
+    """Maps client addresses to regions, by longest matching CIDR prefix
+
+    Prefixes are grouped by length, so a lookup takes one dictionary lookup per
+    distinct prefix length, longest first, however many prefixes are configured.
+
+    Private attributes:
+        _prefixes (list[tuple[int, int, dict[Any, str]]]): (IP version, prefix
+            length, network -> region) per distinct prefix length, longest first
+
+    Methods:
+        region: Region of a client address
+    """
+
+    def __init__(self: RegionTable, cidrs: dict[str, str]) -> None:
+        """Initializes RegionTable
+
+        Args:
+            cidrs (dict[str, str]): CIDR prefix -> region, e.g.
+                `{"10.1.0.0/16": "eu-west"}`
+
+        Raises:
+            ValueError: If a prefix is not a valid CIDR
+        """
+        groups: dict[tuple[int, int], dict[Any, str]] = {}
+        for cidr, region in cidrs.items():
+            network = ip_network(cidr.strip(), strict=False)
+            groups.setdefault((network.version, network.prefixlen), {})[
+                network
+            ] = region.strip()
+        self._prefixes = [
+            (version, length, networks)
+            for (version, length), networks in sorted(
+                groups.items(), key=lambda group: -group[0][1]
+            )
+        ]
+
+    def __bool__(self: RegionTable) -> bool:
+        return bool(self._prefixes)
+
+    def region(self: RegionTable, address: str) -> Optional[str]:
+        """Returns the region of a client address
+
+        Args:
+            address (str): Client IP address
+
+        Returns:
+            Optional[str]: Region of the longest matching prefix, or None if none
+                matches (or the address is not an IP address)
+        """
+        try:
+            ip = ip_address(address)
+        except ValueError:
+            return None
+        for version, length, networks in self._prefixes:
+            if version != ip.version:
+                continue
+            region = networks.get(ip_network((ip, length), strict=False))
+            if region is not None:
+                return region
+        return None
@@ -1,8 +1,19 @@
+from __future__ import annotations
+
+import atexit
 import logging
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+from time import monotonic
+from typing import Any, Optional
 
 import structlog
 from structlog.typing import Processor
 
+from configs import LOG_QUEUE_SIZE, LOG_SAMPLE_SIZE, LOG_SUMMARY_INTERVAL
+from metrics import LOG_RECORDS_DROPPED
+
 # Re-export logger
 log = structlog.get_logger()
 
@@ -17,12 +28,129 @@ SHARED_PROCESSORS: list[Processor] = [
 ]
 
 
-def setup_logging(log_path: str = "/tmp/infernet_router.log") -> None:
+class BoundedQueueHandler(QueueHandler):
+    """Hands log records to a bounded queue, drained by a `QueueListener` thread
+
+    Records are enqueued as-is: rendering (e.g. to JSON) and I/O both happen on
+    the listener thread. When the queue is full, records are dropped and counted
+    instead of blocking the caller.
+    """
+
+    def prepare(self: BoundedQueueHandler, record: logging.LogRecord) -> Any:
+        # Structlog's event dict travels in `record.msg`, and is rendered by the
+        # listener's handlers. Only the exception being handled must be captured
+        # here, on the logging thread
+        if isinstance(record.msg, dict) and record.msg.get("exc_info") is True:
+            record.msg["exc_info"] = sys.exc_info()
+        return record
+
+    def enqueue(self: BoundedQueueHandler, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class EventSummary:
+    """Samples a repeated per-node event, and summarizes it periodically
+
+    The first `sample_size` occurrences within each `interval` are logged
+    individually. Any further occurrences are only counted, and logged as a single
+    summary (e.g. "137 nodes went unavailable") once the interval is over.
+
+    Private attributes:
+        _summary (str): Summary message, formatted with the occurrence count
+        _interval (float): Summary interval in seconds
+        _sample_size (int): Occurrences logged individually per interval
+        _window_start (float): Start of the current interval
+        _count (int): Occurrences in the current interval
+        _nodes (list[str]): Nodes of the first occurrences in the current interval
+
+    Methods:
+        record: Record an occurrence
+        flush: Log the summary, if the interval is over
+    """
+
+    def __init__(
+        self: EventSummary,
+        summary: str,
+        interval: float = LOG_SUMMARY_INTERVAL,
+        sample_size: int = LOG_SAMPLE_SIZE,
+    ) -> None:
+        """Initializes EventSummary
+
+        Args:
+            summary (str): Summary message, with a `{count}` placeholder
+            interval (float, optional): Summary interval in seconds. Defaults to
+                LOG_SUMMARY_INTERVAL.
+            sample_size (int, optional): Occurrences logged individually per
+                interval. Defaults to LOG_SAMPLE_SIZE.
+        """
+        self._summary = summary
+        self._interval = interval
+        self._sample_size = sample_size
+        self._window_start = monotonic()
+        self._count = 0
+        self._nodes: list[str] = []
+
+    def record(
+        self: EventSummary,
+        event: str,
+        node: str,
+        level: int = logging.ERROR,
+        **fields: Any,
+    ) -> None:
+        """Records an occurrence, logging it individually if within the sample
+
+        Args:
+            event (str): Individual log message
+            node (str): Node the event occurred on
+            level (int, optional): Log level. Defaults to logging.ERROR.
+            **fields (Any): Additional fields of the individual log line
+        """
+        self.flush()
+        self._count += 1
+        if self._count <= self._sample_size:
+            self._nodes.append(node)
+            log.log(level, event, node=node, **fields)
+
+    def flush(self: EventSummary, now: Optional[float] = None) -> None:
+        """Logs a summary of the current interval if it is over, and occurrences
+        beyond the sample were left out
+
+        Args:
+            now (Optional[float], optional): Current monotonic time. Defaults to
+                `monotonic()`.
+        """
+        now = monotonic() if now is None else now
+        if now - self._window_start < self._interval:
+            return
+
+        if self._count > self._sample_size:
+            log.warning(
+                self._summary.format(count=self._count),
+                count=self._count,
+                sample=self._nodes,
+                seconds=round(now - self._window_start, 1),
+            )
+        self._window_start = now
+        self._count = 0
+        self._nodes = []
+
+
+def setup_logging(log_path: str = "/tmp/infernet_router.log") -> QueueListener:
     """Setup logging configuration
 
+    Log records are queued, and formatted and written on a background thread, so
+    logging never blocks the event loop on I/O. The listener is stopped (flushing
+    queued records) at exit.
+
     Args:
         log_path (str, optional): Path for log file. Defaults to
             "/app/infernet_router.log".
+
+    Returns:
+        QueueListener: Listener thread writing queued records
     """
 
     # Configure structlog
@@ -52,12 +180,23 @@ def setup_logging(log_path: str = "/tmp/infernet_router.log") -> None:
     console_handler.setLevel(logging.INFO)  # Console INFO+
     file_handler.setFormatter(
         structlog.stdlib.ProcessorFormatter(
-            # Format logs as JSON
-            processor=structlog.processors.JSONRenderer()
+            # Format logs as JSON, with tracebacks as strings
+            processors=[
+                structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+                structlog.processors.format_exc_info,
+                structlog.processors.JSONRenderer(),
+            ]
         )
     )
     file_handler.setLevel(logging.DEBUG)  # Save to file DEBUG+
 
-    # Add log handlers to raw python logger
-    root_logger.addHandler(console_handler)
-    root_logger.addHandler(file_handler)
+    # Write records on a listener thread, fed through a bounded queue
+    queue: Queue[logging.LogRecord] = Queue(LOG_QUEUE_SIZE)
+    listener = QueueListener(
+        queue, console_handler, file_handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+
+    root_logger.addHandler(BoundedQueueHandler(queue))
+    return listener
@@ -1,65 +1,122 @@
 import asyncio
+import multiprocessing
 import signal
+from multiprocessing.process import BaseProcess
 from os import environ
+from typing import Any, Coroutine, Optional, Protocol, Sequence
 
-from logger import log
-from monitor import NodeMonitor
+from checkpoint import Checkpointer, load_checkpoint
+from cluster import Cluster
+from configs import (
+    CHECKPOINT_PATH,
+    CLUSTER_PEERS,
+    CLUSTER_SELF,
+    CONFIG_PATH,
+    IPS_PATH,
+    RELOAD_INTERVAL,
+    WORKERS,
+)
+from labels import Labels, parse_node
+from logger import log, setup_logging
+from metrics import MetricsExport
+from monitor import NodeMonitor, NodeTable
+from profiler import LoopMonitor
+from reloader import FileWatcher, reload_configs, track_configs
 from rest import RESTServer
+from shared import (
+    METRICS_MEMORY_SIZE,
+    SharedMetrics,
+    SharedTable,
+    SnapshotFollower,
+    SnapshotPublisher,
+)
 
 
-def read_ips(filepath: str = "ips.txt") -> list[str]:
-    """Read node IPs from filepath
+class Service(Protocol):
+    """Long-running component with a graceful stop"""
+
+    async def stop(self) -> None:
+        ...
+
+
+def read_ips(filepath: str = IPS_PATH) -> dict[str, Labels]:
+    """Read node IPs, and their labels, from filepath
+
+    Each line holds a node IP, optionally followed by whitespace-separated
+    `key=value` labels, e.g. `1.2.3.4:4000 region=eu-west zone=eu-west-1a`. Blank
+    lines and lines starting with `#` are skipped.
 
     Args:
-        filepath (str, optional): Filepath to read from. Defaults to "ips.txt".
+        filepath (str, optional): Filepath to read from. Defaults to IPS_PATH.
 
     Returns:
-        list[str]: List of node IPs
+        dict[str, Labels]: Node IPs, in file order, and their labels
     """
     try:
         with open(filepath, "r") as file:
-            return file.read().splitlines()
+            return dict(
+                node for node in map(parse_node, file.read().splitlines()) if node
+            )
     except Exception as e:
         log.error(f"Failed to read IPs from {filepath}: {str(e)}")
-        return []
+        return {}
 
 
-async def shutdown(
-    signal: signal.Signals, monitor: NodeMonitor, rest: RESTServer
-) -> None:
+def watch_files(monitor: Optional[NodeMonitor]) -> Optional[FileWatcher]:
+    """Watches the config file, and the node list if given a monitor to apply it
+    to, unless reloading is disabled
+
+    Args:
+        monitor (Optional[NodeMonitor]): Node monitor owning the node list
+
+    Returns:
+        Optional[FileWatcher]: File watcher to run, if any
+    """
+    if RELOAD_INTERVAL <= 0:
+        return None
+
+    watcher = FileWatcher()
+    if monitor is not None:
+        watcher.watch(IPS_PATH, lambda: monitor.set_base_nodes(read_ips()))
+    if CONFIG_PATH:
+        track_configs(CONFIG_PATH)
+        watcher.watch(CONFIG_PATH, lambda: reload_configs(CONFIG_PATH))
+    return watcher
+
+
+async def shutdown(signal: signal.Signals, *services: Service) -> None:
     """Gracefully shutdown node.
 
     Args:
         signal (signal.Signals): Signal to handle
-        rest (RESTServer): REST server
+        services (Service): Services to stop, in order
     """
     log.info(f"Received exit signal {signal.name}...")
-    await monitor.stop()
-    await rest.stop()
+    for service in services:
+        await service.stop()
     log.info("Shutdown complete.")
 
 
-async def main() -> None:
-    """Entry point for router"""
-
-    # Read node IPs from file
-    nodes = read_ips()
-    port = environ.get("PORT", "4000")
+async def run_services(
+    services: Sequence[Service], coroutines: list[Coroutine[Any, Any, None]]
+) -> None:
+    """Runs services until any of them completes, stopping all of them on SIGTERM
+    or SIGINT
 
-    monitor = NodeMonitor(nodes)
-    server = RESTServer(port, monitor)
+    Args:
+        services (Sequence[Service]): Services to stop on shutdown, in order
+        coroutines (list[Coroutine[Any, Any, None]]): Services' main loops
+    """
+    loop = asyncio.get_running_loop()
 
     # Register signal handlers for graceful shutdown
     for sig in (signal.SIGTERM, signal.SIGINT):
         loop.add_signal_handler(
-            sig, lambda s=sig: asyncio.create_task(shutdown(s, monitor, server))
+            sig, lambda s=sig: asyncio.create_task(shutdown(s, *services))
         )
 
     # Run tasks
-    tasks = [
-        asyncio.create_task(monitor.run_forever()),
-        asyncio.create_task(server.run_forever()),
-    ]
+    tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
 
     # Wait for any task to complete
     done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
@@ -70,6 +127,197 @@ async def main() -> None:
             log.error(f"Task exception: {task.exception()}")
 
 
+def attach_metrics(metrics_names: Sequence[str], index: int) -> SharedMetrics:
+    """Attaches to the shared memory segments holding each process' metrics
+
+    Args:
+        metrics_names (Sequence[str]): Names of the segments, the poller's first
+        index (int): This process' index in `metrics_names`
+
+    Returns:
+        SharedMetrics: Metrics of all processes
+    """
+    tables: list[SharedTable[MetricsExport]] = [
+        SharedTable(name, METRICS_MEMORY_SIZE) for name in metrics_names
+    ]
+    return SharedMetrics(tables, index)
+
+
+async def serve_worker(
+    port: str, table_name: str, metrics_names: Sequence[str], index: int
+) -> None:
+    """Serves the REST API from node state published by the poller process
+
+    Args:
+        port (str): Port to serve on, shared with the other workers
+        table_name (str): Name of the shared memory segment holding node state
+        metrics_names (Sequence[str]): Names of the shared memory segments holding
+            each process' metrics, the poller's first
+        index (int): This worker's index in `metrics_names`
+    """
+    setup_logging()
+    table: SharedTable[NodeTable] = SharedTable(table_name)
+    metrics = attach_metrics(metrics_names, index)
+
+    # Monitor that doesn't probe, only mirrors the poller's node table
+    monitor = NodeMonitor([])
+    follower = SnapshotFollower(monitor, table)
+    server = RESTServer(port, monitor, reuse_port=True, metrics=metrics)
+
+    # Workers reload their own settings, the poller applies the node list
+    services: list[Service] = [follower, metrics, server]
+    coroutines = [
+        follower.run_forever(),
+        metrics.run_forever(),
+        server.run_forever(),
+    ]
+    watcher = watch_files(None)
+    if watcher is not None:
+        services.append(watcher)
+        coroutines.append(watcher.run_forever())
+
+    try:
+        await run_services(services, coroutines)
+    finally:
+        table.close()
+        metrics.close()
+
+
+def run_worker(
+    port: str, table_name: str, metrics_names: Sequence[str], index: int
+) -> None:
+    """Entry point for REST worker processes
+
+    Args:
+        port (str): Port to serve on, shared with the other workers
+        table_name (str): Name of the shared memory segment holding node state
+        metrics_names (Sequence[str]): Names of the shared memory segments holding
+            each process' metrics, the poller's first
+        index (int): This worker's index in `metrics_names`
+    """
+    asyncio.run(serve_worker(port, table_name, metrics_names, index))
+
+
+class Workers:
+    """REST worker processes, stopped alongside the poller"""
+
+    def __init__(self, processes: Sequence[BaseProcess]) -> None:
+        """Initializes Workers
+
+        Args:
+            processes (Sequence[BaseProcess]): Started worker processes
+        """
+        self._processes = processes
+
+    async def stop(self) -> None:
+        """Terminates worker processes, waiting for them to exit"""
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            await asyncio.to_thread(process.join)
+
+
+async def main() -> None:
+    """Entry point for router
+
+    With `WORKERS` > 1, this process only polls nodes and publishes their state to
+    shared memory, and `WORKERS` separate processes serve the REST API from it.
+
+    With `CLUSTER_PEERS` set (and `WORKERS` = 1), this router probes only its shard
+    of the nodes, and exchanges node state with its peers.
+
+    With `CHECKPOINT_PATH` set, node state is restored from the last checkpoint on
+    startup and checkpointed periodically while running.
+
+    Changes to the node list (`IPS_PATH`) and config file (`CONFIG_PATH`) are
+    applied while running, every `RELOAD_INTERVAL`.
+    """
+
+    setup_logging()
+
+    # Without its own URL, a router can't tell its shard apart from its peers'
+    if CLUSTER_PEERS and CLUSTER_SELF not in CLUSTER_PEERS:
+        log.error("CLUSTER_SELF must be one of CLUSTER_PEERS", self=CLUSTER_SELF)
+        raise SystemExit(1)
+
+    # Read node IPs from file
+    nodes = read_ips()
+    port = environ.get("PORT", "4000")
+
+    monitor = NodeMonitor(list(nodes), nodes)
+
+    # Services shared by both modes, stopped in order
+    services: list[Service] = [monitor]
+    coroutines = [monitor.run_forever()]
+    if CHECKPOINT_PATH:
+        monitor.warm_start(*load_checkpoint(CHECKPOINT_PATH))
+        checkpointer = Checkpointer(monitor, CHECKPOINT_PATH)
+        services.append(checkpointer)
+        coroutines.append(checkpointer.run_forever())
+    watcher = watch_files(monitor)
+    if watcher is not None:
+        services.append(watcher)
+        coroutines.append(watcher.run_forever())
+
+    if WORKERS <= 1:
+        cluster = None
+        if set(CLUSTER_PEERS) - {CLUSTER_SELF}:
+            cluster = Cluster(monitor, CLUSTER_SELF, CLUSTER_PEERS)
+            monitor.set_routed_elsewhere()
+            services.append(cluster)
+            coroutines.append(cluster.run_forever())
+
+        server = RESTServer(port, monitor, cluster=cluster)
+        await run_services(services + [server], coroutines + [server.run_forever()])
+        return
+
+    if CLUSTER_PEERS:
+        log.warning("Cluster mode requires WORKERS=1, running standalone")
+
+    # Jobs are routed by the REST workers, unseen by this monitor
+    monitor.set_routed_elsewhere()
+    table: SharedTable[NodeTable] = SharedTable()
+    publisher = SnapshotPublisher(monitor, table)
+
+    # Each process publishes its metrics, so that any REST worker serves all of
+    # them: probing metrics are only recorded here, request metrics in workers
+    metrics_tables: list[SharedTable[MetricsExport]] = [
+        SharedTable(size=METRICS_MEMORY_SIZE) for _ in range(WORKERS + 1)
+    ]
+    metrics_names = [metrics_table.name for metrics_table in metrics_tables]
+    metrics = SharedMetrics(metrics_tables, 0)
+
+    # REST workers watch their own event loops, this one probes nodes
+    loop_monitor = LoopMonitor()
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(port, table.name, metrics_names, index),
+            daemon=True,
+        )
+        for index in range(1, WORKERS + 1)
+    ]
+    for process in processes:
+        process.start()
+    log.info("Started REST workers", count=WORKERS, port=port)
+
+    try:
+        await run_services(
+            services + [publisher, metrics, loop_monitor, Workers(processes)],
+            coroutines
+            + [
+                publisher.run_forever(),
+                metrics.run_forever(),
+                loop_monitor.run_forever(),
+            ],
+        )
+    finally:
+        table.close(unlink=True)
+        metrics.close(unlink=True)
+
+
 if __name__ == "__main__":
     loop = asyncio.get_event_loop()
     loop.run_until_complete(main())
@@ -0,0 +1,355 @@
+"""Minimal, dependency-free Prometheus metrics
+
+Metrics are registered at import time, and their label children are meant to be
+created once (e.g. per route or per node) and kept, so that recording a value on a
+hot path is a list index and an addition.
+
+Processes of a multi-process router export their values (see `export`), so that
+any of them can render the metrics of all of them, labeled by process.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left
+from typing import Callable, Generic, Optional, Sequence, TypeVar
+
+# Default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Exported child values of a metric: (label values, values) pairs. Values are a
+# counter's or gauge's value, or a histogram's bucket counts then sum
+ChildValues = list[tuple[tuple[str, ...], list[float]]]
+
+# Exported metrics of a process: metric name -> child values
+MetricsExport = dict[str, ChildValues]
+
+
+class CounterValue:
+    """Monotonically increasing value"""
+
+    __slots__ = ("value",)
+
+    def __init__(self: CounterValue) -> None:
+        self.value = 0.0
+
+    def inc(self: CounterValue, amount: float = 1) -> None:
+        self.value += amount
+
+    def values(self: CounterValue) -> list[float]:
+        return [self.value]
+
+    def samples(
+        self: CounterValue, name: str, labels: str, values: list[float]
+    ) -> list[str]:
+        return [f"{name}_total{labels} {values[0]}"]
+
+
+class GaugeValue:
+    """Value that can go up and down, or be computed when scraped"""
+
+    __slots__ = ("value", "function")
+
+    def __init__(self: GaugeValue) -> None:
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self: GaugeValue, value: float) -> None:
+        self.value = value
+
+    def set_function(self: GaugeValue, function: Callable[[], float]) -> None:
+        """Computes the gauge's value with `function` whenever it is scraped"""
+        self.function = function
+
+    def values(self: GaugeValue) -> list[float]:
+        return [self.function() if self.function is not None else self.value]
+
+    def samples(
+        self: GaugeValue, name: str, labels: str, values: list[float]
+    ) -> list[str]:
+        return [f"{name}{labels} {values[0]}"]
+
+
+class HistogramValue:
+    """Distribution of observations over fixed, preallocated buckets"""
+
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self: HistogramValue, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self: HistogramValue, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def values(self: HistogramValue) -> list[float]:
+        return [*self.counts, self.sum]
+
+    def samples(
+        self: HistogramValue, name: str, labels: str, values: list[float]
+    ) -> list[str]:
+        # Bucket counts are cumulative in the exposition format
+        prefix = f"{labels[:-1]}," if labels else "{"
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), values[:-1]):
+            cumulative += int(count)
+            le = "+Inf" if bound == float("inf") else bound
+            lines.append(f'{name}_bucket{prefix}le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{labels} {values[-1]}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+V = TypeVar("V", CounterValue, GaugeValue, HistogramValue)
+
+
+class Metric(Generic[V]):
+    """Metric family: a named metric, with one child value per set of label values
+
+    Unlabeled metrics have a single child, returned by `labels()`.
+
+    Methods:
+        labels: Child value for given label values, created on first use
+        remove: Drop the child value for given label values
+        export: Export child values
+        render: Render in the Prometheus text exposition format
+    """
+
+    def __init__(
+        self: Metric[V],
+        kind: str,
+        name: str,
+        documentation: str,
+        factory: Callable[[], V],
+        labelnames: tuple[str, ...] = (),
+    ) -> None:
+        """Initializes Metric, registering it in `REGISTRY`
+
+        Args:
+            kind (str): Prometheus metric type
+            name (str): Metric name
+            documentation (str): Help text
+            factory (Callable[[], V]): Creates child values
+            labelnames (tuple[str, ...]): Label names
+        """
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self._factory: Callable[[], V] = factory
+        self._labelnames = labelnames
+        self._children: dict[tuple[str, ...], V] = {}
+
+        REGISTRY.append(self)
+
+    def labels(self: Metric[V], *values: str) -> V:
+        """Returns the child value for given label values, creating it if needed.
+        Callers on hot paths should keep the returned child.
+
+        Args:
+            values (str): Label values, in the order of the label names
+
+        Returns:
+            V: Child value
+        """
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._factory()
+        return child
+
+    def remove(self: Metric[V], *values: str) -> None:
+        """Drops the child value for given label values, e.g. for a removed node
+
+        Args:
+            values (str): Label values, in the order of the label names
+        """
+        self._children.pop(values, None)
+
+    def export(self: Metric[V]) -> ChildValues:
+        """Exports child values, e.g. to render them in another process
+
+        Returns:
+            ChildValues: Label values and values of each child
+        """
+        return [
+            (values, child.values()) for values, child in list(self._children.items())
+        ]
+
+    def render(
+        self: Metric[V], processes: Optional[Sequence[tuple[str, MetricsExport]]] = None
+    ) -> list[str]:
+        """Renders the metric in the Prometheus text exposition format
+
+        Args:
+            processes (Optional[Sequence[tuple[str, MetricsExport]]], optional):
+                Process names and their exported metrics, to render labeled by
+                process. Defaults to None, rendering this process' own values.
+
+        Returns:
+            list[str]: Lines
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        sources: list[tuple[tuple[tuple[str, str], ...], ChildValues]]
+        if processes is None:
+            sources = [((), self.export())]
+        else:
+            sources = [
+                ((("process", process),), metrics.get(self.name, []))
+                for process, metrics in processes
+            ]
+
+        formatter = self._factory()
+        for process_labels, children in sources:
+            for label_values, child_values in children:
+                pairs = list(zip(self._labelnames, label_values)) + list(process_labels)
+                labels = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+                lines += formatter.samples(
+                    self.name, f"{{{labels}}}" if labels else "", child_values
+                )
+        return lines
+
+
+def _escape(value: str) -> str:
+    """Escapes a label value"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def counter(
+    name: str, documentation: str, labelnames: tuple[str, ...] = ()
+) -> Metric[CounterValue]:
+    """Registers a counter"""
+    return Metric("counter", name, documentation, CounterValue, labelnames)
+
+
+def gauge(
+    name: str, documentation: str, labelnames: tuple[str, ...] = ()
+) -> Metric[GaugeValue]:
+    """Registers a gauge"""
+    return Metric("gauge", name, documentation, GaugeValue, labelnames)
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: tuple[str, ...] = (),
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+) -> Metric[HistogramValue]:
+    """Registers a histogram"""
+    return Metric(
+        "histogram", name, documentation, lambda: HistogramValue(buckets), labelnames
+    )
+
+
+def export() -> MetricsExport:
+    """Exports all registered metrics' values. Only reads them, so it may run off
+    the event loop while they are being recorded
+
+    Returns:
+        MetricsExport: Metric name -> child values
+    """
+    return {metric.name: metric.export() for metric in REGISTRY}
+
+
+def render(processes: Optional[Sequence[tuple[str, MetricsExport]]] = None) -> str:
+    """Renders all registered metrics in the Prometheus text exposition format.
+    Only reads metric values, so it may run off the event loop while they are
+    being recorded
+
+    Args:
+        processes (Optional[Sequence[tuple[str, MetricsExport]]], optional): Process
+            names and their exported metrics, to render labeled by process.
+            Defaults to None, rendering this process' own values.
+
+    Returns:
+        str: Exposition text
+    """
+    return (
+        "\n".join(line for metric in REGISTRY for line in metric.render(processes))
+        + "\n"
+    )
+
+
+# All registered metrics
+REGISTRY: list[Metric[CounterValue] | Metric[GaugeValue] | Metric[HistogramValue]] = []
+
+# Node monitor. Unlabeled metrics are bound to their single child
+PROBES = counter("router_probes", "Node probes").labels()
+PROBE_RESPONSES = counter(
+    "router_probe_responses",
+    "Successful node probes, by kind: full (parsed /info), unchanged (/info not "
+    "modified) or health (/health liveness check)",
+    ("kind",),
+)
+# Probe durations are aggregated: a histogram per node would be 14 series per node
+PROBE_SECONDS = histogram(
+    "router_probe_duration_seconds", "Node probe round-trip time"
+).labels()
+PROBE_FAILURES = counter("router_probe_failures", "Failed node probes", ("node",))
+PROBE_LATENCY = gauge(
+    "router_node_probe_latency_seconds",
+    "Percentiles of each probed node's /info round-trip time, from a sketch of "
+    "recent probes",
+    ("node", "quantile"),
+)
+SCHEDULED_NODES = gauge(
+    "router_scheduled_nodes", "Nodes scheduled for probing"
+).labels()
+AVAILABLE_NODES = gauge("router_available_nodes", "Nodes currently available").labels()
+LIVE_REFRESH_SECONDS = histogram(
+    "router_live_refresh_duration_seconds", "Live node discovery refresh duration"
+).labels()
+GET_NODES_SECONDS = histogram(
+    "router_get_nodes_duration_seconds", "Node selection compute time"
+).labels()
+LOCALITY_SPILLOVERS = counter(
+    "router_locality_spillovers",
+    "Node selections with preferred labels that spilled over to other nodes",
+).labels()
+GET_CONTAINERS_SECONDS = histogram(
+    "router_get_containers_duration_seconds", "Container listing compute time"
+).labels()
+
+# Explorer API
+EXPLORER_FETCH_SECONDS = histogram(
+    "router_explorer_fetch_duration_seconds", "Explorer live node fetch duration"
+).labels()
+EXPLORER_FAILURES = counter(
+    "router_explorer_fetch_failures", "Failed explorer live node fetches"
+).labels()
+EXPLORER_NODES = gauge(
+    "router_explorer_nodes", "Live nodes returned by the last explorer fetch"
+).labels()
+
+# Event loop
+LOOP_LAG_SECONDS = histogram(
+    "router_loop_lag_seconds",
+    "Event loop scheduling delay of timed wakeups",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+).labels()
+SLOW_CALLBACKS = counter(
+    "router_slow_callbacks",
+    "Event loop stalls longer than SLOW_CALLBACK_THRESHOLD, logged with their stack",
+).labels()
+
+# Logging
+LOG_RECORDS_DROPPED = counter(
+    "router_log_records_dropped", "Log records dropped due to a full log queue"
+).labels()
+
+# REST server
+REQUEST_SECONDS = histogram(
+    "router_request_duration_seconds", "REST request latency", ("route",)
+)
+SHED_REQUESTS = counter(
+    "router_shed_requests",
+    "REST requests shed while overloaded, rejected or answered stale",
+    ("route",),
+)
+RATE_LIMITED = counter(
+    "router_rate_limited_requests",
+    "REST requests rejected by rate limiting",
+    ("route",),
+)
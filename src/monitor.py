@@ -1,178 +1,1084 @@
 from __future__ import annotations
 
-from asyncio import create_task, gather, sleep
+import json
+import logging
+from asyncio import Task, Timeout, create_task, gather, get_running_loop, timeout
+from bisect import bisect_left, insort
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from hashlib import blake2b
+from heapq import heapify, heappop, heappush, heapreplace, nsmallest
+from itertools import count, islice
 from os import environ
-from typing import Any
+from random import Random
+from time import monotonic, perf_counter, time
+from types import SimpleNamespace
+from typing import Any, Callable, Collection, Hashable, Iterator, Optional, cast
 
-from aiohttp import ClientSession
-from dotenv import load_dotenv
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
 
-from configs import REFRESH_INTERVAL
-from logger import log
-from sql import fetch_live_nodes
-
-load_dotenv()
+import configs
+from changelog import ChangeLog
+from configs import (
+    CHANGELOG_SIZE,
+    CONTAINER_WEIGHTS,
+    DNS_CACHE_TTL,
+    EJECT_COOLDOWN,
+    EJECT_THRESHOLD,
+    EJECT_WINDOW,
+    INFLIGHT_HALF_LIFE,
+    PROBE_MAX_CONNECTIONS,
+    PROBE_MAX_CONNECTIONS_PER_HOST,
+    REFRESH_INTERVAL,
+)
+from discovery import Discovery
+from interning import CONTAINERS
+from labels import Labels
+from logger import EventSummary, log
+from metrics import (
+    AVAILABLE_NODES,
+    GET_CONTAINERS_SECONDS,
+    GET_NODES_SECONDS,
+    LOCALITY_SPILLOVERS,
+    PROBE_FAILURES,
+    PROBE_LATENCY,
+    PROBE_RESPONSES,
+    PROBE_SECONDS,
+    PROBES,
+    SCHEDULED_NODES,
+)
+from routing import (
+    CANDIDATE_FACTOR,
+    CircuitBreaker,
+    DecayingCounter,
+    LatencyStats,
+    choose,
+)
+from scheduler import ProbeScheduler, probe_delay
+from snapshot import Encoded, Snapshot
 
 Hostname = str  # hostname or IP address and port
 
+# Plain-data export of a node: (containers, pending, latency EWMA, labels)
+NodeEntry = tuple[list[dict[str, Any]], dict[str, int], float, Labels]
+
+# Plain-data export of available nodes
+NodeTable = dict[Hostname, NodeEntry]
+
+# Changed nodes: host -> latest entry, or None if no longer available
+NodeDelta = dict[Hostname, Optional[NodeEntry]]
+
+# Expected latency in seconds of nodes without latency samples
+UNKNOWN_LATENCY = 1.0
+
+# Percentiles of probed nodes' latency exposed per node in `/metrics`
+LATENCY_PERCENTILES = (50, 99)
+
+# Per-probe timeouts. Time spent queued for a pooled connection is not counted, so
+# connection limits don't cause healthy nodes to time out
+PROBE_TIMEOUT = ClientTimeout(total=None, sock_connect=3, sock_read=3)
+
+# Overall time limit in seconds of a probe, from when it has a connection, so that
+# nodes trickling their response can't hold a probe
+PROBE_DEADLINE = 3.0
+
+# Largest `/info` body accepted, in bytes
+MAX_INFO_BYTES = 1 << 20
+
+# Statuses of nodes without a `/health` endpoint, which are always probed via `/info`
+NO_HEALTH_STATUSES = (404, 405, 501)
+
 
-@dataclass
+# Shared (empty) queue depths of nodes not reporting pending jobs per container
+NO_QUEUES: dict[str, float] = {}
+
+# Shared (empty) labels of unlabeled nodes
+NO_LABELS: Labels = {}
+
+
+def remove_sorted(entries: list[Any], entry: Any) -> None:
+    """Removes an entry from a sorted list, if present"""
+    i = bisect_left(entries, entry)
+    if i < len(entries) and entries[i] == entry:
+        del entries[i]
+
+
+async def start_deadline(
+    session: ClientSession, context: SimpleNamespace, params: Any
+) -> None:
+    """Starts a probe's `PROBE_DEADLINE`, once it has a connection. Probes pass
+    their deadline as `trace_request_ctx`"""
+    deadline = context.trace_request_ctx
+    if isinstance(deadline, Timeout):
+        deadline.reschedule(get_running_loop().time() + PROBE_DEADLINE)
+
+
+@dataclass(slots=True)
 class NodeInfo:
+    """Node state as reported by its `/info` endpoint
+
+    Containers and pending job counts are interned (see `ContainerInterner`), so
+    nodes reporting equal ones share them. They must not be mutated.
+    """
+
     available: bool
     containers: list[dict[str, Any]]
-    container_ids: list[str]
     pending: dict[str, int]
+    # Restored from a checkpoint, and not yet revalidated by a probe
+    stale: bool = False
+    # IDs of `containers`, and their bitmap (see `ContainerInterner.mask`)
+    container_ids: list[str] = field(init=False)
+    mask: int = field(init=False)
+    # Total pending job count, cached so ranking doesn't re-sum `pending`
+    load: int = field(init=False)
+    # Container ID -> queue depth, for containers reporting their own pending jobs:
+    # pending jobs per unit of capacity, weighted by `CONTAINER_WEIGHTS`
+    queue: dict[str, float] = field(init=False)
+
+    def __post_init__(self: NodeInfo) -> None:
+        self.containers, self.container_ids, self.mask = CONTAINERS.intern_containers(
+            self.containers
+        )
+        self.pending = CONTAINERS.intern_pending(self.pending)
+        self.load = sum(self.pending.values())
+        self.queue = {
+            container["id"]: container["pending"]
+            * CONTAINER_WEIGHTS.get(container["id"], 1)
+            / max(1, container.get("capacity") or 1)
+            for container in self.containers
+            if isinstance(container.get("pending"), int)
+        } or NO_QUEUES
+
+    def depth(self: NodeInfo, containers: Collection[str]) -> float:
+        """Returns the queue depth relevant to a job requiring `containers`: the
+        sum of their queue depths, or the total pending job count if the node
+        doesn't report all of them
+
+        Args:
+            containers (Collection[str]): Container IDs
+
+        Returns:
+            float: Queue depth
+        """
+        if not containers or not all(c in self.queue for c in containers):
+            return self.load
+        return sum(self.queue[c] for c in containers)
 
 
 class NodeMonitor:
     """Monitors nodes' availability and pending job counts
 
+    Every tracked node is probed on its own timer (see `ProbeScheduler`), and each
+    probe result is published to the routing indices as soon as it arrives.
+
     Private attributes:
-        _base_nodes (dict[Hostname, NodeInfo]): Node objects for nodes included in
-            ips.txt (explicitly specified nodes)
-        _api_url (Optional[str]): URL of the explorer API to fetch live nodes from
+        _base_nodes (set[Hostname]): Nodes included in ips.txt (explicitly specified
+            nodes)
+        _live_nodes (set[Hostname]): Live nodes discovered via the explorer API
+        _live_labels (dict[Hostname, Labels]): Labels of live nodes, per the
+            explorer API
+        _labels (dict[Hostname, Labels]): Host -> labels (e.g. region, zone), from
+            ips.txt or the explorer API for tracked nodes, or alongside the state
+            of nodes mirrored from elsewhere. Equal labels are shared
+        _label_index (dict[tuple[str, str], set[Hostname]]): (key, value) -> hosts
+            labeled with it
+        _discovery (Optional[Discovery]): Live node discovery via the explorer API,
+            if `API_URL` is set
+        _discovery_task (Optional[Task[None]]): Running live node discovery
         _available_nodes (dict[Hostname, NodeInfo]): Node objects for available nodes
+        _container_index (dict[str, set[Hostname]]): Container ID -> hosts of
+            available nodes running that container
+        _ranked_nodes (list[tuple[int, int, Hostname]]): Available hosts as
+            (load, order, host), sorted by lowest load
+        _container_ranked (dict[str, list[tuple[float, int, Hostname]]]): Container
+            ID -> available hosts running it as (queue depth, order, host), sorted
+            by the queue depth of that container
+        _queue_nodes (dict[str, int]): Container ID -> number of available nodes
+            reporting a queue depth for it
+        _order (dict[Hostname, int]): Host -> tie-breaker for equal loads, in order
+            of first availability
+        _inflight (DecayingCounter): Host -> provisional jobs assigned since the
+            node's last probe
+        _rng (Random): Random number generator for randomized strategies
+        _latency (dict[Hostname, LatencyStats]): Host -> `/info` round-trip times
+        _last_seen (dict[Hostname, float]): Host -> time of the last successful
+            probe
+        _payloads (dict[Hostname, bytes]): Host -> digest of its last parsed `/info`
+            payload, to skip parsing unchanged ones
+        _etags (dict[Hostname, str]): Host -> entity tag of its last `/info`, for
+            nodes supporting conditional requests
+        _light_probes (dict[Hostname, int]): Host -> `/health` probes since its last
+            `/info` fetch
+        _no_health (set[Hostname]): Nodes without a `/health` endpoint
+        _routed_elsewhere (bool): Whether jobs are also routed to nodes without
+            `assign` seeing them, which rules out light probes
+        _failures (dict[Hostname, int]): Host -> consecutive failed probes
+        _breaker (CircuitBreaker): Nodes ejected after failure reports from clients,
+            until a probe succeeds after `EJECT_COOLDOWN`
+        _scheduler (ProbeScheduler): Per-node probe timers
+        _owns (Callable[[Hostname], bool]): Whether this monitor probes a node, or
+            leaves it to a peer (cluster mode)
+        _probes (set[Task[None]]): In-flight probe tasks
+        _version (int): Routing state version, bumped whenever the state changes
+        _containers_version (int): Version of the container listing, bumped only
+            when available nodes or their containers change
+        _snapshot (Optional[Snapshot]): Latest published snapshot
+        _changes (ChangeLog): Hosts whose published state changed
+        _session (Optional[ClientSession]): Pooled HTTP client shared by all probes
+            and explorer requests, created on first use
+        _unavailable (EventSummary): Nodes going unavailable, logged as summaries
+            when many do at once
+        _ejected (EventSummary): Nodes ejected by failure reports, likewise
         _shutdown (bool): Shutdown flag
 
     Methods:
         get_nodes: Select the next node hostnames / IPs to send a job to
+        rank_nodes: Rank all nodes running the requested containers
+        assign: Count provisional jobs against nodes returned to a client
+        set_routed_elsewhere: Mark that jobs are routed without `assign`
+        report_failure: Count a client's failure report against a node
+        get_containers: Containers running on available nodes, with counts
+        snapshot: Latest snapshot of the routing state
+        export_table: Export available nodes as plain data
+        load_table: Replace available nodes with an exported table
+        export_changes: Export nodes changed since a change sequence number
+        apply_remote: Publish node changes observed by a peer
+        set_base_nodes: Apply a new list of explicitly specified nodes
+        set_shard: Restrict probing to a subset of nodes
+        last_seen: Time each node last answered a probe
+        warm_start: Restore available nodes from a checkpoint, pending revalidation
         run_forever: Main lifecycle loop
         stop: Stop node monitor
     """
 
-    def __init__(self, nodes: list[Hostname]) -> None:
+    def __init__(
+        self, nodes: list[Hostname], labels: Optional[dict[Hostname, Labels]] = None
+    ) -> None:
         """Initializes NodeMonitor
 
         Args:
             nodes (list[Hostname]): List of node hostnames or IPs
+            labels (Optional[dict[Hostname, Labels]], optional): Labels of the
+                listed nodes. Defaults to None.
         """
         super().__init__()
 
         # Nodes specified in ips.txt
-        self._base_nodes: dict[Hostname, NodeInfo] = {
-            node: NodeInfo(available=False, containers=[], container_ids=[], pending={})
-            for node in nodes
-        }
+        self._base_nodes: set[Hostname] = set(nodes)
+
+        # Nodes discovered via the explorer API
+        self._live_nodes: set[Hostname] = set()
+        self._live_labels: dict[Hostname, Labels] = {}
 
-        # URL of the explorer API to fetch live nodes
-        self._api_url = environ.get("API_URL")
+        # Node labels, for locality-aware routing
+        self._labels: dict[Hostname, Labels] = {}
+        self._label_index: dict[tuple[str, str], set[Hostname]] = {}
+        self._label_sets: dict[tuple[tuple[str, str], ...], Labels] = {}
+
+        # Live node discovery, running on its own schedule
+        api_url = environ.get("API_URL")
+        self._discovery = (
+            Discovery(api_url, self._get_session, self._set_live_nodes)
+            if api_url
+            else None
+        )
+        self._discovery_task: Optional[Task[None]] = None
 
         # Available nodes, including explicitly specified and live nodes
         self._available_nodes: dict[Hostname, NodeInfo] = {}
 
+        # Routing indices over available nodes, patched as probe results arrive
+        self._container_index: dict[str, set[Hostname]] = {}
+        self._ranked_nodes: list[tuple[int, int, Hostname]] = []
+        self._container_ranked: dict[str, list[tuple[float, int, Hostname]]] = {}
+        self._queue_nodes: dict[str, int] = {}
+        self._order: dict[Hostname, int] = {}
+        self._order_counter = count()
+
+        # Provisional jobs assigned by routing since each node's last probe
+        self._inflight = DecayingCounter(INFLIGHT_HALF_LIFE)
+        self._rng = Random()
+
+        # Round-trip times of successful probes
+        self._latency: dict[Hostname, LatencyStats] = {}
+        self._last_seen: dict[Hostname, float] = {}
+        self._payloads: dict[Hostname, bytes] = {}
+
+        # Two-tier probes: liveness checks between (conditional) full fetches
+        self._etags: dict[Hostname, str] = {}
+        self._light_probes: dict[Hostname, int] = {}
+        self._no_health: set[Hostname] = set()
+        self._routed_elsewhere = False
+
+        # Probe scheduling
+        self._failures: dict[Hostname, int] = {}
+        self._breaker = CircuitBreaker(EJECT_THRESHOLD, EJECT_WINDOW, EJECT_COOLDOWN)
+        self._scheduler = ProbeScheduler()
+        self._owns: Callable[[Hostname], bool] = lambda host: True
+        self._probes: set[Task[None]] = set()
+
+        # Versioned snapshots of the routing state
+        self._version = 0
+        self._containers_version = 0
+        self._snapshot: Optional[Snapshot] = None
+        self._changes = ChangeLog(CHANGELOG_SIZE)
+
+        # Shared HTTP client, created lazily since it must be bound to a running loop
+        self._session: Optional[ClientSession] = None
+
+        # Nodes flapping at once are logged as a summary, not one line each
+        self._unavailable = EventSummary("{count} nodes went unavailable")
+        self._ejected = EventSummary("{count} nodes ejected by failure reports")
+
         # Shutdown flag
         self._shutdown = False
 
-    async def _update_node(
-        self: NodeMonitor, host: Hostname, nodes: dict[Hostname, NodeInfo]
+        # Gauges are computed when scraped
+        AVAILABLE_NODES.set_function(lambda: len(self._available_nodes))
+        SCHEDULED_NODES.set_function(lambda: len(self._scheduler))
+
+        for host, host_labels in (labels or {}).items():
+            self._set_labels(host, host_labels)
+
+    def _get_session(self: NodeMonitor) -> ClientSession:
+        """Returns the shared HTTP client, creating it on first use
+
+        Connections are kept alive across probes, so steady-state probing reuses
+        pooled sockets instead of resolving and connecting to every node each time.
+
+        Returns:
+            ClientSession: Shared HTTP client
+        """
+        if self._session is None or self._session.closed:
+            # Probe deadlines start once connected (aiohttp mistypes its signals)
+            tracing = TraceConfig()
+            for signal in (
+                tracing.on_connection_create_end,
+                tracing.on_connection_reuseconn,
+            ):
+                cast(list[Any], signal).append(start_deadline)
+            self._session = ClientSession(
+                trace_configs=[tracing],
+                connector=TCPConnector(
+                    limit=PROBE_MAX_CONNECTIONS,
+                    limit_per_host=PROBE_MAX_CONNECTIONS_PER_HOST,
+                    ttl_dns_cache=DNS_CACHE_TTL,
+                    # Outlive the refresh interval, so sockets survive between probes
+                    keepalive_timeout=REFRESH_INTERVAL * 2,
+                ),
+            )
+        return self._session
+
+    def _is_tracked(self: NodeMonitor, host: Hostname) -> bool:
+        """Whether a host is still monitored, i.e. specified or discovered"""
+        return host in self._base_nodes or host in self._live_nodes
+
+    def _index_node(self: NodeMonitor, host: Hostname, node: NodeInfo) -> None:
+        """Adds an available node to the routing indices"""
+        if host not in self._order:
+            self._order[host] = next(self._order_counter)
+        order = self._order[host]
+
+        for container_id in node.container_ids:
+            self._container_index.setdefault(container_id, set()).add(host)
+            insort(
+                self._container_ranked.setdefault(container_id, []),
+                (node.depth((container_id,)), order, host),
+            )
+        for container_id in node.queue:
+            self._queue_nodes[container_id] = self._queue_nodes.get(container_id, 0) + 1
+
+        insort(self._ranked_nodes, (node.load, order, host))
+
+    def _unindex_node(self: NodeMonitor, host: Hostname, node: NodeInfo) -> None:
+        """Removes an available node from the routing indices"""
+        order = self._order[host]
+        for container_id in node.container_ids:
+            hosts = self._container_index.get(container_id)
+            if hosts is not None:
+                hosts.discard(host)
+                if not hosts:
+                    del self._container_index[container_id]
+
+            ranked = self._container_ranked.get(container_id)
+            if ranked is not None:
+                remove_sorted(ranked, (node.depth((container_id,)), order, host))
+                if not ranked:
+                    del self._container_ranked[container_id]
+        for container_id in node.queue:
+            self._queue_nodes[container_id] -= 1
+            if not self._queue_nodes[container_id]:
+                del self._queue_nodes[container_id]
+
+        remove_sorted(self._ranked_nodes, (node.load, order, host))
+
+    def _publish(
+        self: NodeMonitor,
+        host: Hostname,
+        node: Optional[NodeInfo],
+        reconcile: bool = True,
     ) -> None:
-        """Fetches latest information for given node, updating its NodeInfo
-        object in place. If node does not respond, marks it as unavailable.
+        """Publishes a node's latest state to `self._available_nodes` and the
+        routing indices
 
         Args:
             host (Hostname): Node hostname or IP
-            nodes (dict[Hostname, NodeInfo]): Node info
+            node (Optional[NodeInfo]): Latest node info, or None if unavailable
+            reconcile (bool, optional): Whether `node` reports the node's current
+                jobs, accounting for jobs assigned before it. False for states
+                carried over by a `/health` probe. Defaults to True.
+        """
+        # Fresh node state accounts for jobs assigned before it was reported
+        reconciled = reconcile and node is not None and self._inflight.clear(host)
+
+        previous = self._available_nodes.get(host)
+        if previous == node and not reconciled:
+            return
+
+        self._version += 1
+        if previous is None or node is None:
+            containers_changed = pending_changed = True
+        else:
+            containers_changed = previous.containers != node.containers
+            pending_changed = previous.pending != node.pending
+        if containers_changed:
+            self._containers_version += 1
+
+        # Exported state changed. Latency alone doesn't make a change worth sending
+        if containers_changed or pending_changed:
+            self._changes.append(host)
+
+        if previous is not None:
+            self._unindex_node(host, previous)
+
+        if node is None:
+            if previous is not None:
+                del self._available_nodes[host]
+            return
+
+        self._available_nodes[host] = node
+        self._index_node(host, node)
+
+    def _rebuild_index(self: NodeMonitor) -> None:
+        """Rebuilds all routing indices from `self._available_nodes`"""
+        self._container_index = {}
+        self._ranked_nodes = []
+        self._container_ranked = {}
+        self._queue_nodes = {}
+        for host, node in self._available_nodes.items():
+            self._index_node(host, node)
+
+    def _set_labels(self: NodeMonitor, host: Hostname, labels: Labels) -> None:
+        """Sets a node's labels, and patches the label index
+
+        Args:
+            host (Hostname): Node hostname or IP
+            labels (Labels): Node labels, empty to remove them
+        """
+        previous = self._labels.get(host, NO_LABELS)
+        if previous == labels:
+            return
+
+        for item in previous.items():
+            hosts = self._label_index[item]
+            hosts.discard(host)
+            if not hosts:
+                del self._label_index[item]
+
+        if labels:
+            # Fleets share a few label sets, stored once
+            key = tuple(sorted(labels.items()))
+            labels = self._label_sets.setdefault(key, dict(key))
+            self._labels[host] = labels
+            for item in labels.items():
+                self._label_index.setdefault(item, set()).add(host)
+        else:
+            self._labels.pop(host, None)
+
+        if host in self._available_nodes:
+            self._version += 1
+            self._changes.append(host)
+
+    def _preferred(self: NodeMonitor, prefer: Labels) -> set[Hostname]:
+        """Returns the nodes carrying all preferred labels
+
+        Args:
+            prefer (Labels): Preferred labels, at least one
+
+        Returns:
+            set[Hostname]: Matching hosts, available or not. May be the label
+                index's own set, which must not be mutated
         """
+        matches = sorted(
+            (self._label_index.get(item, set()) for item in prefer.items()), key=len
+        )
+        if len(matches) == 1:
+            return matches[0]
+        return {host for host in matches[0] if all(host in m for m in matches[1:])}
+
+    def _light_probe_due(
+        self: NodeMonitor, host: Hostname, previous: Optional[NodeInfo]
+    ) -> bool:
+        """Whether a node's next probe only needs to check its liveness
+
+        Idle nodes with fresh state, and no jobs assigned to them since, are probed
+        via `/health` between full `/info` fetches, once every `FULL_PROBE_EVERY`
+        probes. Their containers rarely change, and their pending jobs are
+        accounted for by `assign` until the next full fetch. That only holds while
+        all jobs are routed through this monitor: otherwise, `/info` is always
+        fetched (see `set_routed_elsewhere`).
+
+        Args:
+            host (Hostname): Node hostname or IP
+            previous (Optional[NodeInfo]): Node's current state, if available
+
+        Returns:
+            bool: Whether to probe `/health` instead of `/info`
+        """
+        if (
+            configs.FULL_PROBE_EVERY <= 1
+            or self._routed_elsewhere
+            or previous is None
+            or previous.stale
+            or previous.load
+            or host in self._no_health
+            or self._inflight.get(host)
+        ):
+            self._light_probes.pop(host, None)
+            return False
+
+        light_probes = self._light_probes.get(host, 0)
+        if light_probes + 1 >= configs.FULL_PROBE_EVERY:
+            self._light_probes.pop(host, None)
+            return False
+
+        self._light_probes[host] = light_probes + 1
+        return True
+
+    async def _fetch_info(
+        self: NodeMonitor,
+        host: Hostname,
+        previous: Optional[NodeInfo],
+        deadline: Timeout,
+    ) -> Optional[NodeInfo]:
+        """Fetches a node's `/info`, conditionally if it supports entity tags
+
+        Unchanged payloads, as per a `304 Not Modified` or an equal digest, reuse
+        the node's current state without parsing. Bodies beyond `MAX_INFO_BYTES`
+        fail the probe.
+
+        Args:
+            host (Hostname): Node hostname or IP
+            previous (Optional[NodeInfo]): Node's current state, if available
+            deadline (Timeout): Probe deadline, started once connected
+
+        Returns:
+            Optional[NodeInfo]: Node's latest state, or None if the request failed
+        """
+        fresh = previous is not None and not previous.stale
+        etag = self._etags.get(host) if fresh else None
+        async with self._get_session().get(
+            f"http://{host}/info",
+            headers={"If-None-Match": etag} if etag else None,
+            timeout=PROBE_TIMEOUT,
+            trace_request_ctx=deadline,
+        ) as response:
+            if response.status == 304 and etag:
+                PROBE_RESPONSES.labels("unchanged").inc()
+                return previous
+            if response.status != 200:
+                return None
+
+            if (response.content_length or 0) > MAX_INFO_BYTES:
+                return None
+            body = bytearray()
+            async for chunk in response.content.iter_any():
+                body += chunk
+                if len(body) > MAX_INFO_BYTES:
+                    return None
+
+            etag = response.headers.get("ETag")
+            if etag:
+                self._etags[host] = etag
+            else:
+                self._etags.pop(host, None)
+
+            digest = blake2b(body, digest_size=16).digest()
+            if fresh and self._payloads.get(host) == digest:
+                PROBE_RESPONSES.labels("unchanged").inc()
+                return previous
+
+            data = json.loads(body)
+            node = NodeInfo(
+                available=True,
+                containers=data["containers"],
+                pending=data["pending"],
+            )
+            self._payloads[host] = digest
+            PROBE_RESPONSES.labels("full").inc()
+            return node
+
+    async def _update_node(self: NodeMonitor, host: Hostname) -> bool:
+        """Fetches latest information for given node and publishes it. If node does
+        not respond, marks it as unavailable.
+
+        Between full `/info` fetches, idle nodes are only checked for liveness via
+        `/health` (see `_light_probe_due`), falling back to `/info` for nodes
+        without it.
+
+        Args:
+            host (Hostname): Node hostname or IP
+
+        Returns:
+            bool: Whether the node is available
+        """
+        node: Optional[NodeInfo] = None
+        previous = self._available_nodes.get(host)
+        light = self._light_probe_due(host, previous)
+        started = monotonic()
         try:
-            async with ClientSession() as session:
-                # Ping node for pending jobs
-                async with session.get(f"http://{host}/info", timeout=3) as response:
-                    if response.status == 200:
-                        # Update node info
-                        data = await response.json()
-                        nodes[host] = NodeInfo(
-                            available=True,
-                            containers=data["containers"],
-                            container_ids=[
-                                container["id"] for container in data["containers"]
-                            ],
-                            pending=data["pending"],
-                        )
-                        return
+            async with timeout(None) as deadline:
+                if light:
+                    async with self._get_session().get(
+                        f"http://{host}/health",
+                        timeout=PROBE_TIMEOUT,
+                        trace_request_ctx=deadline,
+                    ) as response:
+                        if response.status == 200:
+                            PROBE_RESPONSES.labels("health").inc()
+                            node = previous
+                        elif response.status in NO_HEALTH_STATUSES:
+                            self._no_health.add(host)
+                            light = False
+
+                if not light:
+                    node = await self._fetch_info(host, previous, deadline)
 
         except Exception:
             pass
 
-        # Node is not available
-        if nodes[host].available:
-            log.error("Node not available", node=host)
-            nodes[host].available = False
+        # Node may have been dropped while it was being probed
+        if not self._is_tracked(host):
+            return False
 
-    async def _get_live_nodes(self: NodeMonitor) -> dict[Hostname, NodeInfo]:
-        """Fetches live nodes from the database
+        elapsed = monotonic() - started
+        PROBES.inc()
+        PROBE_SECONDS.observe(elapsed)
+        if node is not None:
+            if not light:
+                # Latency ranking models `/info` round trips
+                stats = self._latency.setdefault(host, LatencyStats())
+                if not stats.samples:
+                    self._export_percentiles(host, stats)
+                stats.record(elapsed)
+            self._last_seen[host] = time()
+        else:
+            PROBE_FAILURES.labels(host).inc()
 
-        If `self._api_url` is set, fetches live nodes from the explorer API.
+        if node is not None and host in self._breaker:
+            if not self._breaker.allows(host):
+                # Ejected node stays out of routing until its half-open probe
+                return True
+            self._breaker.close(host)
+            log.info("Node re-admitted", node=host)
 
-        Returns:
-            dict[Hostname, NodeInfo]: Node objects for live nodes
+        if node is None and host in self._available_nodes:
+            self._unavailable.record("Node not available", host)
+
+        self._publish(host, node, reconcile=not light)
+        return node is not None
+
+    async def _probe(self: NodeMonitor, host: Hostname) -> None:
+        """Probes a node and schedules its next probe based on the outcome
+
+        Args:
+            host (Hostname): Node hostname or IP
         """
+        available = await self._update_node(host)
+        if not self._is_tracked(host) or not self._owns(host):
+            return
 
-        if self._api_url:
-            return {
-                # Hostname is ip:port for each node. Default port is 4000
-                f'{node["ip"]}:{node["port"] if "port" in node else "4000"}': NodeInfo(
-                    available=False, containers=[], container_ids=[], pending={}
-                )
-                for node in await fetch_live_nodes(self._api_url)
-            }
+        if available:
+            self._failures.pop(host, None)
+            failures = 0
+        else:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+
+        if host in self._breaker and not self._breaker.allows(host):
+            # Probe ejected nodes again once their circuit turns half-open
+            self._scheduler.schedule(host, EJECT_COOLDOWN)
+            return
+
+        node = self._available_nodes.get(host)
+        self._scheduler.schedule(
+            host, probe_delay(available, node.load if node else 0, failures)
+        )
+
+    def _untrack(self: NodeMonitor, host: Hostname) -> None:
+        """Stops monitoring a node and evicts it from all indices
+
+        Args:
+            host (Hostname): Node hostname or IP
+        """
+        self._scheduler.remove(host)
+        self._failures.pop(host, None)
+        self._breaker.remove(host)
+        self._forget_latency(host)
+        self._last_seen.pop(host, None)
+        self._payloads.pop(host, None)
+        self._etags.pop(host, None)
+        self._light_probes.pop(host, None)
+        self._no_health.discard(host)
+        self._publish(host, None)
+        self._set_labels(host, NO_LABELS)
+        self._order.pop(host, None)
+        PROBE_FAILURES.remove(host)
+
+    def _set_live_nodes(
+        self: NodeMonitor,
+        live_nodes: set[Hostname],
+        labels: Optional[dict[Hostname, Labels]] = None,
+    ) -> None:
+        """Applies a new set of live nodes, scheduling newly discovered nodes for
+        probing and evicting nodes that are no longer live. Nodes that remain live
+        keep their state.
+
+        Args:
+            live_nodes (set[Hostname]): Hostnames of live nodes
+            labels (Optional[dict[Hostname, Labels]], optional): Labels of live
+                nodes. Nodes in ips.txt keep their labels from there. Defaults to
+                None.
+        """
+        for host in live_nodes - self._live_nodes - self._base_nodes:
+            if self._owns(host):
+                self._scheduler.schedule_initial(host)
+
+        self._live_labels = labels or {}
+        for host in live_nodes - self._base_nodes:
+            self._set_labels(host, self._live_labels.get(host, NO_LABELS))
+
+        removed = self._live_nodes - live_nodes - self._base_nodes
+        self._live_nodes = set(live_nodes)
+        for host in removed:
+            self._untrack(host)
 
-        return {}
+    def set_base_nodes(self: NodeMonitor, nodes: dict[Hostname, Labels]) -> None:
+        """Applies a new list of explicitly specified nodes (ips.txt), e.g. after it
+        was edited. Added nodes are probed right away, and removed nodes are
+        evicted, unless they are also live. Other nodes keep their state.
+
+        Args:
+            nodes (dict[Hostname, Labels]): Node hostnames or IPs, and their labels
+        """
+        added = nodes.keys() - self._base_nodes
+        removed = self._base_nodes - nodes.keys()
+        self._base_nodes = set(nodes)
+
+        for host in added - self._live_nodes:
+            if self._owns(host):
+                self._scheduler.schedule(host, 0)
+        for host in removed - self._live_nodes:
+            self._untrack(host)
+
+        for host, labels in nodes.items():
+            self._set_labels(host, labels)
+        for host in removed & self._live_nodes:
+            self._set_labels(host, self._live_labels.get(host, NO_LABELS))
+
+        if added or removed:
+            log.info("Applied node list", added=len(added), removed=len(removed))
 
     async def run_forever(self: NodeMonitor) -> None:
         """Main lifecycle loop
 
-        Continuously polls nodes for availability and updates `self._base_nodes` and
+        Continuously probes nodes for availability and updates
         `self._available_nodes`.
 
-        `self._available_nodes` is a combination of all `self._base_nodes` (explicitl
-        specified nodes that are online) and live nodes from the database.
-        `get_live_nodes` is called every iteration to fetch the latest live nodes.
+        `self._available_nodes` is a combination of all `self._base_nodes` (explicitly
+        specified nodes that are online) and live nodes from the explorer API. Live
+        nodes are discovered in a separate task (see `Discovery`), every
+        `DISCOVERY_INTERVAL`.
 
-        The availability of each node is checked by pinging the node's `/info` endpoint.
+        The availability of each node is checked by pinging the node's `/info`
+        endpoint. Each node is probed on its own schedule, within the global
+        `PROBE_RATE` budget, and its result is published as soon as it arrives.
         """
+        for host in self._base_nodes:
+            if self._owns(host):
+                self._scheduler.schedule_initial(host)
+
+        if self._discovery is not None:
+            self._discovery_task = create_task(self._discovery.run_forever())
+        else:
+            # Nodes restored from a checkpoint are only tracked if specified
+            self._set_live_nodes(set())
+
         while not self._shutdown:
-            # Base nodes
-            tasks = [
-                create_task(self._update_node(host, self._base_nodes))
-                for host in self._base_nodes
-            ]
+            due = await self._scheduler.next(timeout=configs.REFRESH_INTERVAL)
+            self._unavailable.flush()
+            self._ejected.flush()
+            if due is None or self._shutdown:
+                continue
+
+            task = create_task(self._probe(due))
+            self._probes.add(task)
+            task.add_done_callback(self._probes.discard)
+
+    def _candidates(
+        self: NodeMonitor, containers: list[str]
+    ) -> Optional[set[Hostname]]:
+        """Returns available nodes running all requested containers
+
+        Args:
+            containers (list[str]): List of container IDs
+
+        Returns:
+            Optional[set[Hostname]]: Matching hosts, or None if all available nodes
+                match (no containers requested)
+        """
+        if not containers:
+            return None
+
+        # Hosts running the rarest requested container, that run all others too.
+        # The index's own set is returned as is, and must not be mutated
+        rarest = min(
+            (self._container_index.get(container, set()) for container in containers),
+            key=len,
+        )
+        required = CONTAINERS.mask(containers)
+        if required is None or len(set(containers)) == 1:
+            return rarest if required is not None else set()
+        return {
+            host
+            for host in rarest
+            if self._available_nodes[host].mask & required == required
+        }
 
-            # Live nodes
-            live_nodes = await self._get_live_nodes()
-            tasks += [
-                create_task(self._update_node(host, live_nodes))
-                for host in live_nodes
-                if host not in self._base_nodes
+    def _iter_ranked(
+        self: NodeMonitor,
+        containers: set[str],
+        candidates: Optional[set[Hostname]],
+        end: int,
+        subset: bool = False,
+    ) -> Iterator[tuple[float, int, Hostname]]:
+        """Yields candidate nodes by ascending queue depth for the requested
+        containers (see `NodeInfo.depth`)
+
+        Args:
+            containers (set[str]): Requested container IDs
+            candidates (Optional[set[Hostname]]): Candidate hosts, None for all
+                available nodes
+            end (int): Number of nodes the caller expects to consume, used to pick
+                the cheaper way of ordering candidates
+            subset (bool, optional): Whether candidates are only some of the nodes
+                running the requested containers. Defaults to False.
+
+        Yields:
+            tuple[float, int, Hostname]: (queue depth, order, host)
+        """
+        if candidates is None:
+            yield from self._ranked_nodes
+        elif len(containers) == 1 and not subset:
+            # Exactly the nodes running the container, by its queue depth
+            yield from self._container_ranked[next(iter(containers))]
+        elif any(container in self._queue_nodes for container in containers):
+            # Depths of several containers are only known per candidate
+            heap = [
+                (
+                    self._available_nodes[host].depth(containers),
+                    self._order[host],
+                    host,
+                )
+                for host in candidates
             ]
+            heapify(heap)
+            while heap:
+                yield heappop(heap)
+        elif end * len(self._ranked_nodes) < len(candidates) ** 2:
+            # Candidates are dense: walk the pre-sorted ordering, which finds the
+            # first `end` matches without touching most of the fleet
+            for entry in self._ranked_nodes:
+                if entry[2] in candidates:
+                    yield entry
+        else:
+            # Candidates are sparse: pop them off a heap
+            heap = [
+                (self._available_nodes[host].load, self._order[host], host)
+                for host in candidates
+            ]
+            heapify(heap)
+            while heap:
+                yield heappop(heap)
+
+    def _export_percentiles(
+        self: NodeMonitor, host: Hostname, stats: LatencyStats
+    ) -> None:
+        """Exposes a node's latency percentiles as gauges, estimated when scraped
+
+        Args:
+            host (Hostname): Node hostname or IP
+            stats (LatencyStats): Node's latency stats
+        """
 
-            # Wait for all tasks to complete
-            await gather(*tasks)
+        def percentile(q: float) -> Callable[[], float]:
+            return lambda: stats.percentile(q) or UNKNOWN_LATENCY
 
-            # Combine base and live nodes
-            all_nodes = {**self._base_nodes, **live_nodes}
+        for q in LATENCY_PERCENTILES:
+            PROBE_LATENCY.labels(host, f"{q / 100:g}").set_function(percentile(q))
 
-            # Filter available nodes
-            self._available_nodes = {
-                host: node
-                for host, node in all_nodes.items()
-                if all_nodes[host].available
-            }
-            log.debug(
-                "Available nodes",
-                nodes=self._available_nodes.keys(),
-                count=len(self._available_nodes),
+    def _forget_latency(self: NodeMonitor, host: Hostname) -> None:
+        """Drops a node's latency stats, and their gauges
+
+        Args:
+            host (Hostname): Node hostname or IP
+        """
+        if self._latency.pop(host, None) is not None:
+            for q in LATENCY_PERCENTILES:
+                PROBE_LATENCY.remove(host, f"{q / 100:g}")
+
+    def _expected_latency(self: NodeMonitor, host: Hostname) -> float:
+        """Returns a node's expected `/info` round-trip time in seconds"""
+        stats = self._latency.get(host)
+        if stats is None or stats.ewma is None:
+            return UNKNOWN_LATENCY
+        return stats.ewma
+
+    def _rank(
+        self: NodeMonitor,
+        containers: list[str],
+        end: int,
+        mode: str = "pending",
+        within: Optional[set[Hostname]] = None,
+    ) -> list[tuple[float, Hostname]]:
+        """Ranks the top `end` nodes running all requested containers
+
+        Args:
+            containers (list[str]): List of container IDs
+            end (int): Number of nodes to rank
+            mode (str): Ranking mode, one of `routing.RANK_MODES`. "pending" ranks
+                by effective load: queue depth for the requested containers plus
+                provisional in-flight jobs. "latency" ranks by expected completion
+                time: effective load plus the job itself, times the node's observed
+                round-trip time
+            within (Optional[set[Hostname]], optional): Hosts to rank among, None
+                for all. Defaults to None.
+
+        Returns:
+            list[tuple[float, Hostname]]: (score, host) pairs, by ascending score
+        """
+        candidates = self._candidates(containers)
+        if within is not None:
+            candidates = (
+                {host for host in within if host in self._available_nodes}
+                if candidates is None
+                else candidates & within
+            )
+        if candidates is not None and not candidates:
+            return []
+        distinct = set(containers)
+
+        if mode == "latency":
+            hosts = self._available_nodes if candidates is None else candidates
+            scored = nsmallest(
+                end,
+                (
+                    (
+                        (
+                            self._available_nodes[host].depth(distinct)
+                            + self._inflight.get(host)
+                            + 1
+                        )
+                        * self._expected_latency(host),
+                        self._order[host],
+                        host,
+                    )
+                    for host in hosts
+                ),
+            )
+            return [(score, host) for score, _, host in scored]
+
+        ranked = self._iter_ranked(distinct, candidates, end, within is not None)
+        if not self._inflight:
+            return [(load, host) for load, _, host in islice(ranked, end)]
+
+        # In-flight jobs only ever add to a node's load, so once the worst of the
+        # best `end` nodes beats the next node's pending count, no later node can
+        # make it into the top `end`
+        best: list[tuple[float, int, Hostname]] = []  # max-heap of (-load, -order)
+        for load, order, host in ranked:
+            if len(best) == end and (-best[0][0], -best[0][1]) < (load, order):
+                break
+
+            entry = (-(load + self._inflight.get(host)), -order, host)
+            if len(best) < end:
+                heappush(best, entry)
+            elif entry > best[0]:
+                heapreplace(best, entry)
+
+        return [(-load, host) for load, _, host in sorted(best, reverse=True)]
+
+    def _rank_preferred(
+        self: NodeMonitor,
+        containers: list[str],
+        end: int,
+        mode: str = "pending",
+        prefer: Optional[Labels] = None,
+    ) -> tuple[list[tuple[float, Hostname]], int]:
+        """Ranks the top `end` nodes running all requested containers, nodes with
+        the preferred labels first
+
+        Preferred nodes whose queue depth for the requested containers, including
+        in-flight jobs, is at most `SPILLOVER_DEPTH` come first. Other nodes, and
+        busier preferred nodes, follow by score, so jobs only spill over to other
+        nodes once preferred ones are busy (or missing).
+
+        Args:
+            containers (list[str]): List of container IDs
+            end (int): Number of nodes to rank
+            mode (str): Ranking mode, one of `routing.RANK_MODES`
+            prefer (Optional[Labels], optional): Preferred labels. Defaults to None.
+
+        Returns:
+            tuple[list[tuple[float, Hostname]], int]: (score, host) pairs, and the
+                number of leading preferred nodes among them
+        """
+        if not prefer:
+            return self._rank(containers, end, mode), 0
+
+        distinct = set(containers)
+        near = [
+            (score, host)
+            for score, host in self._rank(
+                containers, end, mode, within=self._preferred(prefer)
             )
+            if self._available_nodes[host].depth(distinct) + self._inflight.get(host)
+            <= configs.SPILLOVER_DEPTH
+        ]
+        if len(near) == end:
+            return near, end
 
-            await sleep(REFRESH_INTERVAL)
+        taken = {host for _, host in near}
+        spillover = [
+            entry
+            for entry in self._rank(containers, end + len(near), mode)
+            if entry[1] not in taken
+        ]
+        return near + spillover[: end - len(near)], len(near)
 
     def get_nodes(
-        self: NodeMonitor, containers: list[str], n: int = 3, offset: int = 0
+        self: NodeMonitor,
+        containers: list[str],
+        n: int = 3,
+        offset: int = 0,
+        strategy: str = "least",
+        rank: str = "pending",
+        prefer: Optional[Labels] = None,
     ) -> list[Hostname]:
         """Select the next node hostname / IP to send a job to
 
-        Returns the next n nodes to send a job to, based on the pending job count.
+        Returns the next n nodes to send a job to, based on the pending job count
+        and jobs provisionally assigned since (see `assign`).
         If no nodes running the requested containers are available, returns None.
         Optionally, an offset can be provided to skip the first `offset` nodes.
 
@@ -180,27 +1086,172 @@ class NodeMonitor:
             containers (list[str]): List of container IDs
             n (int): Maximum number of nodes to return
             offset (int): Offset to start from
+            strategy (str): Selection strategy among the best ranked nodes, one of
+                `routing.STRATEGIES`
+            rank (str): Ranking mode, one of `routing.RANK_MODES`
+            prefer (Optional[Labels]): Preferred node labels, e.g. the client's
+                region (see `_rank_preferred`)
 
         Returns:
             list[Hostname]: List of node hostnames or IPs
         """
-        # Filter available nodes by running containers
-        filtered_nodes = [
+        end = offset + n
+        if n <= 0 or end <= 0:
+            return []
+
+        started = perf_counter()
+
+        # Randomized strategies choose among a wider set of close candidates
+        window = end if strategy == "least" else offset + n * CANDIDATE_FACTOR
+        ranked, near = self._rank_preferred(containers, window, rank, prefer)
+        ranked, near = ranked[offset:], max(0, near - offset)
+
+        # Strategies choose among preferred nodes first, then the others
+        selected = choose(strategy, ranked[:near], n, self._rng)
+        if len(selected) < n:
+            spilled = choose(strategy, ranked[near:], n - len(selected), self._rng)
+            if prefer and spilled:
+                LOCALITY_SPILLOVERS.inc()
+            selected += spilled
+
+        GET_NODES_SECONDS.observe(perf_counter() - started)
+        return selected
+
+    def rank_nodes(
+        self: NodeMonitor,
+        containers: list[str],
+        rank: str = "pending",
+        prefer: Optional[Labels] = None,
+    ) -> list[Hostname]:
+        """Ranks all available nodes running the requested containers
+
+        Args:
+            containers (list[str]): List of container IDs
+            rank (str): Ranking mode, one of `routing.RANK_MODES`
+            prefer (Optional[Labels]): Preferred node labels (see
+                `_rank_preferred`)
+
+        Returns:
+            list[Hostname]: Node hostnames or IPs, best first
+        """
+        started = perf_counter()
+        ranked = [
             host
-            for host in self._available_nodes
-            if all(
-                container in self._available_nodes[host].container_ids
-                for container in containers
-            )
+            for _, host in self._rank_preferred(
+                containers, len(self._available_nodes), rank, prefer
+            )[0]
         ]
+        GET_NODES_SECONDS.observe(perf_counter() - started)
+        return ranked
 
-        # Sort nodes by the lowest pending job count
-        sorted_nodes = sorted(
-            filtered_nodes, key=lambda x: sum(self._available_nodes[x].pending.values())
-        )
+    def get_nodes_batch(
+        self: NodeMonitor, requests: list[tuple[list[str], int]], rank: str = "pending"
+    ) -> list[list[Hostname]]:
+        """Select nodes for a batch of jobs against the same routing state
+
+        Requests for the same container set are ranked once. Within the batch,
+        every node handed out counts as one more job on it, so that jobs are spread
+        across nodes instead of all landing on the least busy ones.
+
+        Args:
+            requests (list[tuple[list[str], int]]): (container IDs, n) per job
+            rank (str): Ranking mode, one of `routing.RANK_MODES`
+
+        Returns:
+            list[list[Hostname]]: Node hostnames or IPs per job, in request order
+        """
+        results: list[list[Hostname]] = [[] for _ in requests]
+
+        # Group jobs by container set
+        groups: defaultdict[frozenset[str], list[int]] = defaultdict(list)
+        for i, (containers, n) in enumerate(requests):
+            if n > 0:
+                groups[frozenset(containers)].append(i)
+
+        # Jobs handed out in this batch per node, across container sets
+        batch_jobs: defaultdict[Hostname, int] = defaultdict(int)
+
+        def cost(host: Hostname) -> float:
+            """Score added to a node by one more job"""
+            return self._expected_latency(host) if rank == "latency" else 1
+
+        for container_set, indices in groups.items():
+            # Greedy picks below never go past the top `demand` nodes that weren't
+            # handed out earlier in the batch, since at most `demand - 1` nodes of
+            # this set have been picked before any pick
+            demand = sum(requests[i][1] for i in indices)
+            heap = [
+                (score + batch_jobs[host] * cost(host), position, host)
+                for position, (score, host) in enumerate(
+                    self._rank(list(container_set), demand + len(batch_jobs), rank)
+                )
+            ]
+            heapify(heap)
+
+            for i in indices:
+                # Take the n best nodes, then push them back one job busier
+                picked = [heappop(heap) for _ in range(min(requests[i][1], len(heap)))]
+                results[i] = [host for _, _, host in picked]
+                for score, position, host in picked:
+                    batch_jobs[host] += 1
+                    heappush(heap, (score + cost(host), position, host))
+
+        return results
+
+    def assign(self: NodeMonitor, hosts: list[Hostname]) -> None:
+        """Counts a provisional in-flight job against each given node, so that
+        routing spreads load between probes. In-flight jobs decay over
+        `INFLIGHT_HALF_LIFE`, and are reset by the node's next probe.
+
+        Args:
+            hosts (list[Hostname]): Node hostnames or IPs returned to a client
+        """
+        if INFLIGHT_HALF_LIFE <= 0 or not hosts:
+            return
+
+        # In-flight jobs are not part of the snapshot version: they change with
+        # every answer, and decay between probes
+        for host in hosts:
+            self._inflight.add(host)
+
+    def set_routed_elsewhere(self: NodeMonitor) -> None:
+        """Marks that jobs are also routed to nodes without this monitor's `assign`
+        seeing them: by REST workers in other processes, cluster peers, or
+        subscribers routing locally. Nodes' pending jobs are then only known from
+        full `/info` fetches, so light probes are disabled.
+        """
+        if not self._routed_elsewhere:
+            log.info("Jobs are routed elsewhere too, disabling light probes")
+        self._routed_elsewhere = True
+        self._light_probes.clear()
+
+    def report_failure(
+        self: NodeMonitor, host: Hostname, reason: str, reporter: Hashable
+    ) -> bool:
+        """Counts a client's report that a node failed (or was too slow) to serve a
+        job. After reports by `EJECT_THRESHOLD` distinct clients within
+        `EJECT_WINDOW` seconds, the node is ejected from routing until a probe
+        succeeds after `EJECT_COOLDOWN` seconds (half-open). Reports of unavailable
+        nodes are ignored.
+
+        Args:
+            host (Hostname): Node hostname or IP
+            reason (str): Reported failure, e.g. "failed" or "slow"
+            reporter (Hashable): Reporting client, e.g. its API key or address
 
-        # Top n nodes after  offset
-        return sorted_nodes[offset : offset + n]
+        Returns:
+            bool: Whether the report ejected the node
+        """
+        if host not in self._available_nodes or not self._breaker.report(
+            host, reporter
+        ):
+            return False
+
+        self._publish(host, None)
+        if host in self._scheduler:
+            self._scheduler.schedule(host, EJECT_COOLDOWN)
+        self._ejected.record("Node ejected", host, logging.WARNING, reason=reason)
+        return True
 
     def get_containers(self: NodeMonitor) -> list[dict[str, Any]]:
         """Returns containers running on all available nodes, with counts
@@ -209,6 +1260,7 @@ class NodeMonitor:
             list[dict[str, Any]]: List of containers running on available nodes, with
                 counts and descriptions
         """
+        started = perf_counter()
 
         containers: defaultdict[str, Any] = defaultdict(
             lambda: {"count": 0, "description": None}
@@ -226,7 +1278,7 @@ class NodeMonitor:
                         "description"
                     ]
 
-        return [
+        listing = [
             {
                 "id": id,
                 "count": data["count"],
@@ -235,6 +1287,242 @@ class NodeMonitor:
             for id, data in containers.items()
         ]
 
+        GET_CONTAINERS_SECONDS.observe(perf_counter() - started)
+        return listing
+
+    def snapshot(self: NodeMonitor) -> Snapshot:
+        """Returns a snapshot of the current routing state
+
+        Snapshots are immutable and published at most once per state version, so
+        responses memoized on them are reused until the state changes. The encoded
+        container listing is carried over while it is unchanged.
+
+        Returns:
+            Snapshot: Snapshot at the current version
+        """
+        previous = self._snapshot
+        if previous is not None and previous.version == self._version:
+            return previous
+
+        if previous is not None and (
+            previous.containers_version == self._containers_version
+        ):
+            containers = previous.containers
+        else:
+            containers = Encoded.from_json(self.get_containers())
+
+        self._snapshot = Snapshot(self._version, self._containers_version, containers)
+        return self._snapshot
+
+    def export_table(self: NodeMonitor) -> NodeTable:
+        """Exports available nodes as plain data, e.g. to share with other processes
+
+        Returns:
+            NodeTable: Available nodes
+        """
+        return {
+            host: self._entry(host, node)
+            for host, node in self._available_nodes.items()
+        }
+
+    def _entry(self: NodeMonitor, host: Hostname, node: NodeInfo) -> NodeEntry:
+        """Exports an available node as plain data"""
+        return (
+            node.containers,
+            node.pending,
+            self._expected_latency(host),
+            self._labels.get(host, NO_LABELS),
+        )
+
+    def _load_entry(
+        self: NodeMonitor, host: Hostname, entry: NodeEntry, stale: bool = False
+    ) -> None:
+        """Publishes a node from exported plain data, unless it is unchanged
+
+        Args:
+            host (Hostname): Node hostname or IP
+            entry (NodeEntry): Exported node
+            stale (bool, optional): Whether the entry awaits revalidation by a
+                probe. Defaults to False.
+        """
+        containers, pending, latency, labels = entry
+        stats = self._latency.get(host)
+        if stats is None:
+            self._latency[host] = LatencyStats(ewma=latency)
+        else:
+            stats.ewma = latency
+        if not self._is_tracked(host):
+            # Labels of nodes mirrored from elsewhere come with their state
+            self._set_labels(host, labels)
+
+        node = self._available_nodes.get(host)
+        if node is not None and (
+            node.containers == containers
+            and node.pending == pending
+            and node.stale == stale
+        ):
+            return
+
+        self._publish(
+            host,
+            NodeInfo(
+                available=True,
+                containers=containers,
+                pending=pending,
+                stale=stale,
+            ),
+        )
+
+    def _drop_entry(self: NodeMonitor, host: Hostname) -> None:
+        """Unpublishes a node that is not probed by this monitor
+
+        Args:
+            host (Hostname): Node hostname or IP
+        """
+        self._publish(host, None)
+        self._order.pop(host, None)
+        self._forget_latency(host)
+        if not self._is_tracked(host):
+            self._set_labels(host, NO_LABELS)
+
+    def load_table(self: NodeMonitor, table: NodeTable) -> None:
+        """Replaces available nodes with an exported table, patching the routing
+        indices for changed nodes only. Used by monitors that don't probe nodes
+        themselves.
+
+        Args:
+            table (NodeTable): Available nodes
+        """
+        for host in [host for host in self._available_nodes if host not in table]:
+            self._drop_entry(host)
+
+        for host, entry in table.items():
+            if self._readmits(host):
+                self._load_entry(host, entry)
+
+        # Followers eject nodes on reports too, but don't run the probing loop
+        self._ejected.flush()
+
+    def _readmits(self: NodeMonitor, host: Hostname) -> bool:
+        """Returns whether a node reported available elsewhere (by the poller, or
+        a peer) may be routed to. Nodes ejected by this monitor are re-admitted
+        once their circuit is half-open
+
+        Args:
+            host (Hostname): Node hostname or IP
+
+        Returns:
+            bool: Whether the node may be routed to
+        """
+        if host in self._breaker:
+            if not self._breaker.allows(host):
+                return False
+            self._breaker.close(host)
+        return True
+
+    def export_changes(
+        self: NodeMonitor, since: Optional[int] = None
+    ) -> tuple[int, NodeDelta, bool]:
+        """Exports nodes whose containers, pending jobs or availability changed
+        after change sequence number `since`, or all available nodes if changes
+        since then are no longer retained
+
+        Args:
+            since (Optional[int], optional): Last change sequence number seen by the
+                consumer, None to export all available nodes. Defaults to None.
+
+        Returns:
+            tuple[int, NodeDelta, bool]: Latest change sequence number, changed
+                nodes, and whether they are all available nodes instead (in which
+                case nodes missing from them are no longer available)
+        """
+        hosts = None if since is None else self._changes.since(since)
+        if hosts is None:
+            return self._changes.seq, dict(self.export_table()), True
+
+        delta: NodeDelta = {}
+        for host in hosts:
+            node = self._available_nodes.get(host)
+            delta[host] = None if node is None else self._entry(host, node)
+        return self._changes.seq, delta, False
+
+    def apply_remote(self: NodeMonitor, delta: NodeDelta) -> None:
+        """Publishes node changes observed by a peer, for nodes this monitor
+        doesn't probe itself
+
+        Args:
+            delta (NodeDelta): Changed nodes
+        """
+        for host, entry in delta.items():
+            if entry is None:
+                self._drop_entry(host)
+            elif self._readmits(host):
+                self._load_entry(host, entry)
+
+    def set_shard(self: NodeMonitor, owns: Callable[[Hostname], bool]) -> None:
+        """Restricts probing to the nodes this monitor owns, e.g. its shard of a
+        cluster. Newly owned nodes are scheduled right away, and nodes no longer
+        owned stop being probed (their state is then expected from peers).
+
+        Args:
+            owns (Callable[[Hostname], bool]): Whether this monitor probes a node
+        """
+        self._owns = owns
+        for host in self._base_nodes | self._live_nodes:
+            if not owns(host):
+                self._scheduler.remove(host)
+                # Peers' state may diverge from what this monitor last fetched
+                self._payloads.pop(host, None)
+                self._etags.pop(host, None)
+            elif host not in self._scheduler:
+                self._scheduler.schedule_initial(host)
+
+    def last_seen(self: NodeMonitor) -> dict[Hostname, float]:
+        """Returns the time each node last answered a probe
+
+        Returns:
+            dict[Hostname, float]: Host -> UNIX timestamp
+        """
+        return dict(self._last_seen)
+
+    def warm_start(
+        self: NodeMonitor, table: NodeTable, last_seen: dict[Hostname, float]
+    ) -> None:
+        """Restores available nodes from a checkpoint, e.g. after a restart, so that
+        requests are served before the first probes complete. Restored nodes are
+        marked stale and scheduled for probing right away, which revalidates or
+        evicts them. Nodes that are not specified nor discovered again are evicted
+        on the first successful live node refresh.
+
+        Args:
+            table (NodeTable): Available nodes as of the checkpoint
+            last_seen (dict[Hostname, float]): Time each node last answered a probe
+        """
+        for host, entry in table.items():
+            if not self._is_tracked(host):
+                self._live_nodes.add(host)
+            if host in last_seen:
+                self._last_seen[host] = last_seen[host]
+            self._load_entry(host, entry, stale=True)
+            if self._owns(host):
+                self._scheduler.schedule_initial(host)
+
+        log.info("Restored nodes from checkpoint", count=len(table))
+
     async def stop(self: NodeMonitor) -> None:
-        """Stop node monitor"""
+        """Stop node monitor, cancelling in-flight probes and closing pooled
+        connections"""
         self._shutdown = True
+
+        if self._discovery is not None and self._discovery_task is not None:
+            # Don't wait for an in-flight explorer fetch
+            await self._discovery.stop()
+            self._discovery_task.cancel()
+            await gather(self._discovery_task, return_exceptions=True)
+
+        for task in self._probes:
+            task.cancel()
+        await gather(*self._probes, return_exceptions=True)
+
+        if self._session is not None:
+            await self._session.close()
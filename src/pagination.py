@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from time import monotonic
+from typing import Callable, Optional
+
+from configs import CURSOR_CACHE_SIZE, CURSOR_TTL
+from labels import Labels
+
+# Cached ranking key: (snapshot version, ranking mode, sorted container IDs, sorted
+# preferred labels as key=value pairs)
+RankingKey = tuple[int, str, tuple[str, ...], tuple[str, ...]]
+
+# Page of hosts, and the cursor to the next page if any
+Page = tuple[list[str], Optional[str]]
+
+
+def encode_cursor(key: RankingKey, position: int) -> str:
+    """Encodes an opaque cursor to a position in a cached ranking
+
+    Args:
+        key (RankingKey): Cached ranking key
+        position (int): Position of the next page in the ranking
+
+    Returns:
+        str: Cursor
+    """
+    version, rank, containers, prefer = key
+    raw = json.dumps(
+        [version, rank, containers, prefer, position], separators=(",", ":")
+    )
+    return urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Optional[tuple[RankingKey, int]]:
+    """Decodes a cursor
+
+    Args:
+        cursor (str): Cursor, as returned by `encode_cursor`
+
+    Returns:
+        Optional[tuple[RankingKey, int]]: Cached ranking key and position, or None
+            if the cursor is malformed
+    """
+    try:
+        raw = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        version, rank, containers, prefer, position = json.loads(raw)
+    except (TypeError, ValueError):
+        return None
+    if (
+        not isinstance(version, int)
+        or not isinstance(rank, str)
+        or not isinstance(containers, list)
+        or not all(isinstance(c, str) for c in containers)
+        or not isinstance(prefer, list)
+        or not all(isinstance(p, str) for p in prefer)
+        or not isinstance(position, int)
+        or position < 0
+    ):
+        return None
+    return (version, rank, tuple(containers), tuple(prefer)), position
+
+
+class CursorCache:
+    """Node rankings paged through by clients with cursors
+
+    The first page of a paginated query ranks all matching nodes once, as of the
+    current snapshot version, and caches the ranking. Follow-up pages are sliced
+    from that ranking, so clients see a consistent order without duplicates or
+    gaps, even as node state changes in between. Rankings expire `ttl` seconds
+    after they were computed, and the least recently used ones are evicted beyond
+    `size`.
+
+    Private attributes:
+        _size (int): Maximum number of cached rankings
+        _ttl (float): Lifetime of cached rankings in seconds
+        _rankings (OrderedDict[RankingKey, tuple[float, list[str]]]): Ranking key
+            -> (expiry time, ranked hosts), in LRU order
+
+    Methods:
+        first_page: Page through a new (or cached) ranking
+        next_page: Page through a cached ranking
+    """
+
+    def __init__(
+        self: CursorCache, size: int = CURSOR_CACHE_SIZE, ttl: float = CURSOR_TTL
+    ) -> None:
+        """Initializes CursorCache
+
+        Args:
+            size (int, optional): Maximum number of cached rankings. Defaults to
+                CURSOR_CACHE_SIZE.
+            ttl (float, optional): Lifetime of cached rankings in seconds. Defaults
+                to CURSOR_TTL.
+        """
+        self._size = size
+        self._ttl = ttl
+        self._rankings: OrderedDict[RankingKey, tuple[float, list[str]]] = OrderedDict()
+
+    def _page(
+        self: CursorCache, key: RankingKey, hosts: list[str], position: int, n: int
+    ) -> Page:
+        """Slices a page from a ranking, with the cursor to the next one if any"""
+        end = position + n
+        next_cursor = encode_cursor(key, end) if end < len(hosts) else None
+        return hosts[position:end], next_cursor
+
+    def _get(self: CursorCache, key: RankingKey) -> Optional[list[str]]:
+        """Returns a cached ranking, unless expired"""
+        cached = self._rankings.get(key)
+        if cached is None:
+            return None
+        expires, hosts = cached
+        if expires < monotonic():
+            del self._rankings[key]
+            return None
+        self._rankings.move_to_end(key)
+        return hosts
+
+    def first_page(
+        self: CursorCache,
+        version: int,
+        rank: str,
+        containers: list[str],
+        position: int,
+        n: int,
+        ranking: Callable[[], list[str]],
+        prefer: Optional[Labels] = None,
+    ) -> Page:
+        """Returns a page of a query's ranking as of a snapshot version, ranking and
+        caching it unless already cached
+
+        Args:
+            version (int): Snapshot version
+            rank (str): Ranking mode
+            containers (list[str]): Requested container IDs
+            position (int): Position of the page in the ranking
+            n (int): Page size
+            ranking (Callable[[], list[str]]): Ranks all matching hosts
+            prefer (Optional[Labels], optional): Preferred node labels. Defaults to
+                None.
+
+        Returns:
+            Page: Hosts, and the cursor to the next page if any
+        """
+        key = (
+            version,
+            rank,
+            tuple(sorted(set(containers))),
+            tuple(sorted(f"{k}={v}" for k, v in (prefer or {}).items())),
+        )
+        hosts = self._get(key)
+        if hosts is None:
+            hosts = ranking()
+            self._rankings[key] = (monotonic() + self._ttl, hosts)
+            if len(self._rankings) > self._size:
+                self._rankings.popitem(last=False)
+        return self._page(key, hosts, position, n)
+
+    def next_page(self: CursorCache, cursor: str, n: int) -> Optional[Page]:
+        """Returns the page of a cached ranking a cursor points to
+
+        Args:
+            cursor (str): Cursor returned with the previous page
+            n (int): Page size
+
+        Returns:
+            Optional[Page]: Hosts, and the cursor to the next page if any, or None
+                if the cursor is malformed or its ranking expired
+        """
+        decoded = decode_cursor(cursor)
+        if decoded is None:
+            return None
+        key, position = decoded
+        hosts = self._get(key)
+        if hosts is None:
+            return None
+        return self._page(key, hosts, position, n)
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import marshal
+import sys
+from asyncio import sleep, to_thread
+from collections import Counter
+from cProfile import Profile
+from pathlib import Path
+from threading import Event, Thread, get_ident
+from time import monotonic
+from time import sleep as sleep_thread
+from types import FrameType
+from typing import Optional
+
+import configs
+from logger import log
+from metrics import LOOP_LAG_SECONDS, SLOW_CALLBACKS
+
+# Interval in seconds at which event loop lag is sampled
+LAG_SAMPLE_INTERVAL = 0.05
+
+# Interval in seconds between stack samples of a profile
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# Longest profile capture in seconds
+PROFILE_MAX_SECONDS = 60.0
+
+# Profile modes: sampled collapsed stacks, or deterministic cProfile dumps
+PROFILE_MODES = ("sample", "cprofile")
+
+
+def frame_name(frame: FrameType) -> str:
+    """Returns a stack frame's function, as `function (dir/file.py:line)`"""
+    code = frame.f_code
+    path = "/".join(Path(code.co_filename).parts[-2:])
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+def collapse(frame: Optional[FrameType]) -> str:
+    """Returns a stack in collapsed form: frames from the outermost to `frame`,
+    separated by `;`, as read by flame graph tools (e.g. `flamegraph.pl`,
+    speedscope)
+
+    Args:
+        frame (Optional[FrameType]): Innermost frame
+
+    Returns:
+        str: Collapsed stack
+    """
+    names: list[str] = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def sample_stacks(
+    thread_id: int, seconds: float, interval: float = PROFILE_SAMPLE_INTERVAL
+) -> str:
+    """Samples a thread's stack at an interval, blocking the calling thread
+
+    Args:
+        thread_id (int): Sampled thread
+        seconds (float): Capture duration in seconds
+        interval (float, optional): Interval in seconds between samples. Defaults
+            to PROFILE_SAMPLE_INTERVAL.
+
+    Returns:
+        str: Collapsed stacks and their sample counts, one per line, most sampled
+            first
+    """
+    samples: Counter[str] = Counter()
+    deadline = monotonic() + seconds
+    while monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            samples[collapse(frame)] += 1
+        del frame
+        sleep_thread(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+async def profile_calls(seconds: float) -> bytes:
+    """Profiles all calls on the running event loop's thread with `cProfile`
+
+    Args:
+        seconds (float): Capture duration in seconds
+
+    Returns:
+        bytes: Profile in the `pstats` dump format, as read by `pstats.Stats`, or
+            converted to flame graphs by e.g. `flameprof`
+    """
+    profile = Profile()
+    profile.enable()
+    try:
+        await sleep(seconds)
+    finally:
+        profile.disable()
+    profile.create_stats()
+    return marshal.dumps(profile.stats)
+
+
+class LoopMonitor:
+    """Measures event loop lag, and captures the stacks of slow callbacks
+
+    Lag is sampled as the delay of timed wakeups, and recorded in the
+    `router_loop_lag_seconds` histogram. Each wakeup is also a heartbeat for a
+    watchdog thread: when the loop misses heartbeats for more than
+    `SLOW_CALLBACK_THRESHOLD` seconds, a callback is blocking it, and the
+    watchdog logs the loop thread's stack while it still blocks, once per stall.
+
+    Private attributes:
+        _heartbeat (float): Monotonic time of the last wakeup
+        _thread_id (Optional[int]): Event loop thread, once running
+        _stopped (Event): Set to stop sampling, and the watchdog
+        _watchdog (Optional[Thread]): Watchdog thread, once running
+
+    Public attributes:
+        lag (float): Latest sampled event loop lag in seconds
+        capturing (bool): Whether a profile is being captured
+
+    Methods:
+        check: Log the loop thread's stack, if it stalls
+        profile: Capture a profile of the event loop
+        run_forever: Sample event loop lag
+        stop: Stop sampling event loop lag
+    """
+
+    def __init__(self: LoopMonitor) -> None:
+        """Initializes LoopMonitor"""
+        self._heartbeat = monotonic()
+        self._thread_id: Optional[int] = None
+        self._stopped = Event()
+        self._watchdog: Optional[Thread] = None
+        self.lag = 0.0
+        self.capturing = False
+
+    def check(self: LoopMonitor, reported: float) -> float:
+        """Logs the loop thread's stack, if it missed heartbeats for longer than
+        `SLOW_CALLBACK_THRESHOLD` seconds. Called from the watchdog thread
+
+        Args:
+            reported (float): Heartbeat of the last reported stall
+
+        Returns:
+            float: Heartbeat of the last reported stall, updated if reported
+        """
+        heartbeat = self._heartbeat
+        stalled = monotonic() - heartbeat
+        threshold = configs.SLOW_CALLBACK_THRESHOLD
+        if threshold <= 0 or stalled <= threshold or heartbeat == reported:
+            return reported
+        if self._thread_id is None:
+            return reported  # Not running
+
+        frame = sys._current_frames().get(self._thread_id)
+        SLOW_CALLBACKS.inc()
+        log.warning(
+            "Event loop stalled", seconds=round(stalled, 3), stack=collapse(frame)
+        )
+        return heartbeat
+
+    def _watch(self: LoopMonitor) -> None:
+        """Watchdog thread: checks for stalls, until stopped"""
+        reported = 0.0
+        while not self._stopped.wait(
+            max(configs.SLOW_CALLBACK_THRESHOLD / 2, LAG_SAMPLE_INTERVAL)
+        ):
+            reported = self.check(reported)
+
+    async def profile(self: LoopMonitor, seconds: float, mode: str) -> bytes:
+        """Captures a profile of the event loop, while it keeps running
+
+        Args:
+            seconds (float): Capture duration in seconds
+            mode (str): `sample` for collapsed stacks sampled from a separate
+                thread, or `cprofile` for a deterministic `cProfile` dump
+
+        Returns:
+            bytes: Profile, see `sample_stacks` and `profile_calls`
+
+        Raises:
+            RuntimeError: If a profile is already being captured
+        """
+        if self.capturing:
+            raise RuntimeError("A profile is already being captured")
+
+        self.capturing = True
+        try:
+            if mode == "cprofile":
+                return await profile_calls(seconds)
+
+            # Sample from a separate thread, as the loop keeps running
+            stacks = await to_thread(sample_stacks, get_ident(), seconds)
+            return stacks.encode()
+        finally:
+            self.capturing = False
+
+    async def run_forever(self: LoopMonitor) -> None:
+        """Samples event loop lag, as the delay of timed wakeups, until stopped"""
+        self._thread_id = get_ident()
+        self._heartbeat = monotonic()
+        self._watchdog = Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+        while not self._stopped.is_set():
+            expected = monotonic() + LAG_SAMPLE_INTERVAL
+            await sleep(LAG_SAMPLE_INTERVAL)
+            self._heartbeat = monotonic()
+            self.lag = max(0.0, self._heartbeat - expected)
+            LOOP_LAG_SECONDS.observe(self.lag)
+
+    async def stop(self: LoopMonitor) -> None:
+        """Stops sampling event loop lag, and the watchdog"""
+        self._stopped.set()
+        if self._watchdog is not None:
+            await to_thread(self._watchdog.join)
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import importlib
+from asyncio import Event, TimeoutError, wait_for
+from os import environ, stat
+from typing import Any, Callable, Optional
+
+from dotenv import dotenv_values
+
+import configs
+from logger import log
+
+# File modification stamp: (modification time in ns, size in bytes)
+Stamp = tuple[int, int]
+
+# Environment variables set from the config file, unset once removed from it
+_file_keys: set[str] = set()
+
+
+def _read_env_file(path: str) -> dict[str, str]:
+    """Returns the variables set in a .env file"""
+    return {
+        key: value for key, value in dotenv_values(path).items() if value is not None
+    }
+
+
+def track_configs(path: str) -> None:
+    """Records the variables loaded from a config file at startup (see `configs`),
+    so that removing them from the file reverts them to their defaults. Variables
+    set to the same value in the environment are taken as loaded from the file
+
+    Args:
+        path (str): Config file path, in .env format
+    """
+    for key, value in _read_env_file(path).items():
+        if environ.get(key) == value:
+            _file_keys.add(key)
+
+
+def reload_configs(path: str) -> list[str]:
+    """Re-reads settings from the environment, and a config file for those not
+    set in the environment, as on startup
+
+    Only the settings in `configs.RELOADABLE` take new values, which components
+    read on use. Other settings keep their startup values. If any setting fails
+    to parse, all of them keep their current values. Settings removed from the
+    file revert to their defaults.
+
+    Args:
+        path (str): Config file path, in .env format
+
+    Returns:
+        list[str]: Names of the settings that changed
+    """
+    current = {name: value for name, value in vars(configs).items() if name.isupper()}
+    values = _read_env_file(path)
+    for key in _file_keys - set(values):
+        _file_keys.discard(key)
+        environ.pop(key, None)
+    for key, value in values.items():
+        if key in environ and key not in _file_keys:
+            continue  # Set in the environment
+        _file_keys.add(key)
+        environ[key] = value
+
+    try:
+        importlib.reload(configs)
+        failed: Optional[Exception] = None
+    except Exception as e:
+        failed = e
+
+    changed: list[str] = []
+    for name, value in current.items():
+        if failed is not None or name not in configs.RELOADABLE:
+            setattr(configs, name, value)
+        elif getattr(configs, name) != value:
+            changed.append(name)
+
+    if failed is not None:
+        log.error(f"Failed to reload settings from {path}: {str(failed)}")
+    elif changed:
+        log.info("Reloaded settings", changed=changed)
+    return changed
+
+
+class FileWatcher:
+    """Watches files for changes, and applies them while running
+
+    Files are checked every `RELOAD_INTERVAL` seconds, by modification time and
+    size. A file's callback is called when it changed since the last check, but not
+    while it is missing (e.g. in the middle of being replaced), so that a missing
+    file doesn't take effect as an empty one.
+
+    Private attributes:
+        _watches (dict[str, Callable[[], Any]]): Path -> callback applying the file
+        _stamps (dict[str, Optional[Stamp]]): Path -> stamp as of the last check,
+            None if missing
+        _shutdown (Event): Set to stop watching
+
+    Methods:
+        watch: Watch a file
+        check: Apply files changed since the last check
+        run_forever: Check files every interval
+        stop: Stop watching
+    """
+
+    def __init__(self: FileWatcher) -> None:
+        """Initializes FileWatcher"""
+        self._watches: dict[str, Callable[[], Any]] = {}
+        self._stamps: dict[str, Optional[Stamp]] = {}
+        self._shutdown = Event()
+
+    @staticmethod
+    def _stamp(path: str) -> Optional[Stamp]:
+        """Returns a file's stamp, or None if missing"""
+        try:
+            result = stat(path)
+        except OSError:
+            return None
+        return result.st_mtime_ns, result.st_size
+
+    def watch(self: FileWatcher, path: str, on_change: Callable[[], Any]) -> None:
+        """Watches a file. Its current contents are assumed to be applied already
+
+        Args:
+            path (str): File path
+            on_change (Callable[[], Any]): Applies the file, when it changed
+        """
+        self._watches[path] = on_change
+        self._stamps[path] = self._stamp(path)
+
+    def check(self: FileWatcher) -> list[str]:
+        """Applies files changed since the last check
+
+        Returns:
+            list[str]: Paths of the applied files
+        """
+        applied: list[str] = []
+        for path, on_change in self._watches.items():
+            stamp = self._stamp(path)
+            if stamp == self._stamps[path]:
+                continue
+            self._stamps[path] = stamp
+            if stamp is None:
+                continue
+
+            try:
+                on_change()
+                applied.append(path)
+            except Exception as e:
+                log.error(f"Failed to apply {path}: {str(e)}")
+        return applied
+
+    async def run_forever(self: FileWatcher) -> None:
+        """Checks files every interval, until stopped"""
+        while not self._shutdown.is_set():
+            try:
+                await wait_for(self._shutdown.wait(), timeout=configs.RELOAD_INTERVAL)
+            except TimeoutError:
+                self.check()
+
+    async def stop(self: FileWatcher) -> None:
+        """Stops watching"""
+        self._shutdown.set()
@@ -1,17 +1,70 @@
 from __future__ import annotations
 
-from asyncio import CancelledError, Event, create_task
-from datetime import timedelta
-from typing import Tuple
+import json
+import socket
+from asyncio import CancelledError, Event, create_task, to_thread
+from collections import OrderedDict
+from hmac import compare_digest
+from math import ceil
+from time import perf_counter
+from typing import AsyncGenerator, Optional, Tuple
 
 from hypercorn.asyncio import serve
 from hypercorn.config import Config
-from quart import Quart, Response, jsonify, request
-from quart_rate_limiter import RateLimiter, rate_limit
+from quart import Quart, Response, g, jsonify, request
+from quart.wrappers.response import IterableBody
 
-from configs import RATELIMIT_REQS_PER_MIN
+import configs
+from admission import SHED_RETRY_AFTER, AdmissionControl, RateLimiter
+from cluster import Cluster
+from labels import Labels, RegionTable, parse_labels
 from logger import log
+from metrics import (
+    RATE_LIMITED,
+    REQUEST_SECONDS,
+    SHED_REQUESTS,
+    CounterValue,
+    HistogramValue,
+    render,
+)
 from monitor import NodeMonitor
+from pagination import CursorCache
+from profiler import PROFILE_MAX_SECONDS, PROFILE_MODES
+from routing import RANK_MODES, STRATEGIES
+from shared import SharedMetrics
+from snapshot import IPS_CACHE_SIZE, Encoded, IpsKey
+from subscription import Subscriptions
+
+# Maximum number of job requests in a single batch
+MAX_BATCH_SIZE = 1000
+
+# Number of hosts per chunk of a streamed node listing
+STREAM_CHUNK_SIZE = 1000
+
+# Endpoints exempt from rate limiting and load shedding
+UNLIMITED_ENDPOINTS = ("metrics", "static")
+
+# Admin endpoint requests allowed per client address per minute
+ADMIN_REQS_PER_MIN = 10
+
+# Peer state requests allowed per client address per minute: twice the rate at
+# which each peer syncs
+CLUSTER_STATE_REQS_PER_MIN = ceil(120 / max(configs.CLUSTER_SYNC_INTERVAL, 0.01))
+
+# Endpoints exempt from load shedding, but rate limited per client address whatever
+# the API key, and their limit per minute. Overloaded routers can still be profiled
+# and synced with, but admin keys can't be brute-forced, nor state exports flooded
+ADDRESS_LIMITS = {
+    "admin_profile": ADMIN_REQS_PER_MIN,
+    "cluster_state": CLUSTER_STATE_REQS_PER_MIN,
+}
+
+# Long-lived streaming endpoints, bounded by their own limits instead of counting
+# as in-flight requests
+STREAMING_ENDPOINTS = ("nodes_stream",)
+
+# Failures clients can report against a node
+FEEDBACK_REASONS = ("failed", "slow")
 
 
 class RESTServer:
@@ -21,42 +74,251 @@ class RESTServer:
         self: RESTServer,
         port: str,
         monitor: NodeMonitor,
+        reuse_port: bool = False,
+        cluster: Optional[Cluster] = None,
+        metrics: Optional[SharedMetrics] = None,
     ) -> None:
         """Initializes RESTServer
 
         Args:
             port (str): Port to serve on
             monitor (NodeMonitor): Node monitor
+            reuse_port (bool, optional): Whether to share the port with other
+                processes (SO_REUSEPORT), which the kernel then load-balances
+                connections across. Defaults to False.
+            cluster (Optional[Cluster], optional): Cluster this router is part of,
+                whose peers fetch its node state. Defaults to None.
+            metrics (Optional[SharedMetrics], optional): Metrics of all router
+                processes, to serve those of all of them from `/metrics` rather
+                than this process' own. Defaults to None.
         """
         self._address = "0.0.0.0"
         self._port = port
         self._monitor = monitor
+        self._cluster = cluster
+        self._metrics = metrics
+        self._cursors = CursorCache()
+        self._subscriptions = Subscriptions(monitor)
+        self._regions = RegionTable(configs.REGION_CIDRS)
+        self._region_cidrs = configs.REGION_CIDRS
 
         # Webserver setup
         self._app = Quart(__name__)
-        self._app_config = Config.from_mapping(
-            {"bind": [f"{self._address}:{self._port}"]}
-        )
+        self._socket: Optional[socket.socket] = None
+        if reuse_port:
+            # Bind the socket ourselves, since hypercorn only sets SO_REUSEPORT
+            # when it manages worker processes itself
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self._socket.bind((self._address, int(self._port)))
+            bind = f"fd://{self._socket.fileno()}"
+        else:
+            bind = f"{self._address}:{self._port}"
+        self._app_config = Config.from_mapping({"bind": [bind]})
+
+        # Admission control: load shedding, and per-client rate limits
+        self._admission = AdmissionControl()
+        self._limiter = RateLimiter()
 
-        # Initialize rate limiter
-        RateLimiter(self._app)
+        # Latest `/api/v1/ips` answers, served stale while overloaded
+        self._stale: OrderedDict[IpsKey, Encoded] = OrderedDict()
 
         # Register Quart routes
         self.register_routes()
+        self.register_metrics()
+
+        # Register admission control, after request instrumentation so that
+        # rejected requests are timed too
+        self.register_admission()
 
         # Event to signal shutdown
         self._shutdown_event = Event()
 
         log.info("Initialized RESTServer", port=self._port)
 
+    @staticmethod
+    def _encoded_response(encoded: Encoded) -> Tuple[Response, int]:
+        """Returns a pre-encoded JSON response, or 304 if the client's cached copy
+        (per `If-None-Match`) is still current
+
+        Args:
+            encoded (Encoded): Pre-encoded response body and entity tag
+
+        Returns:
+            Tuple[Response, int]: Response and status code
+        """
+        if request.if_none_match.contains_weak(encoded.etag):
+            response = Response(b"", status=304)
+            response.set_etag(encoded.etag)
+            return response, 304
+
+        response = Response(encoded.body, content_type="application/json")
+        response.set_etag(encoded.etag)
+        return response, 200
+
+    def _preferred_labels(self: RESTServer) -> Labels:
+        """Returns the node labels the client prefers: its `prefer` query
+        parameters, or else the region of its address (see `REGION_CIDRS`)
+
+        Returns:
+            Labels: Preferred labels, empty for no preference
+        """
+        prefer = parse_labels(request.args.getlist("prefer"))
+        if configs.REGION_CIDRS is not self._region_cidrs:
+            # Reloaded
+            self._region_cidrs = configs.REGION_CIDRS
+            try:
+                self._regions = RegionTable(self._region_cidrs)
+            except ValueError as e:
+                log.error(f"Invalid REGION_CIDRS, keeping previous: {str(e)}")
+        if prefer or not self._regions:
+            return prefer
+        region = self._regions.region(self._client_address())
+        return {"region": region} if region is not None else {}
+
+    def _page_response(
+        self: RESTServer, hosts: list[str], cursor: Optional[str]
+    ) -> Tuple[Response, int]:
+        """Returns a page of a paginated `/api/v1/ips` request, counting its nodes as
+        assigned
+
+        Args:
+            hosts (list[str]): Node hostnames or IPs
+            cursor (Optional[str]): Cursor to the next page, if any
+
+        Returns:
+            Tuple[Response, int]: Response and status code
+        """
+        self._monitor.assign(hosts)
+        response = jsonify(hosts)
+        if cursor is not None:
+            response.headers["X-Next-Cursor"] = cursor
+        return response, 200
+
+    def _stale_response(self: RESTServer) -> Optional[Tuple[Response, int]]:
+        """Returns the latest answer to an `/api/v1/ips` request, if it is memoized
+        (see `self._stale`), marked as stale
+
+        Returns:
+            Optional[Tuple[Response, int]]: Response and status code, if any
+        """
+        if (
+            request.endpoint != "ips"
+            or request.args.get("strategy", configs.ROUTING_STRATEGY) != "least"
+            or request.args.get("rank", configs.RANKING_MODE) != "pending"
+            or "cursor" in request.args
+            or "paginate" in request.args
+        ):
+            return None
+
+        key = (
+            frozenset(request.args.getlist("container")),
+            request.args.get("n", default=3, type=int),
+            request.args.get("offset", default=0, type=int),
+            frozenset(self._preferred_labels().items()),
+        )
+        encoded = self._stale.get(key)
+        if encoded is None:
+            return None
+
+        response, status = self._encoded_response(encoded)
+        response.headers["Warning"] = '110 - "Response is Stale"'
+        return response, status
+
+    @staticmethod
+    def _client_address() -> str:
+        """Returns the requesting client's address: the `X-Forwarded-For` entry
+        appended by the outermost of `TRUSTED_PROXY_HOPS` proxies, else the socket
+        address. Entries before it are set by the client, and can be forged"""
+        hops = configs.TRUSTED_PROXY_HOPS
+        forwarded = [
+            address.strip()
+            for address in request.headers.get("X-Forwarded-For", "").split(",")
+            if address.strip()
+        ]
+        if hops <= 0 or not forwarded:
+            return request.remote_addr or ""
+        return forwarded[max(len(forwarded) - hops, 0)]
+
+    @staticmethod
+    def _client() -> tuple[str, int]:
+        """Returns the requesting client's key, by API key (`X-API-Key`, see
+        `API_KEYS`) if known, else by address, and its rate limit per minute"""
+        tier = configs.API_KEYS.get(request.headers.get("X-API-Key", ""))
+        if tier is not None:
+            return (
+                f"key:{request.headers['X-API-Key']}",
+                configs.RATELIMIT_TIERS.get(tier, configs.RATELIMIT_REQS_PER_MIN),
+            )
+        return RESTServer._client_address(), configs.RATELIMIT_REQS_PER_MIN
+
+    def register_admission(self: RESTServer) -> None:
+        """Registers admission control: requests are shed while the router is
+        overloaded (see `AdmissionControl`), answered from stale memoized answers
+        where possible, and rate limited per client and route. Clients are keyed by
+        API key (`X-API-Key`, see `API_KEYS`) if known, else by address."""
+
+        @self._app.before_request
+        async def admit() -> Optional[Tuple[Response, int]]:
+            g.admitted = False
+            if request.endpoint in UNLIMITED_ENDPOINTS:
+                return None
+
+            address_limit = ADDRESS_LIMITS.get(request.endpoint or "")
+            if request.endpoint not in STREAMING_ENDPOINTS and address_limit is None:
+                if not self._admission.admit():
+                    g.shed = True
+                    stale = self._stale_response()
+                    if stale is not None:
+                        return stale
+                    response = jsonify({"error": "Router overloaded, retry later"})
+                    response.headers["Retry-After"] = str(SHED_RETRY_AFTER)
+                    return response, 503
+                g.admitted = True
+
+            client, limit = self._client()
+            if address_limit is not None:
+                client, limit = self._client_address(), address_limit
+            retry_after = self._limiter.acquire((request.endpoint, client), limit)
+            if retry_after > 0:
+                response = jsonify({"error": "Rate limit exceeded"})
+                response.headers["Retry-After"] = str(ceil(retry_after))
+                return response, 429
+            return None
+
+        @self._app.teardown_request
+        async def release(exc: Optional[BaseException]) -> None:
+            if g.get("admitted"):
+                self._admission.release()
+
     def register_routes(self: RESTServer) -> None:
         """Registers Quart webserver routes"""
 
         @self._app.route("/api/v1/ips", methods=["GET"])
-        @rate_limit(RATELIMIT_REQS_PER_MIN, timedelta(seconds=30))
         async def ips() -> Tuple[Response, int]:
             """Returns IPs of nodes that can fulfill a job request"""
 
+            # Rankings of paginated requests are cached per process, so a cursor
+            # can't be resolved by another REST worker
+            cursor = request.args.get("cursor")
+            paginate = request.args.get("paginate") == "true"
+            if (cursor is not None or paginate) and configs.WORKERS > 1:
+                return (
+                    jsonify({"error": "Pagination requires WORKERS=1"}),
+                    400,
+                )
+
+            # Follow-up pages of paginated requests
+            if cursor is not None:
+                n = request.args.get("n", default=3, type=int)
+                if n <= 0:
+                    return jsonify({"error": "n must be positive"}), 400
+                page = self._cursors.next_page(cursor, n)
+                if page is None:
+                    return jsonify({"error": "Invalid or expired cursor"}), 410
+                return self._page_response(*page)
+
             containers = request.args.getlist("container")
             if not containers:
                 return (
@@ -64,22 +326,295 @@ class RESTServer:
                     400,
                 )
 
-            # Optional query parameters n and offset
+            # Optional query parameters n, offset, strategy and rank
             n = request.args.get("n", default=3, type=int)
             offset = request.args.get("offset", default=0, type=int)
+            strategy = request.args.get("strategy", default=configs.ROUTING_STRATEGY)
+            if strategy not in STRATEGIES:
+                return (
+                    jsonify(
+                        {"error": f"Unknown strategy, expected one of {STRATEGIES}"}
+                    ),
+                    400,
+                )
+            rank = request.args.get("rank", default=configs.RANKING_MODE)
+            if rank not in RANK_MODES:
+                return (
+                    jsonify({"error": f"Unknown rank, expected one of {RANK_MODES}"}),
+                    400,
+                )
+
+            prefer = self._preferred_labels()
+
+            if paginate:
+                if strategy != "least":
+                    return (
+                        jsonify({"error": "Pagination requires strategy least"}),
+                        400,
+                    )
+                if n <= 0:
+                    return jsonify({"error": "n must be positive"}), 400
+                page = self._cursors.first_page(
+                    self._monitor.snapshot().version,
+                    rank,
+                    containers,
+                    max(offset, 0),
+                    n,
+                    lambda: self._monitor.rank_nodes(containers, rank, prefer),
+                    prefer,
+                )
+                return self._page_response(*page)
+
+            if strategy == "least" and rank == "pending":
+                # Deterministic answers are memoized per snapshot, keyed on the
+                # container set and preferred labels, unless in-flight jobs (which
+                # change with every answer) take part in ranking
+                snapshot = self._monitor.snapshot()
+                key = (frozenset(containers), n, offset, frozenset(prefer.items()))
+                memoize = configs.INFLIGHT_HALF_LIFE <= 0
+                answer = snapshot.get_ips(key) if memoize else None
+                if answer is None:
+                    hosts = self._monitor.get_nodes(
+                        containers, n, offset, prefer=prefer
+                    )
+                    answer = (
+                        snapshot.put_ips(key, hosts)
+                        if memoize
+                        else (hosts, Encoded.from_json(hosts))
+                    )
+                hosts, encoded = answer
+                self._stale[key] = encoded
+                self._stale.move_to_end(key)
+                if len(self._stale) > IPS_CACHE_SIZE:
+                    self._stale.popitem(last=False)
+            else:
+                hosts = self._monitor.get_nodes(
+                    containers, n, offset, strategy, rank, prefer
+                )
+                encoded = Encoded.from_json(hosts)
+
+            self._monitor.assign(hosts)
+            return self._encoded_response(encoded)
+
+        @self._app.route("/api/v1/ips/stream", methods=["GET"])
+        async def ips_stream() -> Tuple[Response, int]:
+            """Streams IPs of all nodes that can fulfill a job request, best first,
+            as newline-delimited JSON"""
+
+            containers = request.args.getlist("container")
+            if not containers:
+                return (
+                    jsonify({"error": "No containers specified"}),
+                    400,
+                )
+            rank = request.args.get("rank", default=configs.RANKING_MODE)
+            if rank not in RANK_MODES:
+                return (
+                    jsonify({"error": f"Unknown rank, expected one of {RANK_MODES}"}),
+                    400,
+                )
+
+            # Ranked at once, so the listing is consistent
+            hosts = self._monitor.rank_nodes(containers, rank, self._preferred_labels())
+
+            async def lines() -> AsyncGenerator[bytes, None]:
+                for i in range(0, len(hosts), STREAM_CHUNK_SIZE):
+                    chunk = hosts[i : i + STREAM_CHUNK_SIZE]
+                    yield "".join(f"{json.dumps(host)}\n" for host in chunk).encode()
 
             return (
-                jsonify(self._monitor.get_nodes(containers, n, offset)),
+                Response(IterableBody(lines()), content_type="application/x-ndjson"),
                 200,
             )
 
+        @self._app.route("/api/v1/nodes/stream", methods=["GET"])
+        async def nodes_stream() -> Tuple[Response, int]:
+            """Streams the available node table as Server-Sent Events: a snapshot,
+            then deltas (see `Subscriptions`)"""
+
+            if self._subscriptions.full():
+                response = jsonify({"error": "Too many subscribers, retry later"})
+                response.headers["Retry-After"] = str(SHED_RETRY_AFTER)
+                return response, 503
+
+            last_event_id = request.headers.get(
+                "Last-Event-ID", request.args.get("last_event_id")
+            )
+            response = Response(
+                IterableBody(self._subscriptions.stream(last_event_id)),
+                content_type="text/event-stream",
+            )
+            response.headers["Cache-Control"] = "no-cache"
+            response.timeout = None
+            return response, 200
+
+        @self._app.route("/api/v1/ips/batch", methods=["POST"])
+        async def ips_batch() -> Tuple[Response, int]:
+            """Returns IPs of nodes for each of a batch of job requests"""
+
+            body = await request.get_json(silent=True)
+            if (
+                not isinstance(body, list)
+                or not 0 < len(body) <= MAX_BATCH_SIZE
+                or not all(
+                    isinstance(item, dict)
+                    and isinstance(item.get("containers"), list)
+                    and item["containers"]
+                    and all(isinstance(c, str) for c in item["containers"])
+                    and isinstance(item.get("n", 3), int)
+                    for item in body
+                )
+            ):
+                return (
+                    jsonify(
+                        {
+                            "error": "Expected a list of up to "
+                            f"{MAX_BATCH_SIZE} requests, each with containers"
+                        }
+                    ),
+                    400,
+                )
+
+            rank = request.args.get("rank", default=configs.RANKING_MODE)
+            if rank not in RANK_MODES:
+                return (
+                    jsonify({"error": f"Unknown rank, expected one of {RANK_MODES}"}),
+                    400,
+                )
+
+            results = self._monitor.get_nodes_batch(
+                [(item["containers"], item.get("n", 3)) for item in body], rank
+            )
+            self._monitor.assign([host for hosts in results for host in hosts])
+
+            return jsonify(results), 200
+
+        @self._app.route("/api/v1/feedback", methods=["POST"])
+        async def feedback() -> Tuple[Response, int]:
+            """Records a client's report that a node failed to serve a job. Nodes
+            are ejected on reports by distinct clients"""
+
+            body = await request.get_json(silent=True)
+            if (
+                not isinstance(body, dict)
+                or not isinstance(body.get("node"), str)
+                or body.get("reason", "failed") not in FEEDBACK_REASONS
+            ):
+                return (
+                    jsonify(
+                        {
+                            "error": "Expected a node, and optionally a reason in "
+                            f"{FEEDBACK_REASONS}"
+                        }
+                    ),
+                    400,
+                )
+
+            ejected = self._monitor.report_failure(
+                body["node"], body.get("reason", "failed"), self._client()[0]
+            )
+            return jsonify({"ejected": ejected}), 200
+
         @self._app.route("/api/v1/containers", methods=["GET"])
-        @rate_limit(RATELIMIT_REQS_PER_MIN, timedelta(seconds=30))
         async def containers() -> Tuple[Response, int]:
             """Returns containers running across the network"""
 
+            return self._encoded_response(self._monitor.snapshot().containers)
+
+        @self._app.route("/admin/profile", methods=["GET"])
+        async def admin_profile() -> Tuple[Response, int]:
+            """Profiles this process' event loop for some seconds, for admins"""
+
+            key = request.headers.get("X-API-Key", "")
+            if not any(compare_digest(key, admin) for admin in configs.ADMIN_API_KEYS):
+                return jsonify({"error": "Admin API key required"}), 403
+
+            seconds = request.args.get("seconds", default=10.0, type=float)
+            if not 0 < seconds <= PROFILE_MAX_SECONDS:
+                return (
+                    jsonify(
+                        {"error": f"seconds must be in (0, {PROFILE_MAX_SECONDS}]"}
+                    ),
+                    400,
+                )
+            mode = request.args.get("mode", default="sample")
+            if mode not in PROFILE_MODES:
+                return (
+                    jsonify(
+                        {"error": f"Unknown mode, expected one of {PROFILE_MODES}"}
+                    ),
+                    400,
+                )
+
+            loop = self._admission.loop
+            if loop.capturing:
+                return jsonify({"error": "A profile is already being captured"}), 409
+
+            log.info("Capturing profile", seconds=seconds, mode=mode)
+            profile = await loop.profile(seconds, mode)
+            if mode == "cprofile":
+                response = Response(profile, content_type="application/octet-stream")
+                filename = "router.prof"
+            else:
+                response = Response(profile, content_type="text/plain")
+                filename = "router.folded"
+            response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+            return response, 200
+
+        if self._cluster is not None:
+            cluster = self._cluster
+
+            @self._app.route("/api/v1/cluster/state", methods=["GET"])
+            async def cluster_state() -> Tuple[Response, int]:
+                """Returns node state of this router's shard, for its peers"""
+
+                since = request.args.get("since", type=int)
+                epoch = request.args.get("epoch")
+                return jsonify(cluster.state(since, epoch)), 200
+
+    def register_metrics(self: RESTServer) -> None:
+        """Registers request instrumentation, and the `/metrics` route"""
+
+        # Metric children are created once per route, not per request
+        route_metrics: dict[str, tuple[HistogramValue, CounterValue, CounterValue]] = {
+            rule.endpoint: (
+                REQUEST_SECONDS.labels(rule.rule),
+                RATE_LIMITED.labels(rule.rule),
+                SHED_REQUESTS.labels(rule.rule),
+            )
+            for rule in self._app.url_map.iter_rules()
+            if rule.endpoint != "static"
+        }
+
+        @self._app.before_request
+        async def start_timer() -> None:
+            g.started = perf_counter()
+
+        @self._app.after_request
+        async def record_request(response: Response) -> Response:
+            metrics = route_metrics.get(request.endpoint or "")
+            if metrics is not None:
+                metrics[0].observe(perf_counter() - g.started)
+                if response.status_code == 429:
+                    metrics[1].inc()
+                if g.get("shed"):
+                    metrics[2].inc()
+            return response
+
+        @self._app.route("/metrics", methods=["GET"])
+        async def metrics() -> Tuple[Response, int]:
+            """Returns router metrics in the Prometheus text exposition format"""
+
+            def collect() -> str:
+                if self._metrics is None:
+                    return render()
+                return render(self._metrics.collect())
+
+            # Rendered off the event loop: per-node series add up on large fleets
             return (
-                jsonify(self._monitor.get_containers()),
+                Response(
+                    await to_thread(collect), content_type="text/plain; version=0.0.4"
+                ),
                 200,
             )
 
@@ -92,6 +627,7 @@ class RESTServer:
             """Shutdown trigger for hypercorn"""
             await self._shutdown_event.wait()
 
+        lag_task = create_task(self._admission.loop.run_forever())
         server_task = create_task(
             serve(
                 app=self._app,
@@ -106,10 +642,14 @@ class RESTServer:
             await server_task
         except CancelledError:
             pass  # Expected due to cancellation
+        finally:
+            await self._admission.loop.stop()
+            await lag_task
 
     async def stop(self: RESTServer) -> None:
         """Stops the RESTServer."""
         log.info("Stopping REST webserver")
 
-        # Set shutdown event to stop server
+        # End subscriptions, and set shutdown event to stop server
+        await self._subscriptions.stop()
         self._shutdown_event.set()
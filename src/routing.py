@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from math import exp, log
+from random import Random
+from time import monotonic
+from typing import Hashable, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# Node selection strategies
+STRATEGIES = ("least", "p2c", "weighted")
+
+# Node ranking modes
+RANK_MODES = ("pending", "latency")
+
+# Randomized strategies choose among this many times the requested node count
+CANDIDATE_FACTOR = 2
+
+# Smoothing factor of latency EWMAs, i.e. weight of the newest sample
+LATENCY_EWMA_ALPHA = 0.3
+
+# Upper bounds in seconds of latency sketch buckets: from 1ms, growing by 25% per
+# bucket up to ~45s. Percentiles are accurate to within one bucket.
+LATENCY_BUCKETS = tuple(0.001 * 1.25**i for i in range(49))
+
+# Sketch counts are halved once they reach this many samples, favoring recent ones
+LATENCY_SKETCH_SAMPLES = 256
+
+
+class DecayingCounter:
+    """Per-key counters that decay exponentially over time
+
+    Private attributes:
+        _half_life (float): Half-life of counts in seconds. Counting is disabled if 0
+        _counts (dict[str, tuple[float, float]]): Key -> (count, last update time)
+
+    Methods:
+        add: Increment a key's count
+        get: Current count of a key
+        clear: Reset a key's count
+    """
+
+    def __init__(self: DecayingCounter, half_life: float) -> None:
+        """Initializes DecayingCounter
+
+        Args:
+            half_life (float): Half-life of counts in seconds, 0 to disable counting
+        """
+        self._half_life = half_life
+        self._counts: dict[str, tuple[float, float]] = {}
+
+    def __bool__(self: DecayingCounter) -> bool:
+        return bool(self._counts)
+
+    def _decayed(self: DecayingCounter, key: str, now: float) -> float:
+        count, updated = self._counts.get(key, (0.0, now))
+        return count * exp(-log(2) * (now - updated) / self._half_life)
+
+    def add(self: DecayingCounter, key: str, amount: float = 1) -> None:
+        """Increments a key's count
+
+        Args:
+            key (str): Key
+            amount (float): Increment
+        """
+        if self._half_life <= 0:
+            return
+
+        now = monotonic()
+        self._counts[key] = (self._decayed(key, now) + amount, now)
+
+    def get(self: DecayingCounter, key: str) -> float:
+        """Returns a key's current count, dropping it once decayed to ~0
+
+        Args:
+            key (str): Key
+
+        Returns:
+            float: Current count
+        """
+        if key not in self._counts:
+            return 0
+
+        count = self._decayed(key, monotonic())
+        if count < 0.01:
+            del self._counts[key]
+            return 0
+        return count
+
+    def clear(self: DecayingCounter, key: str) -> bool:
+        """Resets a key's count
+
+        Args:
+            key (str): Key
+
+        Returns:
+            bool: Whether the key had a count
+        """
+        return self._counts.pop(key, None) is not None
+
+
+class LatencyStats:
+    """Latency of a node's probes, as an EWMA and a log-bucketed percentile sketch
+
+    Public attributes:
+        ewma (Optional[float]): Exponentially weighted moving average in seconds,
+            None until the first sample
+        counts (Optional[list[int]]): Sample counts per `LATENCY_BUCKETS` bucket,
+            plus one overflow bucket. None until the first sample, so that stats
+            mirrored from another process only hold the EWMA
+        samples (int): Number of samples in the sketch
+
+    Methods:
+        record: Record a latency sample
+        percentile: Estimate a latency percentile
+    """
+
+    __slots__ = ("ewma", "counts", "samples")
+
+    def __init__(self: LatencyStats, ewma: Optional[float] = None) -> None:
+        """Initializes LatencyStats
+
+        Args:
+            ewma (Optional[float]): Initial EWMA in seconds, e.g. when mirroring
+                another process' stats
+        """
+        self.ewma = ewma
+        self.counts: Optional[list[int]] = None
+        self.samples = 0
+
+    def record(self: LatencyStats, seconds: float) -> None:
+        """Records a latency sample
+
+        Args:
+            seconds (float): Latency in seconds
+        """
+        if self.ewma is None:
+            self.ewma = seconds
+        else:
+            self.ewma += LATENCY_EWMA_ALPHA * (seconds - self.ewma)
+
+        if self.counts is None:
+            self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        elif self.samples >= LATENCY_SKETCH_SAMPLES:
+            self.counts = [count // 2 for count in self.counts]
+            self.samples = sum(self.counts)
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.samples += 1
+
+    def percentile(self: LatencyStats, q: float) -> Optional[float]:
+        """Estimates a latency percentile from the sketch
+
+        Args:
+            q (float): Percentile, between 0 and 100
+
+        Returns:
+            Optional[float]: Upper bound of the bucket holding the percentile in
+                seconds, None without samples
+        """
+        if self.counts is None or not self.samples:
+            return None
+
+        rank = q / 100 * self.samples
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return LATENCY_BUCKETS[min(i, len(LATENCY_BUCKETS) - 1)]
+        return LATENCY_BUCKETS[-1]
+
+
+class CircuitBreaker:
+    """Per-key circuit breakers, tripped by failure reports
+
+    A key's circuit opens once `threshold` distinct reporters report it within
+    `window` seconds, so that a single client can't open circuits. It stays open
+    for `cooldown` seconds, then turns half-open, until a successful check closes
+    it again.
+
+    Private attributes:
+        _threshold (int): Reports within a window that open a circuit. Disabled if 0
+        _window (float): Window in seconds over which reports are counted
+        _cooldown (float): Time in seconds an open circuit rejects checks
+        _reports (dict[str, dict[Hashable, float]]): Key -> reporter -> time of its
+            latest report
+        _opened (dict[str, float]): Key -> time its circuit opened
+
+    Methods:
+        report: Record a failure report
+        allows: Whether a key's circuit is closed or half-open
+        close: Close a key's circuit
+        remove: Forget a key
+    """
+
+    def __init__(
+        self: CircuitBreaker, threshold: int, window: float, cooldown: float
+    ) -> None:
+        """Initializes CircuitBreaker
+
+        Args:
+            threshold (int): Reports within a window that open a circuit, 0 to
+                disable
+            window (float): Window in seconds over which reports are counted
+            cooldown (float): Time in seconds an open circuit rejects checks, before
+                it turns half-open
+        """
+        self._threshold = threshold
+        self._window = window
+        self._cooldown = cooldown
+        self._reports: dict[str, dict[Hashable, float]] = {}
+        self._opened: dict[str, float] = {}
+
+    def __contains__(self: CircuitBreaker, key: str) -> bool:
+        """Whether a key's circuit is open or half-open"""
+        return key in self._opened
+
+    def report(self: CircuitBreaker, key: str, reporter: Hashable) -> bool:
+        """Records a failure report. Repeated reports by the same reporter only
+        refresh its report
+
+        Args:
+            key (str): Key
+            reporter (Hashable): Who reported the failure, e.g. a client
+
+        Returns:
+            bool: Whether the report opened the key's circuit
+        """
+        if self._threshold <= 0 or key in self._opened:
+            return False
+
+        now = monotonic()
+        reports = self._reports.setdefault(key, {})
+        reports[reporter] = now
+        for expired in [r for r, at in reports.items() if at <= now - self._window]:
+            del reports[expired]
+        if len(reports) < self._threshold:
+            return False
+
+        del self._reports[key]
+        self._opened[key] = now
+        return True
+
+    def allows(self: CircuitBreaker, key: str) -> bool:
+        """Whether a key's circuit is closed, or half-open (cooldown elapsed)
+
+        Args:
+            key (str): Key
+
+        Returns:
+            bool: Whether checks of the key are allowed
+        """
+        opened = self._opened.get(key)
+        return opened is None or monotonic() - opened >= self._cooldown
+
+    def close(self: CircuitBreaker, key: str) -> None:
+        """Closes a key's circuit, e.g. after a successful half-open check
+
+        Args:
+            key (str): Key
+        """
+        self._opened.pop(key, None)
+
+    def remove(self: CircuitBreaker, key: str) -> None:
+        """Forgets a key's reports and circuit
+
+        Args:
+            key (str): Key
+        """
+        self._reports.pop(key, None)
+        self._opened.pop(key, None)
+
+
+def choose(
+    strategy: str,
+    ranked: Sequence[tuple[float, T]],
+    n: int,
+    rng: Random,
+) -> list[T]:
+    """Chooses n items among candidates ranked by ascending load
+
+    Args:
+        strategy (str): One of `STRATEGIES`. "least" takes the first n candidates,
+            "p2c" repeatedly takes the less loaded of two random candidates, and
+            "weighted" samples candidates with probability inversely proportional to
+            their load
+        ranked (Sequence[tuple[float, T]]): (load, item) pairs, by ascending load
+        n (int): Number of items to choose
+        rng (Random): Random number generator
+
+    Returns:
+        list[T]: Chosen items, in order of preference
+    """
+    if strategy == "least" or len(ranked) <= n:
+        return [item for _, item in ranked[:n]]
+
+    pool = list(ranked[: n * CANDIDATE_FACTOR])
+    chosen: list[T] = []
+    while pool and len(chosen) < n:
+        if strategy == "p2c":
+            i, j = rng.randrange(len(pool)), rng.randrange(len(pool))
+            pick = i if pool[i][0] <= pool[j][0] else j
+        else:
+            pick = rng.choices(
+                range(len(pool)), weights=[1 / (1 + load) for load, _ in pool]
+            )[0]
+        chosen.append(pool.pop(pick)[1])
+    return chosen
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+from asyncio import Event, TimeoutError, wait_for
+from heapq import heappop, heappush
+from random import uniform
+from time import monotonic
+from typing import Optional
+
+import configs
+
+# Relative jitter applied to every probe delay, to spread probes over time
+PROBE_JITTER = 0.1
+
+
+def probe_delay(available: bool, load: int, failures: int) -> float:
+    """Computes the delay until a node should be probed again
+
+    Healthy nodes are probed every `REFRESH_INTERVAL`, busy nodes proportionally
+    more often (down to `MIN_PROBE_INTERVAL`) since their pending counts change
+    faster, and unreachable nodes back off exponentially (up to
+    `MAX_PROBE_BACKOFF`).
+
+    Args:
+        available (bool): Whether the last probe succeeded
+        load (int): Pending job count reported by the last successful probe
+        failures (int): Number of consecutive failed probes
+
+    Returns:
+        float: Delay in seconds, jittered
+    """
+    # Read on every call, since they may be reloaded
+    interval = configs.REFRESH_INTERVAL
+    if available:
+        delay = max(configs.MIN_PROBE_INTERVAL, interval / (1 + load))
+    else:
+        delay = min(configs.MAX_PROBE_BACKOFF, interval * 2 ** max(failures - 1, 0))
+
+    return delay * uniform(1 - PROBE_JITTER, 1 + PROBE_JITTER)
+
+
+class ProbeScheduler:
+    """Per-node probe timers with a global probe rate budget
+
+    Each scheduled host has its own due time. Hosts are handed out one at a time
+    once due, at most `PROBE_RATE` per second. A host handed out by `next` is not
+    scheduled again until it is explicitly rescheduled, so a node is never probed
+    concurrently with itself.
+
+    Private attributes:
+        _heap (list[tuple[float, int, str]]): (due time, sequence, host) heap.
+            May contain stale entries, which are skipped
+        _due (dict[str, float]): Current due time of each scheduled host
+        _seq (int): Heap insertion counter, breaks ties between equal due times
+        _tokens (float): Available probe budget
+        _refilled (float): Last time the probe budget was refilled
+        _wakeup (Event): Set when a host is scheduled, to re-evaluate the next due
+
+    Methods:
+        schedule: Schedule a host to be probed after a delay
+        remove: Stop scheduling a host
+        next: Wait for the next due host
+    """
+
+    def __init__(self: ProbeScheduler) -> None:
+        """Initializes ProbeScheduler"""
+        self._heap: list[tuple[float, int, str]] = []
+        self._due: dict[str, float] = {}
+        self._seq = 0
+        self._tokens = 1.0
+        self._refilled = monotonic()
+        self._wakeup = Event()
+
+    def __contains__(self: ProbeScheduler, host: str) -> bool:
+        return host in self._due
+
+    def __len__(self: ProbeScheduler) -> int:
+        return len(self._due)
+
+    def schedule(self: ProbeScheduler, host: str, delay: float) -> None:
+        """Schedules a host to be probed after a delay, replacing any earlier timer
+
+        Args:
+            host (str): Node hostname or IP
+            delay (float): Delay in seconds
+        """
+        due = monotonic() + delay
+        self._due[host] = due
+        self._seq += 1
+        heappush(self._heap, (due, self._seq, host))
+        self._wakeup.set()
+
+    def schedule_initial(self: ProbeScheduler, host: str) -> None:
+        """Schedules a newly discovered host, with a jittered start time
+
+        Args:
+            host (str): Node hostname or IP
+        """
+        self.schedule(host, uniform(0, configs.REFRESH_INTERVAL * PROBE_JITTER))
+
+    def remove(self: ProbeScheduler, host: str) -> None:
+        """Stops scheduling a host. Its heap entry is dropped lazily.
+
+        Args:
+            host (str): Node hostname or IP
+        """
+        self._due.pop(host, None)
+
+    def _take_token(self: ProbeScheduler) -> float:
+        """Takes one probe from the budget if available
+
+        Returns:
+            float: 0 if a probe was taken, otherwise seconds until one is available
+        """
+        rate = configs.PROBE_RATE
+        if rate <= 0:
+            return 0
+
+        now = monotonic()
+        self._tokens = min(max(rate, 1.0), self._tokens + (now - self._refilled) * rate)
+        self._refilled = now
+
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / rate
+
+    async def next(self: ProbeScheduler, timeout: float) -> Optional[str]:
+        """Waits for the next due host, within the probe budget
+
+        Args:
+            timeout (float): Maximum time to wait in seconds
+
+        Returns:
+            Optional[str]: Due host, or None if none became due within timeout
+        """
+        deadline = monotonic() + timeout
+
+        while True:
+            # Drop stale entries left behind by reschedules and removals
+            while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+                heappop(self._heap)
+
+            now = monotonic()
+            wait = deadline - now
+            if self._heap:
+                due = self._heap[0][0]
+                if due <= now:
+                    budget_wait = self._take_token()
+                    if budget_wait == 0:
+                        host = heappop(self._heap)[2]
+                        del self._due[host]
+                        return host
+                    wait = min(wait, budget_wait)
+                else:
+                    wait = min(wait, due - now)
+
+            if now >= deadline:
+                return None
+
+            # Sleep until something is due, or a new host is scheduled
+            self._wakeup.clear()
+            try:
+                await wait_for(self._wakeup.wait(), timeout=max(wait, 0))
+            except TimeoutError:
+                pass
@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import marshal
+from asyncio import sleep, to_thread
+from multiprocessing.shared_memory import SharedMemory
+from struct import Struct
+from typing import Generic, Optional, Sequence, TypeVar, cast
+
+from configs import SHARED_MEMORY_SIZE, SHARED_STATE_INTERVAL
+from logger import log
+from metrics import MetricsExport, export
+from monitor import NodeMonitor, NodeTable
+
+# Tables that can be shared: plain data, in the `marshal` format
+T = TypeVar("T", NodeTable, MetricsExport)
+
+# Header: generation, then (sequence, length) for each of the two payload slots
+HEADER = Struct("<QQQQQ")
+
+# Size in bytes of each process' shared memory segment holding its metrics
+METRICS_MEMORY_SIZE = 16 * 1024 * 1024
+
+# Interval in seconds at which each process publishes its metrics
+METRICS_INTERVAL = 5.0
+
+
+class SharedTable(Generic[T]):
+    """Table (e.g. the node table) shared between processes through a shared memory
+    segment, in the `marshal` format
+
+    The segment holds two payload slots. A single writer encodes each new table
+    into the slot not referenced by the current generation, then bumps the
+    generation. Each slot is guarded by a sequence counter (odd while being
+    written), so readers never take a lock: they check the generation, decode the
+    referenced slot in place, and retry if its sequence changed meanwhile.
+
+    Private attributes:
+        _shm (SharedMemory): Shared memory segment
+        _slot_size (int): Size of each payload slot in bytes
+        _generation (int): Last generation written or read by this process
+
+    Methods:
+        write: Publish a new table (writer only)
+        read: Read the table if a new generation was published
+        close: Detach from (and optionally destroy) the segment
+    """
+
+    def __init__(
+        self: SharedTable[T], name: Optional[str] = None, size: int = SHARED_MEMORY_SIZE
+    ) -> None:
+        """Initializes SharedTable, creating a new segment or attaching to one
+
+        Args:
+            name (Optional[str]): Name of the segment to attach to. Creates a new
+                segment if not provided
+            size (int): Size of the segment to create, in bytes
+        """
+        if name is None:
+            self._shm = SharedMemory(create=True, size=size)
+            HEADER.pack_into(self._shm.buf, 0, 0, 0, 0, 0, 0)
+        else:
+            self._shm = SharedMemory(name=name)
+
+        self._slot_size = (self._shm.size - HEADER.size) // 2
+        self._generation = 0
+
+    @property
+    def name(self: SharedTable[T]) -> str:
+        """Name of the shared memory segment, to attach to from other processes"""
+        return self._shm.name
+
+    def write(self: SharedTable[T], table: T) -> bool:
+        """Publishes a new table
+
+        Args:
+            table (T): Table, of plain data
+
+        Returns:
+            bool: Whether the table fit in a slot and was published
+        """
+        payload = marshal.dumps(table)
+        if len(payload) > self._slot_size:
+            log.error(
+                "Table exceeds shared memory slot",
+                size=len(payload),
+                slot_size=self._slot_size,
+            )
+            return False
+
+        buf = self._shm.buf
+        header = list(HEADER.unpack_from(buf, 0))
+        generation = header[0] + 1
+        slot = generation % 2
+        seq_field, len_field = 1 + 2 * slot, 2 + 2 * slot
+        offset = HEADER.size + slot * self._slot_size
+
+        # Mark slot as being written, write payload, then mark it stable again
+        header[seq_field] += 1
+        HEADER.pack_into(buf, 0, *header)
+        buf[offset : offset + len(payload)] = payload
+        header[seq_field] += 1
+        header[len_field] = len(payload)
+        HEADER.pack_into(buf, 0, *header)
+
+        # Point readers at the new slot
+        header[0] = generation
+        HEADER.pack_into(buf, 0, *header)
+        self._generation = generation
+        return True
+
+    def read(self: SharedTable[T]) -> Optional[T]:
+        """Reads the table if a new generation was published since the last read
+
+        Returns:
+            Optional[T]: Table, or None if unchanged
+        """
+        buf = self._shm.buf
+
+        while True:
+            header = HEADER.unpack_from(buf, 0)
+            generation = header[0]
+            if generation == self._generation:
+                return None
+
+            slot = generation % 2
+            seq, length = header[1 + 2 * slot], header[2 + 2 * slot]
+            if seq % 2:
+                # Writer lapped this reader and is rewriting the slot, retry
+                continue
+
+            offset = HEADER.size + slot * self._slot_size
+            try:
+                table = marshal.loads(buf[offset : offset + length])
+            except (EOFError, ValueError, TypeError):
+                table = None
+
+            # Discard if the slot was rewritten while decoding
+            if HEADER.unpack_from(buf, 0)[1 + 2 * slot] != seq or table is None:
+                continue
+
+            self._generation = generation
+            return cast(T, table)
+
+    def close(self: SharedTable[T], unlink: bool = False) -> None:
+        """Detaches from the shared memory segment
+
+        Args:
+            unlink (bool): Whether to also destroy the segment. Only the creating
+                process should do so
+        """
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+class SnapshotPublisher:
+    """Publishes a NodeMonitor's node table to a SharedTable whenever it changes,
+    at most every `SHARED_STATE_INTERVAL` seconds"""
+
+    def __init__(
+        self: SnapshotPublisher, monitor: NodeMonitor, table: SharedTable[NodeTable]
+    ) -> None:
+        """Initializes SnapshotPublisher
+
+        Args:
+            monitor (NodeMonitor): Node monitor owning the node state
+            table (SharedTable[NodeTable]): Shared table to publish to
+        """
+        self._monitor = monitor
+        self._table = table
+        self._shutdown = False
+
+    async def run_forever(self: SnapshotPublisher) -> None:
+        """Main lifecycle loop"""
+        version: Optional[int] = None
+        while not self._shutdown:
+            snapshot = self._monitor.snapshot()
+            if snapshot.version != version and self._table.write(
+                self._monitor.export_table()
+            ):
+                version = snapshot.version
+
+            await sleep(SHARED_STATE_INTERVAL)
+
+    async def stop(self: SnapshotPublisher) -> None:
+        """Stop publisher"""
+        self._shutdown = True
+
+
+class SnapshotFollower:
+    """Keeps a (non-probing) NodeMonitor in sync with a SharedTable, checking for
+    new generations every `SHARED_STATE_INTERVAL` seconds"""
+
+    def __init__(
+        self: SnapshotFollower, monitor: NodeMonitor, table: SharedTable[NodeTable]
+    ) -> None:
+        """Initializes SnapshotFollower
+
+        Args:
+            monitor (NodeMonitor): Node monitor to load node state into
+            table (SharedTable[NodeTable]): Shared table to read from
+        """
+        self._monitor = monitor
+        self._table = table
+        self._shutdown = False
+
+    async def run_forever(self: SnapshotFollower) -> None:
+        """Main lifecycle loop"""
+        while not self._shutdown:
+            table = self._table.read()
+            if table is not None:
+                self._monitor.load_table(table)
+
+            await sleep(SHARED_STATE_INTERVAL)
+
+    async def stop(self: SnapshotFollower) -> None:
+        """Stop follower"""
+        self._shutdown = True
+
+
+class SharedMetrics:
+    """Metrics of all router processes, shared through one SharedTable per process
+
+    Each process publishes its own metrics every `METRICS_INTERVAL` seconds, so
+    that whichever process serves a scrape renders those of all processes, labeled
+    by process. Counters then never go backwards between scrapes served by
+    different processes.
+
+    Private attributes:
+        _tables (Sequence[SharedTable[MetricsExport]]): Each process' table
+        _index (int): This process' index: 0 for the poller, then REST workers
+        _latest (list[MetricsExport]): Latest metrics read from each process
+        _shutdown (bool): Set to stop publishing
+
+    Methods:
+        collect: Latest metrics of all processes
+        run_forever: Publish this process' metrics every interval
+        stop: Stop publishing
+        close: Detach from (and optionally destroy) the segments
+    """
+
+    def __init__(
+        self: SharedMetrics, tables: Sequence[SharedTable[MetricsExport]], index: int
+    ) -> None:
+        """Initializes SharedMetrics
+
+        Args:
+            tables (Sequence[SharedTable[MetricsExport]]): Each process' table
+            index (int): This process' index in `tables`
+        """
+        self._tables = tables
+        self._index = index
+        self._latest: list[MetricsExport] = [{} for _ in tables]
+        self._shutdown = False
+
+    @staticmethod
+    def process_name(index: int) -> str:
+        """Name of the process at an index, as in its metrics' `process` label"""
+        return "poller" if index == 0 else f"worker-{index}"
+
+    def collect(self: SharedMetrics) -> list[tuple[str, MetricsExport]]:
+        """Returns the latest metrics of all processes, this one's current. Only
+        reads metric values, so it may run off the event loop
+
+        Returns:
+            list[tuple[str, MetricsExport]]: Process names and their metrics
+        """
+        for i, table in enumerate(self._tables):
+            if i == self._index:
+                self._latest[i] = export()
+                continue
+            metrics = table.read()
+            if metrics is not None:
+                self._latest[i] = metrics
+        return [
+            (self.process_name(i), metrics) for i, metrics in enumerate(self._latest)
+        ]
+
+    async def run_forever(self: SharedMetrics) -> None:
+        """Main lifecycle loop"""
+        table = self._tables[self._index]
+        while not self._shutdown:
+            # Exporting all metrics (e.g. per node) is kept off the event loop
+            await to_thread(lambda: table.write(export()))
+            await sleep(METRICS_INTERVAL)
+
+    async def stop(self: SharedMetrics) -> None:
+        """Stop publishing"""
+        self._shutdown = True
+
+    def close(self: SharedMetrics, unlink: bool = False) -> None:
+        """Detaches from the shared memory segments
+
+        Args:
+            unlink (bool): Whether to also destroy the segments. Only the creating
+                process should do so
+        """
+        for table in self._tables:
+            table.close(unlink)
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from hashlib import blake2b
+from typing import Any, Optional
+
+# Maximum number of memoized `/api/v1/ips` answers per snapshot
+IPS_CACHE_SIZE = 1024
+
+# Memo key of an `/api/v1/ips` answer: (container set, n, offset, preferred labels)
+IpsKey = tuple[frozenset[str], int, int, frozenset[tuple[str, str]]]
+
+
+@dataclass(frozen=True)
+class Encoded:
+    """Pre-encoded JSON response body and its entity tag"""
+
+    body: bytes
+    etag: str
+
+    @classmethod
+    def from_json(cls: type[Encoded], obj: Any) -> Encoded:
+        """Encodes a JSON-serializable object, tagging it by content hash
+
+        Tagging by content (rather than by version) lets clients keep getting 304s
+        when the state changes in ways that don't affect their response.
+
+        Args:
+            obj (Any): JSON-serializable object
+
+        Returns:
+            Encoded: Encoded response
+        """
+        body = json.dumps(obj, separators=(",", ":"), sort_keys=True).encode()
+        return cls(body=body, etag=blake2b(body, digest_size=8).hexdigest())
+
+
+# Memoized `/api/v1/ips` answer: selected hosts and their encoding
+IpsAnswer = tuple[list[str], Encoded]
+
+
+class Snapshot:
+    """Immutable view of NodeMonitor's routing state at a given version
+
+    A new snapshot is published whenever the monitor's state changes, and
+    responses derived from that state are encoded at most once per snapshot.
+
+    Public attributes:
+        version (int): Monitor state version this snapshot was taken at
+        containers_version (int): Version of the container listing
+        containers (Encoded): Encoded `/api/v1/containers` response
+
+    Private attributes:
+        _ips (OrderedDict[IpsKey, IpsAnswer]): LRU of `/api/v1/ips` answers
+
+    Methods:
+        get_ips: Returns a memoized `/api/v1/ips` answer
+        put_ips: Memoizes an `/api/v1/ips` answer
+    """
+
+    def __init__(
+        self: Snapshot,
+        version: int,
+        containers_version: int,
+        containers: Encoded,
+    ) -> None:
+        """Initializes Snapshot
+
+        Args:
+            version (int): Monitor state version
+            containers_version (int): Version of the container listing
+            containers (Encoded): Encoded `/api/v1/containers` response
+        """
+        self.version = version
+        self.containers_version = containers_version
+        self.containers = containers
+        self._ips: OrderedDict[IpsKey, IpsAnswer] = OrderedDict()
+
+    def get_ips(self: Snapshot, key: IpsKey) -> Optional[IpsAnswer]:
+        """Returns a memoized `/api/v1/ips` answer
+
+        Args:
+            key (IpsKey): (container set, n, offset)
+
+        Returns:
+            Optional[IpsAnswer]: Selected hosts and encoded answer, if memoized
+        """
+        answer = self._ips.get(key)
+        if answer is not None:
+            self._ips.move_to_end(key)
+        return answer
+
+    def put_ips(self: Snapshot, key: IpsKey, hosts: list[str]) -> IpsAnswer:
+        """Memoizes an `/api/v1/ips` answer, evicting the least recently used one if
+        full
+
+        Args:
+            key (IpsKey): (container set, n, offset)
+            hosts (list[str]): Selected node hostnames or IPs
+
+        Returns:
+            IpsAnswer: Selected hosts and encoded answer
+        """
+        answer = self._ips[key] = (hosts, Encoded.from_json(hosts))
+        if len(self._ips) > IPS_CACHE_SIZE:
+            self._ips.popitem(last=False)
+        return answer
@@ -1,30 +1,228 @@
-from typing import Any, cast
+from __future__ import annotations
+
+import json
+from codecs import getincrementaldecoder
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Any, Optional
 
 from aiohttp import ClientSession
 
+from labels import Labels, node_labels
 from logger import log
+from metrics import EXPLORER_FAILURES, EXPLORER_FETCH_SECONDS, EXPLORER_NODES
+
+# Size in bytes of chunks explorer responses are read and parsed in
+CHUNK_SIZE = 64 * 1024
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",:]}"
+
+
+class _Incomplete(Exception):
+    """Raised when the buffered input ends before the current JSON token"""
+
+
+class JSONArrayStream:
+    """Incremental parser for the items of an array-valued member of a JSON object,
+    e.g. `{"data": [...]}`
+
+    Input is fed in chunks, and items are returned as soon as they are complete, so
+    large documents are never held in memory as a whole. Other members of the
+    object are parsed and discarded.
+
+    Private attributes:
+        _key (str): Key of the array member
+        _buffer (str): Input not consumed yet
+        _state (str): Next expected token
+        _member (Optional[str]): Key of the member being parsed
+
+    Public attributes:
+        found (bool): Whether the array member was found
+
+    Methods:
+        feed: Parse the next chunk of input
+    """
+
+    def __init__(self: JSONArrayStream, key: str) -> None:
+        """Initializes JSONArrayStream
+
+        Args:
+            key (str): Key of the array member
+        """
+        self._key = key
+        self._buffer = ""
+        self._state = "start"
+        self._member: Optional[str] = None
+        self.found = False
+
+    @staticmethod
+    def _decode(buffer: str, pos: int, final: bool) -> tuple[Any, int]:
+        """Decodes the JSON value at `pos`, unless it may continue past the buffer"""
+        try:
+            value, end = _DECODER.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            raise _Incomplete()
+        if not final and (end == len(buffer) or buffer[end] not in _DELIMITERS):
+            # Scalars (e.g. numbers) may be cut short at the end of the buffer
+            raise _Incomplete()
+        return value, end
+
+    @staticmethod
+    def _expect(char: str, expected: str) -> None:
+        """Raises on an unexpected character"""
+        if char not in expected:
+            raise ValueError(f"Expected one of {expected!r}, got {char!r}")
 
+    def feed(self: JSONArrayStream, text: str, final: bool = False) -> list[Any]:
+        """Parses the next chunk of input
 
-async def fetch_live_nodes(api_url: str) -> list[dict[str, Any]]:
+        Args:
+            text (str): Next chunk of input
+            final (bool, optional): Whether this is the last chunk. Defaults to
+                False.
+
+        Returns:
+            list[Any]: Array items completed by this chunk
+
+        Raises:
+            ValueError: If the input is not a JSON object, or ends prematurely
+        """
+        buffer = self._buffer + text
+        pos = 0
+        items: list[Any] = []
+        try:
+            while True:
+                while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                    pos += 1
+                if pos == len(buffer):
+                    break
+
+                char = buffer[pos]
+                state = self._state
+                if state == "start":
+                    self._expect(char, "{")
+                    self._state, pos = "key_or_end", pos + 1
+                elif state == "key_or_end" and char == "}":
+                    self._state, pos = "done", pos + 1
+                elif state in ("key", "key_or_end"):
+                    key, pos = self._decode(buffer, pos, final)
+                    if not isinstance(key, str):
+                        raise ValueError("Expected a member key")
+                    self._member, self._state = key, "colon"
+                elif state == "colon":
+                    self._expect(char, ":")
+                    pos += 1
+                    self._state = "array" if self._member == self._key else "value"
+                elif state == "value":
+                    _, pos = self._decode(buffer, pos, final)
+                    self._state = "member_end"
+                elif state == "array":
+                    self._expect(char, "[")
+                    self.found = True
+                    self._state, pos = "item_or_end", pos + 1
+                elif state == "item_or_end" and char == "]":
+                    self._state, pos = "member_end", pos + 1
+                elif state in ("item", "item_or_end"):
+                    item, pos = self._decode(buffer, pos, final)
+                    items.append(item)
+                    self._state = "item_end"
+                elif state == "item_end":
+                    self._expect(char, ",]")
+                    self._state = "item" if char == "," else "member_end"
+                    pos += 1
+                elif state == "member_end":
+                    self._expect(char, ",}")
+                    self._state = "key" if char == "," else "done"
+                    pos += 1
+                else:
+                    raise ValueError("Unexpected data after JSON object")
+        except _Incomplete:
+            pass
+
+        self._buffer = buffer[pos:]
+        if final and self._state != "done":
+            raise ValueError("Truncated JSON object")
+        return items
+
+
+@dataclass(frozen=True)
+class LiveNodes:
+    """Result of a live node fetch from the explorer API"""
+
+    # Hostnames of live nodes, or None if unchanged since the conditional request
+    hosts: Optional[set[str]]
+    # Entity tag of the response, for the next conditional request
+    etag: Optional[str]
+    # Labels of live nodes that have any
+    labels: dict[str, Labels] = field(default_factory=dict)
+
+
+async def fetch_live_nodes(
+    session: ClientSession, api_url: str, etag: Optional[str] = None
+) -> Optional[LiveNodes]:
     """Fetches live nodes using the explorer REST API.
 
+    The response is parsed as it streams in, one node at a time. If `etag` is set,
+    the request is conditional, and an unchanged node list is not downloaded again.
+
     Args:
+        session (ClientSession): HTTP client to issue the request with
         api_url (str): URL of the explorer API
+        etag (Optional[str], optional): Entity tag of the last response. Defaults
+            to None.
 
     Returns:
-        list[dict[str, Any]]: List of live nodes
+        Optional[LiveNodes]: Live nodes, or None if the request failed
     """
     url = f"{api_url}/api/nodes?minutes_past=60"
+    started = perf_counter()
+    result: Optional[LiveNodes] = None
     try:
-        async with ClientSession() as session:
-            async with session.get(url) as response:
-                # Check if the HTTP request was successful
-                if response.status == 200:
-                    body = await response.json()
-                    return cast(list[dict[str, Any]], body["data"])
-                else:
-                    log.error("Failed to fetch live nodes", status=response.status)
+        async with session.get(
+            url, headers={"If-None-Match": etag} if etag else None
+        ) as response:
+            # Check if the HTTP request was successful
+            if response.status == 304 and etag:
+                result = LiveNodes(hosts=None, etag=etag)
+            elif response.status == 200:
+                stream = JSONArrayStream("data")
+                decoder = getincrementaldecoder("utf-8")()
+                hosts: set[str] = set()
+                labels: dict[str, Labels] = {}
+
+                def add(nodes: list[Any]) -> None:
+                    for node in nodes:
+                        if not isinstance(node, dict) or "ip" not in node:
+                            continue
+                        # Hostname is ip:port for each node. Default port is 4000
+                        port = node["port"] if "port" in node else "4000"
+                        host = f'{node["ip"]}:{port}'
+                        hosts.add(host)
+                        found = node_labels(node)
+                        if found:
+                            labels[host] = found
+
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    add(stream.feed(decoder.decode(chunk)))
+                add(stream.feed(decoder.decode(b"", final=True), final=True))
+                if not stream.found:
+                    raise ValueError("No data in explorer response")
+
+                result = LiveNodes(
+                    hosts=hosts, etag=response.headers.get("ETag"), labels=labels
+                )
+            else:
+                log.error("Failed to fetch live nodes", status=response.status)
     except Exception as e:
         log.error(f"Failed to fetch live nodes: {str(e)}")
 
-    return []
+    EXPLORER_FETCH_SECONDS.observe(perf_counter() - started)
+    if result is None:
+        EXPLORER_FAILURES.inc()
+    elif result.hosts is not None:
+        EXPLORER_NODES.set(len(result.hosts))
+    return result
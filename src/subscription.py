@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import json
+from asyncio import sleep
+from secrets import token_hex
+from time import monotonic
+from typing import Any, AsyncGenerator, Optional
+
+from configs import MAX_SUBSCRIBERS, SUBSCRIBE_INTERVAL, SUBSCRIBE_KEEPALIVE
+from monitor import NodeDelta, NodeMonitor
+
+
+def format_event(event: str, event_id: str, data: Any) -> bytes:
+    """Formats a Server-Sent Event
+
+    Args:
+        event (str): Event type
+        event_id (str): Event ID, sent back by clients to resume
+        data (Any): JSON-serializable payload
+
+    Returns:
+        bytes: Encoded event
+    """
+    payload = json.dumps(data, separators=(",", ":"))
+    return f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n".encode()
+
+
+class Subscriptions:
+    """Streams the available node table to subscribers as Server-Sent Events
+
+    A subscriber first receives a `snapshot` event with all available nodes, then
+    `delta` events with the nodes whose availability, containers or pending jobs
+    changed since, batched every `SUBSCRIBE_INTERVAL`. Event IDs are
+    `<epoch>:<change sequence number>`: subscribers reconnecting with their last
+    event ID (`Last-Event-ID`) resume with a delta, unless the changes since were
+    no longer retained, or this process restarted, in which case they receive a
+    new snapshot.
+
+    Private attributes:
+        _monitor (NodeMonitor): Node monitor whose table is streamed
+        _epoch (str): Random ID of this process, so that subscribers resuming
+            across a restart receive a new snapshot
+        _shutdown (bool): Shutdown flag, ending all streams
+
+    Public attributes:
+        subscribers (int): Number of connected subscribers
+
+    Methods:
+        full: Whether no more subscribers are accepted
+        stream: Stream events to a subscriber
+        stop: End all streams
+    """
+
+    def __init__(self: Subscriptions, monitor: NodeMonitor) -> None:
+        """Initializes Subscriptions
+
+        Args:
+            monitor (NodeMonitor): Node monitor whose table is streamed
+        """
+        self._monitor = monitor
+        self._epoch = token_hex(8)
+        self._shutdown = False
+        self.subscribers = 0
+
+    def full(self: Subscriptions) -> bool:
+        """Whether `MAX_SUBSCRIBERS` are connected already"""
+        return 0 < MAX_SUBSCRIBERS <= self.subscribers
+
+    def _resume_from(
+        self: Subscriptions, last_event_id: Optional[str]
+    ) -> Optional[int]:
+        """Returns the change sequence number to resume from, if the event ID was
+        issued by this process"""
+        if last_event_id is None:
+            return None
+        epoch, _, seq = last_event_id.partition(":")
+        if epoch != self._epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    @staticmethod
+    def _nodes(delta: NodeDelta) -> dict[str, Optional[dict[str, Any]]]:
+        """Converts changed nodes to their JSON representation"""
+        return {
+            host: (
+                None
+                if entry is None
+                else {
+                    "containers": entry[0],
+                    "pending": entry[1],
+                    "latency": entry[2],
+                    "labels": entry[3],
+                }
+            )
+            for host, entry in delta.items()
+        }
+
+    async def stream(
+        self: Subscriptions, last_event_id: Optional[str] = None
+    ) -> AsyncGenerator[bytes, None]:
+        """Streams events to a subscriber, until it disconnects or streams are
+        stopped
+
+        Args:
+            last_event_id (Optional[str], optional): ID of the last event the
+                subscriber received. Defaults to None.
+
+        Yields:
+            bytes: Encoded events, and keep-alive comments
+        """
+        self.subscribers += 1
+        self._monitor.set_routed_elsewhere()  # Subscribers may route locally
+        try:
+            since = self._resume_from(last_event_id)
+            sent = monotonic()
+            while not self._shutdown:
+                seq, delta, full = self._monitor.export_changes(since)
+                if full or delta:
+                    yield format_event(
+                        "snapshot" if full else "delta",
+                        f"{self._epoch}:{seq}",
+                        {"seq": seq, "nodes": self._nodes(delta)},
+                    )
+                    sent = monotonic()
+                elif monotonic() - sent >= SUBSCRIBE_KEEPALIVE:
+                    # Keeps idle connections open through proxies
+                    yield b": keep-alive\n\n"
+                    sent = monotonic()
+                since = seq
+                await sleep(SUBSCRIBE_INTERVAL)
+        finally:
+            self.subscribers -= 1
+
+    async def stop(self: Subscriptions) -> None:
+        """Ends all streams"""
+        self._shutdown = True
@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+# Router modules live in src/ and import each other as top-level modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from monitor import NodeInfo  # noqa: E402
+
+
+def make_node(containers: list[str], pending: int) -> NodeInfo:
+    """Returns an available node running `containers`, with `pending` jobs"""
+    return NodeInfo(
+        available=True,
+        containers=[{"id": c, "description": f"{c} container"} for c in containers],
+        pending={"offchain": pending},
+    )
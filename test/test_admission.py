@@ -0,0 +1,45 @@
+"""
+Unit tests for admission control: per-client token buckets and load shedding.
+"""
+
+from admission import AdmissionControl, RateLimiter
+
+
+def test_rate_limiter_bursts_then_refills() -> None:
+    limiter = RateLimiter(period=30)
+    assert all(limiter.acquire("a", 3, now=0) == 0 for _ in range(3))
+    assert limiter.acquire("a", 3, now=0) == 10
+
+    # Other clients have their own buckets
+    assert limiter.acquire("b", 3, now=0) == 0
+
+    # One token is back after a third of the period
+    assert limiter.acquire("a", 3, now=10) == 0
+    assert limiter.acquire("a", 3, now=10) > 0
+
+    # No limit
+    assert limiter.acquire("c", 0, now=10) == 0
+
+
+def test_rate_limiter_evicts_idle_buckets() -> None:
+    limiter = RateLimiter(period=30)
+    for i in range(100):
+        limiter.acquire(i, 3, now=i / 10)
+    assert len(limiter) == 100
+
+    # Buckets idle for a whole period are full again, and forgotten
+    limiter.acquire("a", 3, now=35)
+    assert len(limiter) == 50
+
+
+def test_admission_control_bounds_inflight_requests() -> None:
+    admission = AdmissionControl(max_inflight=2, max_lag=0.5)
+    assert admission.admit() and admission.admit()
+    assert not admission.admit()
+    admission.release()
+    assert admission.admit()
+
+    # Requests are shed while the event loop lags
+    admission.release()
+    admission.loop.lag = 1.0
+    assert not admission.admit()
@@ -0,0 +1,55 @@
+"""
+Unit tests for checkpointing node state, and warm starts from a checkpoint.
+"""
+
+from pathlib import Path
+from time import time
+
+from checkpoint import load_checkpoint, save_checkpoint
+from monitor import NodeInfo, NodeMonitor, NodeTable
+
+
+def test_checkpoint_round_trip(tmp_path: Path) -> None:
+    path = str(tmp_path / "nodes.db")
+    assert load_checkpoint(path) == ({}, {})
+
+    table: NodeTable = {
+        "a:4000": ([{"id": "hello-world"}], {"offchain": 2}, 0.02, {}),
+        "b:4000": ([{"id": "llm"}], {"offchain": 0, "onchain": 1}, 0.5, {}),
+    }
+    now = time()
+    save_checkpoint(path, table, {"a:4000": now, "b:4000": now - 7200})
+    assert load_checkpoint(path, max_age=3600) == (
+        {"a:4000": table["a:4000"]},
+        {"a:4000": now},
+    )
+
+    # Checkpoints are replaced, not merged
+    save_checkpoint(path, {"b:4000": table["b:4000"]}, {})
+    assert list(load_checkpoint(path)[0]) == ["b:4000"]
+
+
+def test_warm_start_serves_stale_nodes() -> None:
+    monitor = NodeMonitor(["a:4000"])
+    monitor.warm_start(
+        {
+            "a:4000": ([{"id": "hello-world"}], {"offchain": 2}, 0.02, {}),
+            "b:4000": ([{"id": "hello-world"}], {"offchain": 0}, 0.02, {}),
+        },
+        {"a:4000": 1.0},
+    )
+    assert monitor.get_nodes(["hello-world"]) == ["b:4000", "a:4000"]
+    assert monitor.last_seen() == {"a:4000": 1.0}
+    assert "b:4000" in monitor._scheduler
+
+    # A probe revalidates the node
+    monitor._publish(
+        "a:4000",
+        NodeInfo(
+            available=True,
+            containers=[{"id": "hello-world"}],
+            pending={"offchain": 2},
+        ),
+    )
+    assert not monitor._available_nodes["a:4000"].stale
+    assert monitor._available_nodes["b:4000"].stale
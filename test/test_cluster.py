@@ -0,0 +1,102 @@
+"""
+Unit tests for cluster mode: sharding nodes between peers, and exchanging node state
+through state responses, without a network.
+"""
+
+import pytest
+from conftest import make_node
+
+from changelog import ChangeLog
+from cluster import Cluster, HashRing
+from monitor import NodeMonitor
+
+PEERS = ["http://a:4000", "http://b:4000", "http://c:4000"]
+HOSTS = [f"10.0.{i // 256}.{i % 256}:4000" for i in range(3000)]
+
+
+def test_changelog() -> None:
+    changes = ChangeLog(size=3)
+    assert changes.since(0) == []
+    for key in ("a", "b", "a", "c"):
+        changes.append(key)
+
+    assert changes.seq == 4
+    assert changes.since(2) == ["c", "a"]
+    assert changes.since(4) == []
+
+    # Changes beyond the retained ones, or from the future, require a full resync
+    assert changes.since(0) is None
+    assert changes.since(5) is None
+
+
+def test_hash_ring_balances_and_rebalances_minimally() -> None:
+    ring = HashRing(PEERS)
+    owners = {host: ring.owner(host) for host in HOSTS}
+    for peer in PEERS:
+        assert 600 < list(owners.values()).count(peer) < 1400
+
+    # Only the removed member's keys move
+    smaller = HashRing(PEERS[:2])
+    moved = [host for host in HOSTS if smaller.owner(host) != owners[host]]
+    assert moved and all(owners[host] == PEERS[2] for host in moved)
+
+
+def test_peers_exchange_their_shards() -> None:
+    monitors = [NodeMonitor(HOSTS[:30]) for _ in PEERS[:2]]
+    clusters = [
+        Cluster(monitor, peer, PEERS[:2]) for monitor, peer in zip(monitors, PEERS)
+    ]
+
+    # Each router probes (here: publishes) its own shard only
+    for monitor, cluster in zip(monitors, clusters):
+        for host in HOSTS[:30]:
+            if cluster.owns(host):
+                monitor._publish(host, make_node(["hello-world"], 1))
+        assert 0 < len(monitor.export_table()) < 30
+
+    a, b = clusters
+    state = b.state()
+    assert state["full"]
+    a._apply(PEERS[1], state)
+    assert len(monitors[0].export_table()) == 30
+
+    # Then deltas since the last sync
+    moved = next(host for host in HOSTS[:30] if b.owns(host))
+    monitors[1]._publish(moved, None)
+    state = b.state(state["seq"], state["epoch"])
+    assert not state["full"]
+    assert state["nodes"] == {moved: None}
+    a._apply(PEERS[1], state)
+    assert moved not in monitors[0].export_table()
+
+    # Changes to a node's containers alone are exchanged too
+    changed = next(host for host in HOSTS[:30] if b.owns(host) and host != moved)
+    monitors[1]._publish(changed, make_node(["hello-world", "llm"], 1))
+    state = b.state(state["seq"], state["epoch"])
+    assert list(state["nodes"]) == [changed]
+    a._apply(PEERS[1], state)
+    assert monitors[0].get_nodes(["llm"]) == [changed]
+
+    # Malformed states are rejected before applying any of them
+    seq = a._peers[PEERS[1]].seq
+    for bad in (
+        [],
+        {"epoch": state["epoch"], "seq": seq + 1, "full": True},
+        {**state, "seq": seq + 1, "nodes": {changed: None, moved: [[], {}, 0.1]}},
+        {**state, "seq": seq + 1, "nodes": {moved: [[{"id": 1}], {}, 0.1, {}]}},
+    ):
+        with pytest.raises(ValueError):
+            a._apply(PEERS[1], bad)
+    assert a._peers[PEERS[1]].seq == seq
+    assert monitors[0].get_nodes(["llm"]) == [changed]
+
+
+def test_dead_peer_shard_is_taken_over() -> None:
+    monitor = NodeMonitor(HOSTS[:300])
+    cluster = Cluster(monitor, PEERS[0], PEERS)
+    owned = len(monitor._scheduler)
+    assert 0 < owned < 300
+
+    cluster._peers[PEERS[2]].last_sync -= 3600
+    cluster._update_ring()
+    assert owned < len(monitor._scheduler) < 300
@@ -0,0 +1,98 @@
+"""
+Unit tests for live node discovery via the explorer API, against a stub explorer.
+"""
+
+import json
+from typing import Any, AsyncIterator
+
+import pytest
+import pytest_asyncio
+from aiohttp import ClientSession, web
+
+from discovery import Discovery
+from sql import JSONArrayStream
+
+
+def test_array_stream_handles_any_split() -> None:
+    document = json.dumps(
+        {
+            "total": 12.5,
+            "meta": {"data": [1, 2], "next": None},
+            "data": [{"ip": "10.0.0.1", "port": 4001}, {"ip": "10.0.0.2"}, 7],
+            "after": "]}",
+        }
+    )
+    for split in range(len(document) + 1):
+        stream = JSONArrayStream("data")
+        items = stream.feed(document[:split])
+        items += stream.feed(document[split:], final=True)
+        assert stream.found
+        assert items == [{"ip": "10.0.0.1", "port": 4001}, {"ip": "10.0.0.2"}, 7]
+
+
+def test_array_stream_rejects_truncated_input() -> None:
+    stream = JSONArrayStream("data")
+    assert stream.feed('{"data": [{"ip": "10.0.0.1"}, {"ip"') == [{"ip": "10.0.0.1"}]
+    with pytest.raises(ValueError):
+        stream.feed("", final=True)
+
+
+@pytest_asyncio.fixture
+async def explorer() -> AsyncIterator[tuple[str, dict[str, Any]]]:
+    """Serves a stub explorer API tagging its responses. Yields its URL and its
+    state: the live nodes, and the status to fail with (if any)"""
+    state: dict[str, Any] = {"nodes": [{"ip": "10.0.0.1"}], "status": None}
+
+    async def nodes(request: web.Request) -> web.Response:
+        if state["status"]:
+            return web.Response(status=state["status"])
+        etag = f'"{len(state["nodes"])}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        return web.json_response({"data": state["nodes"]}, headers={"ETag": etag})
+
+    app = web.Application()
+    app.router.add_get("/api/nodes", nodes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    _, port = runner.addresses[0]
+    yield f"http://127.0.0.1:{port}", state
+    await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_discovery_applies_changes_only(
+    explorer: tuple[str, dict[str, Any]]
+) -> None:
+    url, state = explorer
+    changes: list[set[str]] = []
+    labels: dict[str, dict[str, str]] = {}
+
+    def on_change(hosts: set[str], hosts_labels: dict[str, dict[str, str]]) -> None:
+        changes.append(hosts)
+        labels.clear()
+        labels.update(hosts_labels)
+
+    async with ClientSession() as session:
+        discovery = Discovery(url, lambda: session, on_change)
+
+        assert await discovery.refresh()
+        assert changes == [{"10.0.0.1:4000"}]
+
+        # Unchanged (304) lists are not applied again
+        assert await discovery.refresh()
+        assert len(changes) == 1
+
+        state["nodes"] = [
+            {"ip": "10.0.0.1"},
+            {"ip": "10.0.0.2", "port": 4001, "region": "eu", "labels": {"tier": "gpu"}},
+        ]
+        assert await discovery.refresh()
+        assert changes[-1] == {"10.0.0.1:4000", "10.0.0.2:4001"}
+        assert labels == {"10.0.0.2:4001": {"tier": "gpu", "region": "eu"}}
+
+        # Failed fetches keep the last known live nodes
+        state["status"] = 500
+        assert not await discovery.refresh()
+        assert len(changes) == 2
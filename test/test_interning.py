@@ -0,0 +1,51 @@
+"""
+Unit tests for interning node state shared across nodes.
+"""
+
+from interning import ContainerInterner
+from monitor import NodeInfo
+
+
+def test_equal_state_is_shared() -> None:
+    interner = ContainerInterner()
+    first = interner.intern_containers([{"id": "hello-world"}, {"id": "llm"}])
+    second = interner.intern_containers([{"id": "hello-world"}, {"id": "llm"}])
+    assert first is second
+    assert first[1] == ["hello-world", "llm"]
+    assert interner.intern_pending({"offchain": 1}) is interner.intern_pending(
+        {"offchain": 1}
+    )
+
+    # Nested, unhashable container descriptions are interned too
+    nested = [{"id": "llm", "env": {"model": "7b"}}]
+    assert interner.intern_containers(nested) is interner.intern_containers(
+        [{"id": "llm", "env": {"model": "7b"}}]
+    )
+
+
+def test_container_masks() -> None:
+    interner = ContainerInterner()
+    _, _, mask = interner.intern_containers([{"id": "a"}, {"id": "b"}])
+    a = interner.mask(["a"])
+    assert a is not None and a & mask == a
+    assert interner.mask(["a", "b"]) == mask
+    assert interner.mask(["a", "unknown"]) is None
+
+
+def test_intern_tables_are_bounded() -> None:
+    interner = ContainerInterner(size=2)
+    first = interner.intern_containers([{"id": "a"}])
+    interner.intern_containers([{"id": "b"}])
+    interner.intern_containers([{"id": "c"}])
+
+    # Tables are reset, but bits stay assigned
+    assert interner.intern_containers([{"id": "a"}]) is not first
+    assert interner.intern_containers([{"id": "a"}])[2] == first[2]
+
+
+def test_node_info_shares_containers() -> None:
+    first = NodeInfo(True, [{"id": "hello-world"}], {"offchain": 0})
+    second = NodeInfo(True, [{"id": "hello-world"}], {"offchain": 0})
+    assert first.containers is second.containers
+    assert first.pending is second.pending
+    assert first.container_ids == ["hello-world"]
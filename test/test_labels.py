@@ -0,0 +1,92 @@
+"""
+Unit tests for node labels and locality-aware routing.
+"""
+
+import pytest
+from conftest import make_node
+
+import configs
+from labels import RegionTable, node_labels, parse_node
+from monitor import NodeMonitor
+
+
+def test_parse_node() -> None:
+    assert parse_node("1.2.3.4:4000") == ("1.2.3.4:4000", {})
+    assert parse_node("  1.2.3.4:4000 region=eu zone=eu-1a bogus  ") == (
+        "1.2.3.4:4000",
+        {"region": "eu", "zone": "eu-1a"},
+    )
+    assert parse_node("") is None
+    assert parse_node("# 1.2.3.4:4000") is None
+
+
+def test_node_labels() -> None:
+    assert node_labels({"ip": "1.2.3.4"}) == {}
+    assert node_labels(
+        {"ip": "1.2.3.4", "region": "eu", "labels": {"tier": "gpu", "bad": 1}}
+    ) == {"tier": "gpu", "region": "eu"}
+
+
+def test_region_table_longest_prefix() -> None:
+    table = RegionTable({"10.0.0.0/8": "us", "10.1.0.0/16": "eu", "fd00::/8": "ap"})
+    assert table.region("10.1.2.3") == "eu"
+    assert table.region("10.2.2.3") == "us"
+    assert table.region("fd00::1") == "ap"
+    assert table.region("192.168.0.1") is None
+    assert table.region("not an address") is None
+    assert not RegionTable({})
+
+    with pytest.raises(ValueError):
+        RegionTable({"10.0.0.0/33": "us"})
+
+
+def test_preferred_nodes_until_busy(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(configs, "SPILLOVER_DEPTH", 2)
+    monitor = NodeMonitor(
+        ["eu:4000", "us:4000"],
+        {"eu:4000": {"region": "eu"}, "us:4000": {"region": "us"}},
+    )
+    monitor._publish("eu:4000", make_node(["hello-world"], 2))
+    monitor._publish("us:4000", make_node(["hello-world"], 0))
+    eu = {"region": "eu"}
+
+    # Local nodes win while not busier than the spillover depth...
+    assert monitor.get_nodes(["hello-world"], n=2) == ["us:4000", "eu:4000"]
+    assert monitor.get_nodes(["hello-world"], n=2, prefer=eu) == [
+        "eu:4000",
+        "us:4000",
+    ]
+    assert monitor.get_nodes(["hello-world"], n=1, prefer=eu, strategy="p2c") == [
+        "eu:4000"
+    ]
+    assert monitor.rank_nodes(["hello-world"], prefer=eu) == ["eu:4000", "us:4000"]
+
+    # ...then compete with remote ones
+    monitor._publish("eu:4000", make_node(["hello-world"], 3))
+    assert monitor.get_nodes(["hello-world"], n=1, prefer=eu) == ["us:4000"]
+
+    # Unknown labels match no node, so all nodes are ranked as usual
+    assert monitor.get_nodes(["hello-world"], n=1, prefer={"region": "ap"}) == [
+        "us:4000"
+    ]
+
+
+def test_live_node_labels() -> None:
+    monitor = NodeMonitor(["a:4000"], {"a:4000": {"region": "eu"}})
+    monitor._set_live_nodes(
+        {"a:4000", "b:4000"},
+        {"a:4000": {"region": "us"}, "b:4000": {"region": "eu"}},
+    )
+    # Labels from ips.txt take precedence, and equal labels are shared
+    assert monitor._labels["a:4000"] is monitor._labels["b:4000"]
+    assert monitor._preferred({"region": "eu"}) == {"a:4000", "b:4000"}
+
+    monitor._set_live_nodes({"a:4000"})
+    assert monitor._preferred({"region": "eu"}) == {"a:4000"}
+
+    # Labels are exported along with node state
+    monitor._publish("a:4000", make_node(["hello-world"], 0))
+    assert monitor.export_table()["a:4000"][3] == {"region": "eu"}
+    mirror = NodeMonitor([])
+    mirror.load_table(monitor.export_table())
+    assert mirror.get_nodes(["hello-world"], prefer={"region": "eu"}) == ["a:4000"]
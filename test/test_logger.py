@@ -0,0 +1,45 @@
+"""
+Unit tests for the queue-backed logging pipeline and per-node event summaries.
+"""
+
+import logging
+from queue import Queue
+
+from structlog.testing import capture_logs
+
+from logger import BoundedQueueHandler, EventSummary
+from metrics import LOG_RECORDS_DROPPED
+
+
+def test_bounded_queue_handler_drops_when_full() -> None:
+    queue: Queue[logging.LogRecord] = Queue(1)
+    handler = BoundedQueueHandler(queue)
+    dropped = LOG_RECORDS_DROPPED.value
+
+    for i in range(3):
+        handler.handle(logging.makeLogRecord({"msg": {"event": f"event {i}"}}))
+
+    # Records are queued unformatted, and the overflow is counted
+    assert queue.get_nowait().msg == {"event": "event 0"}
+    assert LOG_RECORDS_DROPPED.value == dropped + 2
+
+
+def test_event_summary_samples_and_summarizes() -> None:
+    summary = EventSummary("{count} nodes went unavailable", sample_size=2)
+    with capture_logs() as logs:
+        for i in range(5):
+            summary.record("Node not available", f"10.0.0.{i}:4000")
+
+        # Nothing is summarized before the interval is over
+        summary.flush()
+        assert [entry["node"] for entry in logs] == ["10.0.0.0:4000", "10.0.0.1:4000"]
+
+        summary.flush(now=float("inf"))
+
+    assert logs[-1]["event"] == "5 nodes went unavailable"
+    assert logs[-1]["sample"] == ["10.0.0.0:4000", "10.0.0.1:4000"]
+
+    # A new interval starts sampling afresh
+    with capture_logs() as logs:
+        summary.record("Node not available", "10.0.0.9:4000")
+    assert logs[0]["node"] == "10.0.0.9:4000"
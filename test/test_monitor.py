@@ -0,0 +1,512 @@
+"""
+Unit tests for NodeMonitor's routing logic. These run offline against a node table
+populated in-memory, without probing any nodes.
+"""
+
+import asyncio
+import json
+import random
+import time
+from typing import AsyncIterator
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from conftest import make_node
+from structlog.testing import capture_logs
+
+import configs
+from logger import EventSummary
+from metrics import PROBE_FAILURES, PROBE_LATENCY, PROBE_RESPONSES, PROBES, export
+from monitor import NodeInfo, NodeMonitor, NodeTable
+from routing import CircuitBreaker, LatencyStats
+
+
+def make_monitor(nodes: dict[str, NodeInfo]) -> NodeMonitor:
+    monitor = NodeMonitor(list(nodes))
+    for host, node in nodes.items():
+        monitor._publish(host, node)
+    return monitor
+
+
+def test_get_nodes_orders_by_load() -> None:
+    monitor = make_monitor(
+        {
+            "a:4000": make_node(["hello-world"], 5),
+            "b:4000": make_node(["hello-world", "llm"], 1),
+            "c:4000": make_node(["llm"], 0),
+            "d:4000": make_node(["hello-world"], 3),
+        }
+    )
+
+    assert monitor.get_nodes(["hello-world"]) == ["b:4000", "d:4000", "a:4000"]
+    assert monitor.get_nodes(["hello-world"], n=2, offset=1) == ["d:4000", "a:4000"]
+    assert monitor.get_nodes(["hello-world", "llm"]) == ["b:4000"]
+    assert monitor.get_nodes(["unknown"]) == []
+
+
+def test_get_nodes_matches_full_scan() -> None:
+    rng = random.Random(0)
+    container_ids = [f"c{i}" for i in range(20)]
+    nodes = {
+        f"10.0.{i // 256}.{i % 256}:4000": make_node(
+            rng.sample(container_ids, rng.randint(1, 8)), rng.randint(0, 10)
+        )
+        for i in range(2000)
+    }
+    monitor = make_monitor(nodes)
+
+    for _ in range(200):
+        containers = rng.sample(container_ids, rng.randint(1, 3))
+        n, offset = rng.randint(1, 50), rng.randint(0, 20)
+
+        expected = sorted(
+            (
+                host
+                for host, node in nodes.items()
+                if all(c in node.container_ids for c in containers)
+            ),
+            key=lambda host: nodes[host].load,
+        )[offset : offset + n]
+        assert monitor.get_nodes(containers, n, offset) == expected
+
+
+def make_queued_node(queues: dict[str, int], pending: int) -> NodeInfo:
+    return NodeInfo(
+        available=True,
+        containers=[
+            {"id": c, "pending": depth, "capacity": 2} for c, depth in queues.items()
+        ],
+        pending={"offchain": pending},
+    )
+
+
+def test_get_nodes_ranks_by_container_queue_depth(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monitor = make_monitor(
+        {
+            "a:4000": make_queued_node({"hello-world": 0, "llm": 10}, 10),
+            "b:4000": make_queued_node({"hello-world": 6, "llm": 0}, 6),
+            # Doesn't report pending jobs per container: ranked by its total
+            "c:4000": make_node(["hello-world", "llm"], 2),
+        }
+    )
+    assert monitor.get_nodes(["hello-world"]) == ["a:4000", "c:4000", "b:4000"]
+    assert monitor.get_nodes(["llm"]) == ["b:4000", "c:4000", "a:4000"]
+    assert monitor.get_nodes(["hello-world", "llm"]) == ["c:4000", "b:4000", "a:4000"]
+
+    # Weights scale each container's queue
+    monkeypatch.setitem(configs.CONTAINER_WEIGHTS, "hello-world", 0.1)
+    monitor._publish("b:4000", make_queued_node({"hello-world": 6, "llm": 0}, 6))
+    assert monitor.get_nodes(["hello-world"]) == ["a:4000", "b:4000", "c:4000"]
+
+
+def test_container_queue_ranking_matches_full_scan() -> None:
+    rng = random.Random(1)
+    container_ids = [f"c{i}" for i in range(10)]
+    nodes = {}
+    for i in range(1000):
+        containers = rng.sample(container_ids, rng.randint(1, 5))
+        nodes[f"10.0.{i // 256}.{i % 256}:4000"] = (
+            make_queued_node({c: rng.randint(0, 10) for c in containers}, 0)
+            if rng.random() < 0.5
+            else make_node(containers, rng.randint(0, 10))
+        )
+    monitor = make_monitor(nodes)
+
+    for _ in range(100):
+        containers = rng.sample(container_ids, rng.randint(1, 2))
+        expected = sorted(
+            (
+                host
+                for host, node in nodes.items()
+                if all(c in node.container_ids for c in containers)
+            ),
+            key=lambda host: (nodes[host].depth(containers), monitor._order[host]),
+        )[:20]
+        assert monitor.get_nodes(containers, 20) == expected
+
+
+def test_publish_patches_indices() -> None:
+    monitor = make_monitor(
+        {
+            "a:4000": make_node(["hello-world"], 0),
+            "b:4000": make_node(["hello-world"], 1),
+        }
+    )
+    assert monitor.get_nodes(["hello-world"]) == ["a:4000", "b:4000"]
+
+    # Node gets busier and changes containers
+    monitor._publish("a:4000", make_node(["llm"], 4))
+    assert monitor.get_nodes(["hello-world"]) == ["b:4000"]
+    assert monitor.get_nodes(["llm"]) == ["a:4000"]
+
+    # Node goes down
+    monitor._publish("b:4000", None)
+    assert monitor.get_nodes(["hello-world"]) == []
+    assert "hello-world" not in monitor._container_index
+    assert [host for _, _, host in monitor._ranked_nodes] == ["a:4000"]
+
+    # Untracked nodes are evicted from every index
+    monitor._untrack("a:4000")
+    assert monitor._available_nodes == {}
+    assert monitor._container_index == {}
+    assert monitor._ranked_nodes == []
+
+
+def test_snapshot_versions() -> None:
+    monitor = make_monitor({"a:4000": make_node(["hello-world"], 0)})
+    snapshot = monitor.snapshot()
+    assert monitor.snapshot() is snapshot
+
+    # Identical probe results don't change the state
+    monitor._publish("a:4000", make_node(["hello-world"], 0))
+    assert monitor.snapshot() is snapshot
+
+    # Pending count changes publish a new snapshot, reusing the container listing
+    monitor._publish("a:4000", make_node(["hello-world"], 3))
+    assert monitor.snapshot().version > snapshot.version
+    assert monitor.snapshot().containers is snapshot.containers
+
+    monitor._publish("a:4000", make_node(["llm"], 3))
+    assert monitor.snapshot().containers != snapshot.containers
+
+
+def test_assign_spreads_load() -> None:
+    monitor = make_monitor(
+        {
+            "a:4000": make_node(["hello-world"], 0),
+            "b:4000": make_node(["hello-world"], 1),
+            "c:4000": make_node(["hello-world"], 3),
+        }
+    )
+
+    # Provisional jobs push nodes down the ranking between probes
+    first = monitor.get_nodes(["hello-world"], n=1)
+    monitor.assign(first)
+    assert first == ["a:4000"]
+    assert monitor.get_nodes(["hello-world"], n=1) in (["a:4000"], ["b:4000"])
+    monitor.assign(["a:4000", "a:4000"])
+    assert monitor.get_nodes(["hello-world"]) == ["b:4000", "a:4000", "c:4000"]
+
+    # The node's next probe result replaces its provisional jobs
+    monitor._publish("a:4000", make_node(["hello-world"], 0))
+    assert monitor.get_nodes(["hello-world"], n=1) == ["a:4000"]
+
+
+def test_randomized_strategies() -> None:
+    monitor = make_monitor(
+        {f"{i}:4000": make_node(["hello-world"], i) for i in range(10)}
+    )
+
+    for strategy in ("p2c", "weighted"):
+        for _ in range(20):
+            hosts = monitor.get_nodes(["hello-world"], n=3, strategy=strategy)
+            assert len(set(hosts)) == 3
+
+            # Chosen among the 2n least busy nodes
+            assert all(int(host.split(":")[0]) < 6 for host in hosts)
+
+
+def test_latency_ranking() -> None:
+    monitor = make_monitor(
+        {
+            "fast-busy:4000": make_node(["hello-world"], 2),
+            "slow-idle:4000": make_node(["hello-world"], 0),
+        }
+    )
+    monitor._latency["fast-busy:4000"] = LatencyStats(ewma=0.02)
+    monitor._latency["slow-idle:4000"] = LatencyStats(ewma=2.9)
+
+    assert monitor.get_nodes(["hello-world"], n=1) == ["slow-idle:4000"]
+    assert monitor.get_nodes(["hello-world"], n=1, rank="latency") == ["fast-busy:4000"]
+
+
+def test_latency_stats() -> None:
+    stats = LatencyStats()
+    assert stats.ewma is None and stats.percentile(50) is None
+
+    for _ in range(90):
+        stats.record(0.01)
+    for _ in range(10):
+        stats.record(1.0)
+
+    assert stats.ewma is not None and stats.ewma > 0.01
+    p50, p99 = stats.percentile(50), stats.percentile(99)
+    assert p50 is not None and 0.01 <= p50 < 0.0125
+    assert p99 is not None and 1.0 <= p99 < 1.25
+
+    # Mirrored stats only hold the EWMA
+    assert LatencyStats(ewma=0.02).counts is None
+
+
+def test_get_nodes_batch_spreads_jobs() -> None:
+    monitor = make_monitor(
+        {
+            "a:4000": make_node(["hello-world"], 0),
+            "b:4000": make_node(["hello-world"], 0),
+            "c:4000": make_node(["hello-world", "llm"], 1),
+            "d:4000": make_node(["llm"], 5),
+        }
+    )
+
+    results = monitor.get_nodes_batch(
+        [
+            (["hello-world"], 1),
+            (["hello-world"], 1),
+            (["llm"], 2),
+            (["hello-world"], 3),
+            (["unknown"], 1),
+            (["hello-world"], 0),
+        ]
+    )
+    assert results == [
+        ["a:4000"],
+        ["b:4000"],
+        ["c:4000", "d:4000"],
+        ["a:4000", "b:4000", "c:4000"],
+        [],
+        [],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_failed_probe_is_recorded() -> None:
+    # Nothing listens on port 1, so the probe fails without leaving the host
+    monitor = NodeMonitor(["127.0.0.1:1"])
+    probes = PROBES.value
+    try:
+        assert not await monitor._update_node("127.0.0.1:1")
+    finally:
+        await monitor.stop()
+    assert PROBES.value == probes + 1
+    assert PROBE_FAILURES.labels("127.0.0.1:1").value == 1
+
+
+@pytest_asyncio.fixture
+async def stub_node() -> AsyncIterator[tuple[str, list[str]]]:
+    """Serves a node answering `/health`, and `/info` with entity tags. Yields its
+    host and the paths (and If-None-Match headers) of requests it received"""
+    requests: list[str] = []
+    body = json.dumps({"containers": [{"id": "hello-world"}], "pending": {}})
+
+    async def health(request: web.Request) -> web.Response:
+        requests.append(request.path)
+        return web.json_response({"status": "healthy"})
+
+    async def info(request: web.Request) -> web.Response:
+        requests.append(f"{request.path} {request.headers.get('If-None-Match')}")
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+        return web.Response(body=body, headers={"ETag": '"v1"'})
+
+    app = web.Application()
+    app.router.add_get("/health", health)
+    app.router.add_get("/info", info)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    _, port = runner.addresses[0]
+    yield f"127.0.0.1:{port}", requests
+    await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_two_tier_probes(
+    stub_node: tuple[str, list[str]], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    host, requests = stub_node
+    monkeypatch.setattr(configs, "FULL_PROBE_EVERY", 3)
+    monitor = NodeMonitor([host])
+    health = PROBE_RESPONSES.labels("health").value
+    try:
+        for _ in range(5):
+            assert await monitor._update_node(host)
+        assert monitor.get_nodes(["hello-world"]) == [host]
+
+        # Jobs assigned since the last full fetch force one
+        monitor.assign([host])
+        assert await monitor._update_node(host)
+
+        # As do jobs routed elsewhere, e.g. by REST workers in other processes
+        monitor.set_routed_elsewhere()
+        assert await monitor._update_node(host)
+    finally:
+        await monitor.stop()
+
+    assert requests == [
+        "/info None",
+        "/health",
+        "/health",
+        '/info "v1"',
+        "/health",
+        '/info "v1"',
+        '/info "v1"',
+    ]
+    assert PROBE_RESPONSES.labels("health").value == health + 3
+
+
+@pytest.mark.asyncio
+async def test_latency_percentiles_are_exported(
+    stub_node: tuple[str, list[str]]
+) -> None:
+    host, _ = stub_node
+    monitor = NodeMonitor([host])
+    try:
+        assert await monitor._update_node(host)
+    finally:
+        await monitor.stop()
+
+    # p50 and p99 of probed nodes are exposed, until the node is removed
+    quantiles = {
+        labels[1]: values[0]
+        for labels, values in export()["router_node_probe_latency_seconds"]
+        if labels[0] == host
+    }
+    assert quantiles.keys() == {"0.5", "0.99"}
+    assert 0 < quantiles["0.5"] <= quantiles["0.99"] < 3
+
+    monitor.set_base_nodes({})
+    assert host not in {labels[0] for labels, _ in PROBE_LATENCY.export()}
+
+
+@pytest.mark.asyncio
+async def test_light_probes_keep_inflight_jobs(
+    stub_node: tuple[str, list[str]], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    host, requests = stub_node
+    monkeypatch.setattr(configs, "FULL_PROBE_EVERY", 3)
+    monitor = NodeMonitor([host])
+    try:
+        assert await monitor._update_node(host)
+
+        # Jobs assigned while a `/health` probe is in flight outlive its result
+        probe = asyncio.create_task(monitor._update_node(host))
+        await asyncio.sleep(0)
+        monitor.assign([host])
+        assert await probe
+        assert monitor._inflight.get(host)
+        assert await monitor._update_node(host)
+        assert not monitor._inflight.get(host)
+    finally:
+        await monitor.stop()
+
+    assert requests == ["/info None", "/health", '/info "v1"']
+
+
+@pytest.mark.asyncio
+async def test_probe_deadline_and_size_limit(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("monitor.PROBE_DEADLINE", 0.3)
+    monkeypatch.setattr("monitor.MAX_INFO_BYTES", 64)
+    mode = ["trickle"]
+
+    async def info(request: web.Request) -> web.StreamResponse:
+        if mode[0] == "large":
+            return web.json_response({"containers": [{"id": "c" * 64}], "pending": {}})
+        if mode[0] == "small":
+            return web.json_response({"containers": [{"id": "c"}], "pending": {}})
+
+        # Never finishes the body, but never stalls for long
+        response = web.StreamResponse()
+        await response.prepare(request)
+        while True:
+            await response.write(b" ")
+            await asyncio.sleep(0.1)
+
+    app = web.Application()
+    app.router.add_get("/info", info)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    _, port = runner.addresses[0]
+    host = f"127.0.0.1:{port}"
+    monitor = NodeMonitor([host])
+    try:
+        started = time.monotonic()
+        assert not await monitor._update_node(host)
+        assert time.monotonic() - started < 1
+
+        mode[0] = "large"
+        assert not await monitor._update_node(host)
+        mode[0] = "small"
+        assert await monitor._update_node(host)
+    finally:
+        await monitor.stop()
+        await runner.cleanup()
+
+
+def test_circuit_breaker() -> None:
+    breaker = CircuitBreaker(threshold=2, window=60, cooldown=0)
+    assert not breaker.report("a:4000", "client-1")
+    assert not breaker.report("a:4000", "client-1")  # Reporters count once
+    assert breaker.report("a:4000", "client-2")
+    assert "a:4000" in breaker
+
+    # Reports against an open circuit don't count
+    assert not breaker.report("a:4000", "client-1")
+
+    # Half-open once the cooldown elapsed, until closed
+    assert breaker.allows("a:4000")
+    breaker.close("a:4000")
+    assert "a:4000" not in breaker
+    assert not breaker.report("a:4000", "client-1")
+
+    assert not CircuitBreaker(threshold=0, window=60, cooldown=0).report(
+        "a:4000", "client-1"
+    )
+
+
+def test_report_failure_ejects_until_readmitted() -> None:
+    monitor = NodeMonitor([])
+    table: NodeTable = {
+        "a:4000": ([{"id": "hello-world"}], {"offchain": 2}, 0.02, {}),
+        "b:4000": ([{"id": "hello-world"}], {"offchain": 0}, 0.02, {}),
+    }
+    monitor.load_table(table)
+    monitor._breaker = CircuitBreaker(threshold=2, window=60, cooldown=3600)
+
+    assert not monitor.report_failure("b:4000", "failed", "client-1")
+    assert not monitor.report_failure("b:4000", "failed", "client-1")
+    assert monitor.report_failure("b:4000", "failed", "client-2")
+    assert monitor.get_nodes(["hello-world"]) == ["a:4000"]
+
+    # Unavailable (here: ejected) nodes can't be reported
+    assert not monitor.report_failure("b:4000", "failed", "client-3")
+
+    # Followers keep ejected nodes out while the circuit is open, as do cluster
+    # peers receiving the node's changes...
+    monitor.load_table(table)
+    assert monitor.get_nodes(["hello-world"]) == ["a:4000"]
+    monitor.apply_remote(
+        {"b:4000": ([{"id": "hello-world"}], {"offchain": 1}, 0.02, {})}
+    )
+    assert monitor.get_nodes(["hello-world"]) == ["a:4000"]
+
+    # ...and re-admit them once it is half-open
+    monitor._breaker._cooldown = 0
+    monitor.load_table(table)
+    assert monitor.get_nodes(["hello-world"]) == ["b:4000", "a:4000"]
+    assert "b:4000" not in monitor._breaker
+
+
+def test_ejection_summary_is_flushed() -> None:
+    monitor = NodeMonitor([])
+    table: NodeTable = {
+        f"10.0.0.{i}:4000": ([{"id": "hello-world"}], {"offchain": 0}, 0.02, {})
+        for i in range(8)
+    }
+    monitor.load_table(table)
+    monitor._breaker = CircuitBreaker(threshold=1, window=60, cooldown=3600)
+    monitor._ejected = EventSummary("{count} nodes ejected", 0.05, sample_size=2)
+
+    with capture_logs() as logs:
+        for host in table:
+            monitor.report_failure(host, "failed", "client-1")
+        time.sleep(0.05)
+
+        # Summarized without waiting for another ejection
+        monitor.load_table({})
+    assert logs[-1]["event"] == "8 nodes ejected"
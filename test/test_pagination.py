@@ -0,0 +1,42 @@
+"""
+Unit tests for cursor pagination over cached node rankings.
+"""
+
+from pagination import CursorCache, decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip() -> None:
+    key = (7, "pending", ("hello-world", "llm"), ("region=eu",))
+    assert decode_cursor(encode_cursor(key, 3)) == (key, 3)
+    assert decode_cursor("not a cursor") is None
+    assert decode_cursor(encode_cursor(key, 3)[:-2]) is None
+
+
+def test_cursor_cache_pages_through_ranking() -> None:
+    cache = CursorCache(size=2, ttl=60)
+    rankings = 0
+
+    def ranking() -> list[str]:
+        nonlocal rankings
+        rankings += 1
+        return ["a", "b", "c"]
+
+    hosts, cursor = cache.first_page(1, "pending", ["x"], 0, 2, ranking)
+    assert hosts == ["a", "b"] and cursor is not None
+    assert cache.next_page(cursor, 2) == (["c"], None)
+
+    # Equal queries at the same version share a ranking
+    cache.first_page(1, "pending", ["x", "x"], 0, 2, ranking)
+    assert rankings == 1
+
+    # Least recently used rankings are evicted
+    cache.first_page(2, "pending", ["x"], 0, 2, ranking)
+    cache.first_page(3, "pending", ["x"], 0, 2, ranking)
+    assert cache.next_page(cursor, 2) is None
+
+
+def test_cursor_cache_expires_rankings() -> None:
+    cache = CursorCache(size=2, ttl=-1)
+    _, cursor = cache.first_page(1, "pending", ["x"], 0, 1, lambda: ["a", "b"])
+    assert cursor is not None
+    assert cache.next_page(cursor, 1) is None
@@ -0,0 +1,91 @@
+"""
+Unit tests for event loop lag sampling, stall capture and profiling.
+"""
+
+import asyncio
+import marshal
+import sys
+import threading
+import time
+
+import pytest
+
+import configs
+from metrics import LOOP_LAG_SECONDS, SLOW_CALLBACKS
+from profiler import LoopMonitor, collapse, sample_stacks
+
+
+def block_loop(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+def test_collapse() -> None:
+    stack = collapse(sys._getframe())
+    assert stack.split(";")[-1].startswith("test_collapse (test/test_profiler.py:")
+    assert collapse(None) == ""
+
+
+@pytest.mark.asyncio
+async def test_stalls_are_logged_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(configs, "SLOW_CALLBACK_THRESHOLD", 0.1)
+    loop_monitor = LoopMonitor()
+    task = asyncio.create_task(loop_monitor.run_forever())
+    await asyncio.sleep(0.1)
+    lag = LOOP_LAG_SECONDS.sum
+    stalls = SLOW_CALLBACKS.value
+
+    # The watchdog catches the loop while blocked, once per stall
+    block_loop(0.4)
+    await asyncio.sleep(0.1)
+    assert SLOW_CALLBACKS.value - stalls == 1
+    assert LOOP_LAG_SECONDS.sum - lag > 0.3
+
+    await loop_monitor.stop()
+    await task
+
+
+def test_check_captures_loop_stack(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(configs, "SLOW_CALLBACK_THRESHOLD", 0.1)
+    loop_monitor = LoopMonitor()
+    assert loop_monitor.check(0.0) == 0.0  # Not running
+
+    loop_monitor._thread_id = threading.get_ident()
+    loop_monitor._heartbeat = time.monotonic() - 1
+    stalls = SLOW_CALLBACKS.value
+    reported = loop_monitor.check(0.0)
+    assert reported == loop_monitor._heartbeat
+    assert loop_monitor.check(reported) == reported
+    assert SLOW_CALLBACKS.value - stalls == 1
+
+    # Disabled
+    monkeypatch.setattr(configs, "SLOW_CALLBACK_THRESHOLD", 0)
+    assert loop_monitor.check(0.0) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_profile_modes() -> None:
+    loop_monitor = LoopMonitor()
+
+    async def busy() -> None:
+        for _ in range(10):
+            block_loop(0.02)
+            await asyncio.sleep(0)
+
+    # Sampled stacks of the loop thread, in collapsed form
+    task = asyncio.create_task(busy())
+    stacks = (await loop_monitor.profile(0.3, "sample")).decode()
+    await task
+    lines = stacks.splitlines()
+    assert any(";block_loop (test/test_profiler.py:" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+    # Calls on the loop thread, in the pstats dump format
+    task = asyncio.create_task(busy())
+    stats = marshal.loads(await loop_monitor.profile(0.3, "cprofile"))
+    await task
+    assert any(function[2] == "block_loop" for function in stats)
+    assert not loop_monitor.capturing
+
+
+def test_sample_stacks_of_idle_thread() -> None:
+    assert sample_stacks(-1, 0.02) == ""
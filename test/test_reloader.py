@@ -0,0 +1,124 @@
+"""
+Unit tests for applying changes to the node list and settings while running.
+"""
+
+import importlib
+import os
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+
+import configs
+import reloader
+from monitor import NodeInfo, NodeMonitor
+from reloader import FileWatcher, reload_configs, track_configs
+
+
+@pytest.fixture
+def restore_configs() -> Iterator[None]:
+    environ = dict(os.environ)
+    settings = {name: value for name, value in vars(configs).items() if name.isupper()}
+    yield
+    reloader._file_keys.clear()
+    os.environ.clear()
+    os.environ.update(environ)
+    for name, value in settings.items():
+        setattr(configs, name, value)
+
+
+def test_reload_configs(tmp_path: Path, restore_configs: None) -> None:
+    path = tmp_path / ".env"
+    os.environ.pop("RATELIMIT_REQS_PER_MIN", None)
+    os.environ.pop("API_KEYS", None)
+    os.environ["SPILLOVER_DEPTH"] = str(configs.SPILLOVER_DEPTH)
+    path.write_text(
+        "RATELIMIT_REQS_PER_MIN=99\nAPI_KEYS=k3y=partner\nWORKERS=7\n"
+        f"REFRESH_INTERVAL={configs.REFRESH_INTERVAL}\nSPILLOVER_DEPTH=9\n"
+    )
+    assert sorted(reload_configs(str(path))) == ["API_KEYS", "RATELIMIT_REQS_PER_MIN"]
+    assert configs.RATELIMIT_REQS_PER_MIN == 99
+    assert configs.API_KEYS == {"k3y": "partner"}
+
+    # Other settings require a restart, and the environment takes precedence
+    assert configs.WORKERS != 7
+    assert configs.SPILLOVER_DEPTH != 9
+
+    # Invalid settings are rejected as a whole
+    path.write_text("RATELIMIT_REQS_PER_MIN=5\nPROBE_RATE=fast\n")
+    assert reload_configs(str(path)) == []
+    assert configs.RATELIMIT_REQS_PER_MIN == 99
+
+    # Removed settings revert to their default
+    path.write_text("")
+    assert sorted(reload_configs(str(path))) == ["API_KEYS", "RATELIMIT_REQS_PER_MIN"]
+    assert configs.RATELIMIT_REQS_PER_MIN == 10
+    assert configs.API_KEYS == {}
+
+
+def test_startup_reads_config_file(tmp_path: Path, restore_configs: None) -> None:
+    path = tmp_path / ".env"
+    path.write_text(
+        "REFRESH_INTERVAL=7\nAPI_KEYS=k3y=partner\nRATELIMIT_REQS_PER_MIN=99\n"
+    )
+    os.environ["CONFIG_PATH"] = str(path)
+    for key in ("REFRESH_INTERVAL", "DISCOVERY_INTERVAL", "API_KEYS"):
+        os.environ.pop(key, None)
+    os.environ["RATELIMIT_REQS_PER_MIN"] = "42"
+
+    # As on startup: the file applies where the environment doesn't
+    importlib.reload(configs)
+    assert configs.REFRESH_INTERVAL == 7
+    assert configs.API_KEYS == {"k3y": "partner"}
+    assert configs.RATELIMIT_REQS_PER_MIN == 42
+    track_configs(str(path))
+
+    # Reloads agree with startup
+    assert reload_configs(str(path)) == []
+    path.write_text("RATELIMIT_REQS_PER_MIN=99\n")
+    assert sorted(reload_configs(str(path))) == [
+        "API_KEYS",
+        "DISCOVERY_INTERVAL",
+        "REFRESH_INTERVAL",
+    ]
+    assert configs.REFRESH_INTERVAL == 30
+    assert configs.RATELIMIT_REQS_PER_MIN == 42
+
+
+def test_file_watcher(tmp_path: Path) -> None:
+    path = tmp_path / "ips.txt"
+    path.write_text("a:4000\n")
+    applied: list[Any] = []
+    watcher = FileWatcher()
+    watcher.watch(str(path), lambda: applied.append(path.read_text()))
+    assert watcher.check() == []
+
+    path.write_text("a:4000\nb:4000\n")
+    assert watcher.check() == [str(path)]
+    assert applied == ["a:4000\nb:4000\n"]
+    assert watcher.check() == []
+
+    # Missing files are not applied, until they are back
+    path.unlink()
+    assert watcher.check() == []
+    path.write_text("b:4000\n")
+    assert watcher.check() == [str(path)]
+
+
+def test_set_base_nodes_applies_diff() -> None:
+    monitor = NodeMonitor(["a:4000", "b:4000"], {"b:4000": {"region": "eu"}})
+    node = NodeInfo(available=True, containers=[{"id": "c"}], pending={})
+    monitor._publish("a:4000", node)
+    monitor._publish("b:4000", node)
+    monitor._set_live_nodes({"b:4000"}, {"b:4000": {"region": "us"}})
+
+    monitor.set_base_nodes({"a:4000": {"tier": "gpu"}, "c:4000": {}})
+
+    # Added nodes are probed right away, removed ones evicted unless live
+    assert "c:4000" in monitor._scheduler
+    assert monitor.get_nodes(["c"]) == ["a:4000", "b:4000"]
+    assert monitor._preferred({"tier": "gpu"}) == {"a:4000"}
+    assert monitor._preferred({"region": "us"}) == {"b:4000"}
+
+    monitor._set_live_nodes(set())
+    assert monitor.get_nodes(["c"]) == ["a:4000"]
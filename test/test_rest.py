@@ -0,0 +1,376 @@
+"""
+Unit tests for RESTServer routes, served from an in-memory NodeMonitor.
+"""
+
+from typing import Any
+
+import pytest
+from conftest import make_node
+
+import configs
+from cluster import Cluster
+from labels import RegionTable
+from metrics import RATE_LIMITED, REQUEST_SECONDS, SHED_REQUESTS
+from monitor import NodeMonitor
+from rest import ADMIN_REQS_PER_MIN, CLUSTER_STATE_REQS_PER_MIN, RESTServer
+
+
+def make_server() -> tuple[RESTServer, NodeMonitor]:
+    monitor = NodeMonitor(["a:4000", "b:4000"])
+    monitor._publish("a:4000", make_node(["hello-world"], 2))
+    monitor._publish("b:4000", make_node(["hello-world", "llm"], 0))
+    return RESTServer("4000", monitor), monitor
+
+
+@pytest.mark.asyncio
+async def test_ips() -> None:
+    server, _ = make_server()
+    client = server._app.test_client()
+
+    response = await client.get("/api/v1/ips?container=hello-world")
+    assert response.status_code == 200
+    assert await response.get_json() == ["b:4000", "a:4000"]
+
+    response = await client.get("/api/v1/ips")
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_etags() -> None:
+    server, monitor = make_server()
+    client = server._app.test_client()
+
+    response = await client.get("/api/v1/containers")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert await response.get_json() == [
+        {"id": "hello-world", "count": 2, "description": "hello-world container"},
+        {"id": "llm", "count": 1, "description": "llm container"},
+    ]
+
+    # Unchanged listing is answered with 304, even after unrelated state changes
+    monitor._publish("a:4000", make_node(["hello-world"], 5))
+    response = await client.get("/api/v1/containers", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # Changed listing is sent in full
+    monitor._publish("a:4000", None)
+    response = await client.get("/api/v1/containers", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    response = await client.get("/api/v1/ips?container=llm")
+    etag = response.headers["ETag"]
+    response = await client.get(
+        "/api/v1/ips?container=llm", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+
+@pytest.mark.asyncio
+async def test_ips_batch() -> None:
+    server, _ = make_server()
+    client = server._app.test_client()
+
+    response = await client.post(
+        "/api/v1/ips/batch",
+        json=[{"containers": ["hello-world"]}, {"containers": ["llm"], "n": 1}],
+    )
+    assert response.status_code == 200
+    assert await response.get_json() == [["b:4000", "a:4000"], ["b:4000"]]
+
+    response = await client.post("/api/v1/ips/batch", json=[{"n": 1}])
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_feedback_ejects_node(monkeypatch: pytest.MonkeyPatch) -> None:
+    server, _ = make_server()
+    client = server._app.test_client()
+
+    # Nodes are ejected on reports by distinct clients
+    for reason in ("failed", "slow", "failed"):
+        response = await client.post(
+            "/api/v1/feedback",
+            json={"node": "b:4000", "reason": reason},
+            scope_base={"client": ("10.0.0.1", 5000)},
+        )
+        assert await response.get_json() == {"ejected": False}
+    for address in ("10.0.0.2", "10.0.0.3"):
+        response = await client.post(
+            "/api/v1/feedback",
+            json={"node": "b:4000"},
+            scope_base={"client": (address, 5000)},
+        )
+    assert await response.get_json() == {"ejected": True}
+
+    response = await client.get("/api/v1/ips?container=hello-world")
+    assert await response.get_json() == ["a:4000"]
+
+    # Forged X-Forwarded-For headers don't make distinct clients...
+    for address in ("10.0.0.4", "10.0.0.5", "10.0.0.6"):
+        response = await client.post(
+            "/api/v1/feedback",
+            json={"node": "a:4000"},
+            headers={"X-Forwarded-For": address},
+        )
+    assert await response.get_json() == {"ejected": False}
+
+    # ...unless appended by a trusted proxy
+    monkeypatch.setattr(configs, "TRUSTED_PROXY_HOPS", 1)
+    for address in ("10.0.0.5", "10.0.0.6"):
+        response = await client.post(
+            "/api/v1/feedback",
+            json={"node": "a:4000"},
+            headers={"X-Forwarded-For": f"1.2.3.4, {address}"},
+        )
+    assert await response.get_json() == {"ejected": True}
+
+    response = await client.post(
+        "/api/v1/feedback", json={"node": "a:4000", "reason": "rude"}
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_metrics() -> None:
+    server, _ = make_server()
+    client = server._app.test_client()
+
+    requests = REQUEST_SECONDS.labels("/api/v1/ips").counts[:]
+    rejected = RATE_LIMITED.labels("/api/v1/ips").value
+    for _ in range(15):
+        await client.get("/api/v1/ips?container=hello-world")
+
+    # Requests beyond the rate limit are timed and counted as rejected
+    assert sum(REQUEST_SECONDS.labels("/api/v1/ips").counts) - sum(requests) == 15
+    assert RATE_LIMITED.labels("/api/v1/ips").value - rejected == 5
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    text = await response.get_data(as_text=True)
+
+    assert 'router_request_duration_seconds_count{route="/api/v1/ips"}' in text
+    assert "router_available_nodes 2" in text
+    assert 'router_get_nodes_duration_seconds_bucket{le="+Inf"}' in text
+
+
+@pytest.mark.asyncio
+async def test_ips_pagination(monkeypatch: pytest.MonkeyPatch) -> None:
+    server, monitor = make_server()
+    monitor._publish("c:4000", make_node(["hello-world"], 1))
+    client = server._app.test_client()
+
+    response = await client.get("/api/v1/ips?container=hello-world&n=2&paginate=true")
+    assert await response.get_json() == ["b:4000", "c:4000"]
+    cursor = response.headers["X-Next-Cursor"]
+
+    # Follow-up pages are served from the ranking of the first one
+    monitor._publish("d:4000", make_node(["hello-world"], 0))
+    response = await client.get(f"/api/v1/ips?cursor={cursor}&n=2")
+    assert await response.get_json() == ["a:4000"]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = await client.get("/api/v1/ips?cursor=invalid")
+    assert response.status_code == 410
+
+    response = await client.get(
+        "/api/v1/ips?container=hello-world&paginate=true&strategy=p2c"
+    )
+    assert response.status_code == 400
+
+    # Empty pages would never advance the cursor
+    response = await client.get(f"/api/v1/ips?cursor={cursor}&n=0")
+    assert response.status_code == 400
+
+    # Cursors can't be resolved across REST workers
+    monkeypatch.setattr(configs, "WORKERS", 2)
+    response = await client.get("/api/v1/ips?container=hello-world&paginate=true")
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_ips_stream() -> None:
+    server, _ = make_server()
+    client = server._app.test_client()
+
+    response = await client.get("/api/v1/ips/stream?container=hello-world")
+    assert response.status_code == 200
+    assert response.content_type == "application/x-ndjson"
+    assert await response.get_data(as_text=True) == '"b:4000"\n"a:4000"\n'
+
+
+@pytest.mark.asyncio
+async def test_overload_sheds_or_serves_stale() -> None:
+    server, _ = make_server()
+    client = server._app.test_client()
+    response = await client.get("/api/v1/ips?container=hello-world")
+    assert response.status_code == 200
+
+    server._admission.loop.lag = 10.0
+    shed = SHED_REQUESTS.labels("/api/v1/ips").value
+
+    # Memoized answers are served stale...
+    response = await client.get("/api/v1/ips?container=hello-world")
+    assert response.status_code == 200
+    assert "Warning" in response.headers
+    assert await response.get_json() == ["b:4000", "a:4000"]
+
+    # ...others are rejected
+    response = await client.get("/api/v1/ips?container=llm")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert SHED_REQUESTS.labels("/api/v1/ips").value - shed == 2
+
+    # Metrics are always served
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert server._admission.inflight == 0
+
+
+@pytest.mark.asyncio
+async def test_api_key_tiers(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setitem(configs.API_KEYS, "secret", "partner")
+    monkeypatch.setitem(configs.RATELIMIT_TIERS, "partner", 20)
+    server, _ = make_server()
+    client = server._app.test_client()
+
+    statuses = [
+        (
+            await client.get("/api/v1/containers", headers={"X-API-Key": "secret"})
+        ).status_code
+        for _ in range(25)
+    ]
+    assert statuses.count(429) == 5
+
+    # Anonymous clients have their own, default limit
+    response = await client.get("/api/v1/containers")
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_nodes_stream_rejects_when_full(monkeypatch: pytest.MonkeyPatch) -> None:
+    server, _ = make_server()
+    client = server._app.test_client()
+    monkeypatch.setattr(server._subscriptions, "subscribers", 10**6)
+
+    response = await client.get("/api/v1/nodes/stream")
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+
+@pytest.mark.asyncio
+async def test_ips_prefers_labels(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(configs, "SPILLOVER_DEPTH", 10)
+    server, monitor = make_server()
+    monitor._set_labels("a:4000", {"region": "eu"})
+    server._regions = RegionTable({"10.1.0.0/16": "eu"})
+    client = server._app.test_client()
+
+    response = await client.get("/api/v1/ips?container=hello-world&n=1")
+    assert await response.get_json() == ["b:4000"]
+
+    response = await client.get(
+        "/api/v1/ips?container=hello-world&n=1&prefer=region=eu"
+    )
+    assert await response.get_json() == ["a:4000"]
+
+    # Clients are mapped to their region by address
+    response = await client.get(
+        "/api/v1/ips?container=hello-world&n=1",
+        scope_base={"client": ("10.1.2.3", 5000)},
+    )
+    assert await response.get_json() == ["a:4000"]
+
+
+@pytest.mark.asyncio
+async def test_cluster_state_is_rate_limited() -> None:
+    monitor = NodeMonitor(["a:4000"])
+    cluster = Cluster(monitor, "http://a:4000", ["http://a:4000", "http://b:4000"])
+    server = RESTServer("4000", monitor, cluster=cluster)
+    client = server._app.test_client()
+
+    # Peers sync with overloaded routers...
+    server._admission.loop.lag = 10.0
+    for _ in range(CLUSTER_STATE_REQS_PER_MIN):
+        response = await client.get("/api/v1/cluster/state")
+        assert response.status_code == 200
+
+    # ...but not faster than they need to
+    response = await client.get("/api/v1/cluster/state")
+    assert response.status_code == 429
+
+
+@pytest.mark.asyncio
+async def test_admin_profile(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(configs, "ADMIN_API_KEYS", ["admin-key"])
+    server, _ = make_server()
+    client = server._app.test_client()
+    admin = {"X-API-Key": "admin-key"}
+
+    response = await client.get("/admin/profile?seconds=0.1")
+    assert response.status_code == 403
+    response = await client.get("/admin/profile?seconds=0", headers=admin)
+    assert response.status_code == 400
+    response = await client.get("/admin/profile?mode=perf", headers=admin)
+    assert response.status_code == 400
+
+    response = await client.get("/admin/profile?seconds=0.1", headers=admin)
+    assert response.status_code == 200
+    assert "router.folded" in response.headers["Content-Disposition"]
+    stacks = (await response.get_data(as_text=True)).splitlines()
+    assert stacks and all(line.rsplit(" ", 1)[1].isdigit() for line in stacks)
+
+    # Admins can profile an overloaded router
+    server._admission.loop.lag = 10.0
+    response = await client.get(
+        "/admin/profile?seconds=0.1&mode=cprofile", headers=admin
+    )
+    assert response.status_code == 200
+    assert response.content_type == "application/octet-stream"
+
+    # Guessing admin keys is rate limited per address, forged or not
+    address = {"client": ("10.0.0.9", 5000)}
+    for i in range(ADMIN_REQS_PER_MIN):
+        response = await client.get(
+            "/admin/profile",
+            headers={"X-API-Key": "guess", "X-Forwarded-For": f"10.0.1.{i}"},
+            scope_base=address,
+        )
+        assert response.status_code == 403
+    response = await client.get(
+        "/admin/profile",
+        headers={"X-API-Key": "guess", "X-Forwarded-For": "10.0.2.1"},
+        scope_base=address,
+    )
+    assert response.status_code == 429
+
+
+@pytest.mark.asyncio
+async def test_ips_memoized_without_inflight_jobs(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    server, monitor = make_server()
+    client = server._app.test_client()
+    calls = []
+    get_nodes = monitor.get_nodes
+
+    def counted(*args: Any, **kwargs: Any) -> list[str]:
+        calls.append(args)
+        return get_nodes(*args, **kwargs)
+
+    monkeypatch.setattr(monitor, "get_nodes", counted)
+
+    # Answers don't bump the snapshot version...
+    version = monitor.snapshot().version
+    for _ in range(3):
+        await client.get("/api/v1/ips?container=hello-world")
+    assert monitor.snapshot().version == version
+    assert len(calls) == 3
+
+    # ...and are reused while in-flight jobs don't affect ranking
+    monkeypatch.setattr(configs, "INFLIGHT_HALF_LIFE", 0)
+    for _ in range(3):
+        response = await client.get("/api/v1/ips?container=hello-world")
+        assert await response.get_json() == ["b:4000", "a:4000"]
+    assert len(calls) == 4
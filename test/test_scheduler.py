@@ -0,0 +1,55 @@
+"""
+Unit tests for the per-node probe scheduler.
+"""
+
+import asyncio
+
+import pytest
+
+from configs import MAX_PROBE_BACKOFF, MIN_PROBE_INTERVAL, REFRESH_INTERVAL
+from scheduler import PROBE_JITTER, ProbeScheduler, probe_delay
+
+
+def test_probe_delay() -> None:
+    low, high = 1 - PROBE_JITTER, 1 + PROBE_JITTER
+
+    # Idle nodes are probed every refresh interval, busy nodes more often
+    assert low * REFRESH_INTERVAL <= probe_delay(True, 0, 0) <= high * REFRESH_INTERVAL
+    assert probe_delay(True, 1000, 0) <= high * MIN_PROBE_INTERVAL
+
+    # Unreachable nodes back off exponentially, up to a cap
+    assert probe_delay(False, 0, 3) >= low * min(
+        4 * REFRESH_INTERVAL, MAX_PROBE_BACKOFF
+    )
+    assert probe_delay(False, 0, 100) <= high * MAX_PROBE_BACKOFF
+
+
+@pytest.mark.asyncio
+async def test_scheduler_hands_out_due_hosts_in_order() -> None:
+    scheduler = ProbeScheduler()
+    scheduler.schedule("b", 0.02)
+    scheduler.schedule("a", 0.01)
+    scheduler.schedule("c", 10)
+
+    assert await scheduler.next(timeout=1) == "a"
+    assert await scheduler.next(timeout=1) == "b"
+
+    # Hosts handed out are no longer scheduled
+    assert "a" not in scheduler
+    assert await scheduler.next(timeout=0.01) is None
+
+    # Rescheduling replaces the previous timer, removal cancels it
+    scheduler.schedule("c", 0)
+    assert await scheduler.next(timeout=1) == "c"
+    scheduler.schedule("d", 0)
+    scheduler.remove("d")
+    assert await scheduler.next(timeout=0.01) is None
+
+
+@pytest.mark.asyncio
+async def test_scheduler_wakes_up_on_schedule() -> None:
+    scheduler = ProbeScheduler()
+    waiter = asyncio.create_task(scheduler.next(timeout=5))
+    await asyncio.sleep(0.01)
+    scheduler.schedule("a", 0)
+    assert await asyncio.wait_for(waiter, timeout=1) == "a"
@@ -0,0 +1,105 @@
+"""
+Unit tests for sharing node state between processes through shared memory.
+"""
+
+from typing import Iterator
+
+import pytest
+
+from metrics import LOOP_LAG_SECONDS, PROBES, MetricsExport, export, render
+from monitor import NodeMonitor, NodeTable
+from shared import METRICS_MEMORY_SIZE, SharedMetrics, SharedTable
+
+
+@pytest.fixture
+def table() -> Iterator[SharedTable[NodeTable]]:
+    table: SharedTable[NodeTable] = SharedTable(size=64 * 1024)
+    yield table
+    table.close(unlink=True)
+
+
+def test_shared_table_generations(table: SharedTable[NodeTable]) -> None:
+    reader: SharedTable[NodeTable] = SharedTable(table.name)
+    try:
+        assert reader.read() is None
+
+        first: NodeTable = {
+            "a:4000": ([{"id": "hello-world"}], {"offchain": 1}, 0.02, {})
+        }
+        assert table.write(first)
+        assert reader.read() == first
+        assert reader.read() is None
+
+        # Readers always see the latest generation, across both slots
+        for pending in range(5):
+            table.write(
+                {"a:4000": ([{"id": "hello-world"}], {"offchain": pending}, 0.02, {})}
+            )
+        assert reader.read() == {
+            "a:4000": ([{"id": "hello-world"}], {"offchain": 4}, 0.02, {})
+        }
+    finally:
+        reader.close()
+
+
+def test_shared_table_rejects_oversized_tables(table: SharedTable[NodeTable]) -> None:
+    oversized: NodeTable = {
+        f"10.0.0.{i}:4000": ([{"id": f"{i}" * 1024}], {}, 0.02, {}) for i in range(64)
+    }
+    assert not table.write(oversized)
+
+
+def test_load_table_mirrors_monitor() -> None:
+    source = NodeMonitor([])
+    source.load_table(
+        {
+            "a:4000": ([{"id": "hello-world"}], {"offchain": 2}, 0.02, {}),
+            "b:4000": (
+                [{"id": "hello-world"}, {"id": "llm"}],
+                {"offchain": 0},
+                0.02,
+                {},
+            ),
+        }
+    )
+    mirror = NodeMonitor([])
+    mirror.load_table(source.export_table())
+    assert mirror.get_nodes(["hello-world"]) == ["b:4000", "a:4000"]
+
+    # Removed nodes are evicted, unchanged nodes don't bump the version
+    version = mirror.snapshot().version
+    mirror.load_table(
+        {"b:4000": ([{"id": "hello-world"}, {"id": "llm"}], {"offchain": 0}, 0.02, {})}
+    )
+    assert mirror.get_nodes(["hello-world"]) == ["b:4000"]
+    assert mirror.snapshot().version == version + 1
+
+
+def test_shared_metrics_cover_all_processes() -> None:
+    tables: list[SharedTable[MetricsExport]] = [
+        SharedTable(size=METRICS_MEMORY_SIZE) for _ in range(2)
+    ]
+    poller = SharedMetrics(tables, 0)
+    worker = SharedMetrics(
+        [SharedTable(table.name, METRICS_MEMORY_SIZE) for table in tables], 1
+    )
+    try:
+        # The worker renders the poller's last published metrics, and its own
+        PROBES.inc()
+        LOOP_LAG_SECONDS.observe(0.002)
+        probes = PROBES.value
+        assert tables[0].write(export())
+        PROBES.inc(10)
+
+        text = render(worker.collect())
+        assert f'router_probes_total{{process="poller"}} {probes}' in text
+        assert f'router_probes_total{{process="worker-1"}} {probes + 10}' in text
+        assert 'router_loop_lag_seconds_count{process="poller"}' in text
+
+        # Until the poller publishes again, its last metrics are kept
+        assert f'router_probes_total{{process="poller"}} {probes}' in render(
+            worker.collect()
+        )
+    finally:
+        worker.close()
+        poller.close(unlink=True)
@@ -0,0 +1,81 @@
+"""
+Unit tests for streaming the node table to subscribers as Server-Sent Events.
+"""
+
+import json
+from typing import Any
+
+import pytest
+from conftest import make_node
+
+import subscription
+from monitor import NodeMonitor
+from subscription import Subscriptions
+
+
+def parse_event(raw: bytes) -> tuple[str, str, Any]:
+    fields = dict(line.split(": ", 1) for line in raw.decode().strip().split("\n"))
+    return fields["id"], fields["event"], json.loads(fields["data"])
+
+
+@pytest.mark.asyncio
+async def test_snapshot_then_deltas(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(subscription, "SUBSCRIBE_INTERVAL", 0)
+    monitor = NodeMonitor(["a:4000", "b:4000"])
+    monitor._publish("a:4000", make_node(["hello-world"], 1))
+    subscriptions = Subscriptions(monitor)
+
+    events = subscriptions.stream()
+    event_id, event, data = parse_event(await events.__anext__())
+    assert subscriptions.subscribers == 1
+    assert event == "snapshot"
+    assert data["nodes"] == {
+        "a:4000": {
+            "containers": [
+                {"id": "hello-world", "description": "hello-world container"}
+            ],
+            "pending": {"offchain": 1},
+            "latency": 1.0,
+            "labels": {},
+        }
+    }
+
+    monitor._publish("b:4000", make_node(["llm"], 0))
+    monitor._publish("a:4000", None)
+    next_id, event, data = parse_event(await events.__anext__())
+    assert event == "delta"
+    assert data["seq"] > int(event_id.split(":")[1])
+    assert data["nodes"]["a:4000"] is None
+    assert data["nodes"]["b:4000"]["containers"] == [
+        {"id": "llm", "description": "llm container"}
+    ]
+
+    # Resuming from the last event ID only sends changes since
+    monitor._publish("b:4000", make_node(["llm"], 3))
+    resumed = subscriptions.stream(next_id)
+    _, event, data = parse_event(await resumed.__anext__())
+    assert event == "delta"
+    assert list(data["nodes"]) == ["b:4000"]
+
+    # Changes to a node's containers alone are streamed as deltas too
+    monitor._publish("b:4000", make_node(["llm", "hello-world"], 3))
+    _, event, data = parse_event(await resumed.__anext__())
+    assert event == "delta"
+    assert data["nodes"]["b:4000"]["containers"] == [
+        {"id": "llm", "description": "llm container"},
+        {"id": "hello-world", "description": "hello-world container"},
+    ]
+
+    await events.aclose()
+    await resumed.aclose()
+    assert subscriptions.subscribers == 0
+
+
+def test_resume_requires_same_epoch() -> None:
+    subscriptions = Subscriptions(NodeMonitor([]))
+    epoch = subscriptions._epoch
+    assert subscriptions._resume_from(f"{epoch}:12") == 12
+    assert subscriptions._resume_from("0123456789abcdef:12") is None
+    assert subscriptions._resume_from(f"{epoch}:") is None
+    assert subscriptions._resume_from("garbage") is None
+    assert subscriptions._resume_from(None) is None